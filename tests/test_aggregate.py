@@ -0,0 +1,130 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import os
+import unittest
+
+import numpy as np
+
+from zupport.core import ParameterList, finish_queues
+from zupport.plugins.zarcgis.tools import aggregate
+from zupport.raster import ArrayRaster
+
+DEFINITION = os.path.join(os.path.dirname(aggregate.__file__), 
+                          'aggregate.yaml')
+
+class Environment(object):
+    pass
+
+class Geoprocessor(object):
+    ''' Keeps the environment settings of a tool run and the rasters
+    pyramids are built for.'''
+
+    def __init__(self):
+        self.env = Environment()
+        self.pyramids = []
+
+    def BuildPyramids_management(self, path):
+        self.pyramids.append(path)
+
+    def CalculateStatistics_management(self, path):
+        pass
+
+class AggregateSA(object):
+    ''' Stands for aggregate_with_nodata and keeps its calls.'''
+
+    def __init__(self):
+        self.calls = []
+        self.saved = []
+
+    def __call__(self, raster, factor, method, nodata):
+        self.calls.append((raster, factor, method, nodata))
+        return self
+
+    def save(self, path):
+        self.saved.append(path)
+
+class AggregateTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.source = np.array([[1, 2, 3, 4],
+                                [5, 6, 7, 8],
+                                [-1, -1, 1, -1],
+                                [-1, -1, -1, -1]], dtype='int16')
+        self.outputs = {}
+        self.tool = aggregate.setup(ParameterList('Aggregate', DEFINITION))
+        # No license is checked out and no geoprocessor acquired
+        self.tool.extensions = []
+        self.tool._gp = Geoprocessor()
+        self.tool.open_raster = lambda path: ArrayRaster(self.source, -1)
+        self.tool.create_raster = self.create_raster
+        self.aggregate_with_nodata = aggregate.aggregate_with_nodata
+        aggregate.aggregate_with_nodata = AggregateSA()
+        for name, value in [('input_raster', 'in.tif'), 
+                            ('output_raster', 'out.tif'),
+                            ('raster_type', 'GeoTIFF'), ('pyramids', 'NONE'),
+                            ('debug', False)]:
+            self.tool.parameters.set_parameter_value(name, value)
+
+    def tearDown(self):
+        aggregate.aggregate_with_nodata = self.aggregate_with_nodata
+
+    def create_raster(self, path, like, pixel_type, nodata):
+        output = ArrayRaster(np.zeros(like.shape, pixel_type), nodata, 
+                             like.geotransform, like.projection, path)
+        self.outputs[path] = output
+        return output
+
+class TestAggregate(AggregateTestCase):
+
+    def test_numpy_path(self):
+        # The default mask 'PATH' is a placeholder for no mask
+        self.assertEqual(self.tool.get_parameter('mask'), 'PATH')
+        self.tool.run()
+        self.assertEqual(aggregate.aggregate_with_nodata.calls, [])
+        self.assertFalse(hasattr(self.tool.gp.env, 'mask'))
+        output = self.outputs['out.tif']
+        nodata = output.nodata
+        np.testing.assert_array_equal(output.array, 
+                                      np.array([[14, 22], [nodata, 1]]))
+
+    def test_placeholders(self):
+        for mask in ['', '#', 'None']:
+            self.tool.parameters.set_parameter_value('mask', mask)
+            self.tool.run()
+        self.assertEqual(aggregate.aggregate_with_nodata.calls, [])
+
+    def test_mask(self):
+        self.tool.parameters.set_parameter_value('mask', 'mask.tif')
+        self.tool.run()
+        self.assertEqual(self.tool.gp.env.mask, 'mask.tif')
+        self.assertEqual(aggregate.aggregate_with_nodata.calls, 
+                         [('in.tif', 2, 'SUM', True)])
+        self.assertEqual(aggregate.aggregate_with_nodata.saved, ['out.tif'])
+        self.assertEqual(self.outputs, {})
+
+class TestPyramids(AggregateTestCase):
+
+    def setUp(self):
+        AggregateTestCase.setUp(self)
+        self.tool.parameters.set_parameter_value('pyramids', 'DEFERRED')
+
+    def test_own_queue(self):
+        self.tool.run()
+        self.assertEqual(self.tool.gp.pyramids, ['out.tif'])
+
+    def test_shared_queue(self):
+        queues = {}
+        self.tool.post_queues = queues
+        self.tool.run()
+        self.tool.parameters.set_parameter_value('output_raster', 'out2.tif')
+        self.tool.run()
+        # Pyramids are built once the owner of the queues finishes them
+        self.assertEqual(len(queues), 1)
+        self.assertEqual(self.tool.gp.pyramids, [])
+        finish_queues(queues)
+        self.assertEqual(self.tool.gp.pyramids, ['out.tif', 'out2.tif'])
+        self.assertEqual(queues, {})
+
+if __name__ == '__main__':
+    unittest.main()
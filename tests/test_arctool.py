@@ -0,0 +1,89 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import os
+import unittest
+
+from zupport.core import ParameterList
+from zupport.plugins.zarcgis.tools import aggregate
+
+DEFINITION = os.path.join(os.path.dirname(aggregate.__file__), 
+                          'aggregate.yaml')
+
+class ParameterInfo(object):
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+class Geoprocessor(object):
+    ''' Provides the parameters of a tool called from ArcGIS.'''
+
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.calls = 0
+
+    def GetArgumentCount(self):
+        self.calls += 1
+        return len(self.parameters)
+
+    def GetParameter(self, index):
+        return self.parameters[index].value
+
+    def GetParameterInfo(self):
+        return self.parameters
+
+    def CheckExtension(self, extension):
+        return 'Unavailable'
+
+class TestUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.tool = aggregate.setup(ParameterList('Aggregate', DEFINITION))
+        self.tool.extensions = []
+
+    def test_no_geoprocessor(self):
+        self.tool.update(True, False, 'in.tif', debug=False)
+        self.assertTrue(self.tool.ready)
+        self.assertEqual(self.tool._gp, None)
+        # Neither do the loggers of the tool
+        self.assertEqual(self.tool.logger._gp, None)
+        self.assertEqual(self.tool.log._gp, None)
+        self.assertEqual(self.tool.get_parameter('input_raster'), 'in.tif')
+        self.assertEqual(self.tool.logger.debugging, False)
+
+    def test_gp_parameters(self):
+        self.tool.update(True, False, 'in.tif', 'out.tif')
+        gp = Geoprocessor([ParameterInfo('input_raster', 'gp_in.tif'), 
+                           ParameterInfo('output_raster', 'gp_out.tif'),
+                           ParameterInfo('cell_factor', '4')])
+        self.tool._gp = gp
+        self.tool.validate_parameters()
+        self.assertEqual(self.tool.get_parameter('input_raster'), 
+                         'gp_in.tif')
+        self.assertEqual(self.tool.get_parameter('cell_factor'), 4)
+        # Last parameter toggles debugging
+        self.assertEqual(gp.LogHistory, True)
+        self.tool.validate_parameters()
+        self.assertEqual(gp.calls, 1)
+
+    def test_batch(self):
+        self.tool.update(False, False, 'in.tif', 'out.tif', debug=False)
+        gp = Geoprocessor([ParameterInfo('input_raster', 'gp_in.tif')])
+        self.tool._gp = gp
+        self.tool.validate_parameters()
+        self.assertEqual(gp.calls, 0)
+        self.assertEqual(self.tool.get_parameter('input_raster'), 'in.tif')
+        self.assertEqual(gp.LogHistory, False)
+
+    def test_missing_license(self):
+        self.tool.update(False, False, 'in.tif', 'out.tif', debug=False)
+        self.tool.extensions = ['zupport_missing']
+        self.tool._gp = Geoprocessor([])
+        self.tool.validate_parameters()
+        self.assertFalse(self.tool.ready)
+        # The tool does not run and the error does not stop the batch
+        self.assertEqual(self.tool.run(), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from zupport.plugins.zarcgis.attributes import (AttributeProfile,
+                                                AttributeProfileCache,
+                                                dataset_fingerprint)
+
+class Row(object):
+
+    def __init__(self, **values):
+        self.values = values
+
+    def getValue(self, field):
+        return self.values[field]
+
+ROWS = [Row(LAND=1, SOIL='a'), Row(LAND=2, SOIL='a'), Row(LAND=1, SOIL='a'),
+        Row(LAND=3, SOIL='b'), Row(LAND=None, SOIL='b')]
+
+class TestAttributeProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.profile = AttributeProfile.from_rows(iter(ROWS),
+                                                  ['LAND', 'SOIL'])
+
+    def test_counts(self):
+        self.assertEqual(self.profile.nrows, 5)
+        self.assertEqual(self.profile.counts('LAND'),
+                         {1: 2, 2: 1, 3: 1, None: 1})
+        self.assertEqual(self.profile.counts('SOIL'), {'a': 3, 'b': 2})
+        self.assertEqual(self.profile.uniques('LAND'), [1, 2, 3])
+
+    def test_select(self):
+        self.assertEqual(self.profile.select({'SOIL': ['a'], 'LAND': None}),
+                         {(1, 'a'): 2, (2, 'a'): 1})
+        # Combinations with NULL values are not selected
+        self.assertEqual(self.profile.select({'SOIL': ['b']}),
+                         {(3, 'b'): 1})
+
+    def test_dict(self):
+        profile = AttributeProfile.from_dict(self.profile.to_dict())
+        self.assertEqual(profile.fields, self.profile.fields)
+        self.assertEqual(profile.combinations, self.profile.combinations)
+
+class TestAttributeProfileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.cache = AttributeProfileCache(os.path.join(self.workspace,
+                                                        'cache'))
+        self.dataset = os.path.join(self.workspace, 'parcels.shp')
+        self.write(self.dataset, 'shp')
+        self.write(os.path.join(self.workspace, 'parcels.dbf'), 'dbf')
+        self.profile = AttributeProfile.from_rows(ROWS, ['LAND', 'SOIL'])
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def write(self, path, data, mtime=1000000000):
+        stream = open(path, 'w')
+        stream.write(data)
+        stream.close()
+        os.utime(path, (mtime, mtime))
+
+    def test_put_get(self):
+        self.assertEqual(self.cache.get(self.dataset, ['LAND', 'SOIL']), None)
+        self.cache.put(self.dataset, self.profile)
+        profile = self.cache.get(self.dataset, ['LAND', 'SOIL'])
+        self.assertEqual(profile.combinations, self.profile.combinations)
+        # Entries are per field list
+        self.assertEqual(self.cache.get(self.dataset, ['LAND']), None)
+
+    def test_changed_dataset(self):
+        self.cache.put(self.dataset, self.profile)
+        # Attributes of a shapefile are in the .dbf file
+        self.write(os.path.join(self.workspace, 'parcels.dbf'), 'dbf2',
+                   1000000100)
+        self.assertEqual(self.cache.get(self.dataset, ['LAND', 'SOIL']), None)
+
+    def test_clear(self):
+        self.cache.put(self.dataset, self.profile)
+        self.cache.clear()
+        self.assertEqual(self.cache.get(self.dataset, ['LAND', 'SOIL']), None)
+
+    def test_geodatabase(self):
+        gdb = os.path.join(self.workspace, 'data.gdb')
+        os.mkdir(gdb)
+        self.write(os.path.join(gdb, 'a0000001.gdbtable'), 'table')
+        self.assertEqual(dataset_fingerprint(os.path.join(gdb, 'parcels')),
+                         dataset_fingerprint(gdb))
+        self.assertEqual(dataset_fingerprint(os.path.join(self.workspace,
+                                                          'missing')), None)
+
+    def test_in_memory(self):
+        self.cache.put('in_memory/parcels', self.profile)
+        self.assertEqual(self.cache.get('in_memory/parcels',
+                                        ['LAND', 'SOIL']), None)
+
+if __name__ == '__main__':
+    unittest.main()
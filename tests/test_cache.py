@@ -0,0 +1,46 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from zupport.utilities.cache import replace_file
+
+class TestReplaceFile(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.source = os.path.join(self.workspace, 'entry.tmp')
+        self.target = os.path.join(self.workspace, 'entry')
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def write(self, path, data):
+        stream = open(path, 'w')
+        stream.write(data)
+        stream.close()
+
+    def test_new_target(self):
+        self.write(self.source, 'new')
+        replace_file(self.source, self.target)
+        self.assertFalse(os.path.exists(self.source))
+        self.assertEqual(open(self.target).read(), 'new')
+
+    @unittest.skipIf(os.name == 'nt', 'open files can not be replaced')
+    def test_open_target(self):
+        self.write(self.target, 'old')
+        self.write(self.source, 'new')
+        reader = open(self.target)
+        try:
+            replace_file(self.source, self.target)
+            # A reader that opened the entry before still reads it whole
+            self.assertEqual(reader.read(), 'old')
+        finally:
+            reader.close()
+        self.assertEqual(open(self.target).read(), 'new')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from zupport import plugins
+from zupport.discovery import PluginManifest, module_all, module_service
+
+DEFINITION = '''---
+Eggs:
+- name: 'value'
+  value: 1
+'''
+
+class TestPluginManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.plugins_path = os.path.join(self.workspace, 'plugins')
+        self.cache = os.path.join(self.workspace, 'cache')
+        tools = os.path.join(self.plugins_path, 'spam', 'tools')
+        os.makedirs(tools)
+        os.makedirs(os.path.join(self.plugins_path, 'bare'))
+        self.write('spam/__init__.py', '')
+        self.write('bare/__init__.py', '')
+        self.write('spam/tools/__init__.py', 
+                   "__all__ = ['eggs', 'ham', 'nodefinition']\n")
+        # Importing the tool modules would fail
+        self.write('spam/tools/eggs.py', "import missing\n\n"
+                   "def service():\n    return 'fried_eggs'\n")
+        self.write('spam/tools/eggs.yaml', DEFINITION)
+        self.write('spam/tools/ham.py', "import missing\n\n"
+                   "def service():\n    return 'h' + 'am'\n")
+        self.write('spam/tools/ham.yaml', DEFINITION)
+        self.write('spam/tools/nodefinition.py', '')
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def write(self, name, text):
+        stream = open(os.path.join(self.plugins_path, name), 'w')
+        stream.write(text)
+        stream.close()
+
+    def manifest(self):
+        return PluginManifest(self.plugins_path, path=self.cache)
+
+    def test_sources(self):
+        tools = os.path.join(self.plugins_path, 'spam', 'tools')
+        self.assertEqual(module_all(os.path.join(tools, '__init__.py')),
+                         ['eggs', 'ham', 'nodefinition'])
+        self.assertEqual(module_service(os.path.join(tools, 'eggs.py')),
+                         'fried_eggs')
+        self.assertEqual(module_service(os.path.join(tools, 'ham.py')), None)
+
+    def test_plugins(self):
+        plugins = self.manifest().plugins()
+        self.assertEqual([plugin for plugin, entries in plugins], 
+                         ['bare', 'spam'])
+        tools = self.manifest().tools()
+        self.assertEqual(sorted(tools.keys()), ['fried_eggs', 'ham'])
+        entry = tools['fried_eggs']
+        self.assertEqual(entry['module'], 'spam.tools.eggs')
+        self.assertEqual(entry['plugin'], 'spam')
+        self.assertTrue(entry['definition'].endswith('eggs.yaml'))
+
+    def test_cached(self):
+        self.manifest().plugins()
+        manifest = self.manifest()
+        self.assertEqual(manifest._read(), manifest.plugins())
+
+    def test_changed_sources(self):
+        self.manifest().plugins()
+        self.write('spam/tools/ham.py', "def service():\n"
+                   "    return 'smoked_ham'\n")
+        manifest = self.manifest()
+        self.assertEqual(manifest._read(), None)
+        self.assertTrue('smoked_ham' in manifest.tools())
+
+    def test_new_plugin(self):
+        self.manifest().plugins()
+        os.makedirs(os.path.join(self.plugins_path, 'new'))
+        self.write('new/__init__.py', '')
+        plugins = self.manifest().plugins()
+        self.assertEqual([plugin for plugin, entries in plugins], 
+                         ['bare', 'new', 'spam'])
+
+    def test_zupport_plugins(self):
+        manifest = PluginManifest(os.path.dirname(plugins.__file__), 
+                                  path=self.cache)
+        entry = manifest.tools()['aggregate']
+        self.assertEqual(entry['plugin'], 'zarcgis')
+        self.assertTrue(os.path.exists(entry['definition']))
+
+if __name__ == '__main__':
+    unittest.main()
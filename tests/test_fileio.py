@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from zupport.plugins.fileio import AsciiGrid, GridCache, ParseError
+
+HEADER = ('ncols 4\nnrows 3\nxllcenter 10.5\nyllcenter 20.5\ncellsize 1\n'
+          'NODATA_value -9999\n')
+
+class TestAsciiGrid(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.matrix = np.arange(12, dtype=float).reshape(3, 4)
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def write(self, text, name='grid.asc'):
+        path = os.path.join(self.workspace, name)
+        grid = open(path, 'w')
+        grid.write(text)
+        grid.close()
+        return path
+
+    def test_header(self):
+        grid = AsciiGrid(self.write(HEADER + '0 1 2 3\n4 5 6 7\n8 9 10 11\n'))
+        self.assertEqual(grid.shape, (3, 4))
+        self.assertEqual(grid.xllcorner, 10.0)
+        self.assertEqual(grid.yllcorner, 20.0)
+        self.assertEqual(grid.nodata, -9999.0)
+
+    def test_read(self):
+        grid = AsciiGrid(self.write(HEADER + '0 1 2 3\n4 5 6 7\n8 9 10 11\n'))
+        for block_rows in [1, 2, 256]:
+            np.testing.assert_array_equal(grid.read(block_rows=block_rows),
+                                          self.matrix)
+
+    def test_wrapped_rows(self):
+        grid = AsciiGrid(self.write(HEADER + '0 1 2\n3 4 5 6 7\n8\n9 10 11\n'))
+        blocks = list(grid.iter_blocks(block_rows=1))
+        rows = 0
+        for row, block in blocks:
+            self.assertEqual(row, rows)
+            rows += block.shape[0]
+        np.testing.assert_array_equal(np.vstack([block for row, block in
+                                                 blocks]), self.matrix)
+
+    def test_memmap(self):
+        grid = AsciiGrid(self.write(HEADER + '0 1 2 3\n4 5 6 7\n8 9 10 11\n'))
+        matrix = grid.to_memmap(os.path.join(self.workspace, 'grid.mmap'),
+                                block_rows=2)
+        self.assertTrue(isinstance(matrix, np.memmap))
+        np.testing.assert_array_equal(matrix, self.matrix)
+
+    def test_missing_values(self):
+        grid = AsciiGrid(self.write(HEADER + '0 1 2 3\n4 5 6 7\n'))
+        self.assertRaises(ParseError, grid.read)
+
+    def test_missing_header_keyword(self):
+        path = self.write('ncols 4\nnrows 3\n0 1 2 3\n')
+        self.assertRaises(ParseError, AsciiGrid, path)
+
+class TestGridCache(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.cache = GridCache(os.path.join(self.workspace, 'cache'))
+        self.filename = os.path.join(self.workspace, 'grid.asc')
+        self.write('0 1 2 3\n4 5 6 7\n8 9 10 11\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def write(self, data):
+        grid = open(self.filename, 'w')
+        grid.write(HEADER + data)
+        grid.close()
+
+    def test_load(self):
+        self.assertEqual(self.cache.get(self.filename), None)
+        matrix, header = self.cache.load(self.filename)
+        self.assertEqual(header['ncols'], 4)
+        np.testing.assert_array_equal(matrix,
+                                      np.arange(12.0).reshape(3, 4))
+        matrix, header = self.cache.get(self.filename)
+        self.assertTrue(isinstance(matrix, np.memmap))
+
+    def test_changed_source(self):
+        self.cache.load(self.filename)
+        self.write('0 1 2 3\n4 5 6 7\n8 9 10 110\n')
+        self.assertEqual(self.cache.get(self.filename), None)
+        matrix, header = self.cache.load(self.filename)
+        self.assertEqual(matrix[2, 3], 110)
+
+    def test_dtype_entries(self):
+        self.cache.load(self.filename, dtype=int)
+        self.assertEqual(self.cache.get(self.filename, dtype=float), None)
+        matrix, header = self.cache.get(self.filename, dtype=int)
+        self.assertEqual(matrix.dtype, np.dtype(int))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from zupport.journal import RunJournal
+
+class TestRunJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.journals = os.path.join(self.workspace, 'journals')
+        self.outputs = [os.path.join(self.workspace, 'out%s.tif' % i) for i 
+                        in range(3)]
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def journal(self, resume=True, key_items=('factor=2',), **kwargs):
+        return RunJournal('spam', key_items, resume=resume, 
+                          path=self.journals, **kwargs)
+
+    def write(self, path, data='data'):
+        output = open(path, 'w')
+        output.write(data)
+        output.close()
+
+    def interrupted_run(self):
+        # The first output is completed, the second one only begun
+        journal = self.journal(resume=False)
+        for output in self.outputs[:2]:
+            journal.begin([output])
+            self.write(output)
+        journal.complete(self.outputs[:1])
+        journal.close()
+
+    def test_resume(self):
+        self.interrupted_run()
+        journal = self.journal()
+        self.assertEqual(journal.pending(self.outputs), self.outputs[1:])
+        # The partial output is removed
+        self.assertFalse(os.path.exists(self.outputs[1]))
+        self.assertTrue(os.path.exists(self.outputs[0]))
+
+    def test_no_resume(self):
+        self.interrupted_run()
+        journal = self.journal(resume=False)
+        self.assertEqual(journal.pending(self.outputs), self.outputs)
+
+    def test_other_parameters(self):
+        self.interrupted_run()
+        journal = self.journal(key_items=('factor=5',))
+        self.assertEqual(journal.pending(self.outputs), self.outputs)
+
+    def test_missing_output(self):
+        self.interrupted_run()
+        os.remove(self.outputs[0])
+        self.assertEqual(self.journal().pending(self.outputs), self.outputs)
+
+    def test_unit_parameters(self):
+        journal = self.journal()
+        self.write(self.outputs[0])
+        journal.complete(self.outputs[:1], parameters=['SUM'])
+        self.assertTrue(journal.is_complete(self.outputs[0], ['SUM']))
+        self.assertFalse(journal.is_complete(self.outputs[0], ['MEAN']))
+
+    def test_verify(self):
+        self.interrupted_run()
+        self.write(self.outputs[0], 'changed')
+        self.assertEqual(self.journal().pending(self.outputs[:1]), [])
+        self.assertEqual(self.journal(verify=True).pending(self.outputs[:1]),
+                         self.outputs[:1])
+
+    def test_incomplete_record(self):
+        self.interrupted_run()
+        journal = self.journal()
+        # A record cut short by a killed process is ignored
+        stream = open(journal.filename, 'a')
+        stream.write('done\t%s' % self.outputs[2])
+        stream.close()
+        self.assertEqual(self.journal().pending(self.outputs), 
+                         self.outputs[1:])
+
+    def test_remove(self):
+        self.interrupted_run()
+        removed = []
+        journal = self.journal(remove=removed.append)
+        journal.pending(self.outputs)
+        self.assertEqual(removed, [self.outputs[1]])
+
+    def test_finish(self):
+        self.interrupted_run()
+        journal = self.journal()
+        journal.finish()
+        self.assertFalse(os.path.exists(journal.filename))
+        self.assertEqual(self.journal().pending(self.outputs[:1]), 
+                         self.outputs[:1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from zupport.core import ParameterList
+from zupport.manifest import JobManifest
+
+class Job(object):
+
+    def __init__(self, inputs, outputs, **parameters):
+        self.service = 'spam'
+        self.tool = True
+        self.parameters = ParameterList('Spam')
+        for name in sorted(parameters):
+            self.parameters.add(name, parameters[name])
+        self.inputs = inputs
+        self.outputs = outputs
+
+class TestJobManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.manifest = JobManifest(os.path.join(self.workspace, 'jobs'))
+        self.input = self.path('in.tif')
+        self.output = self.path('out.tif')
+        self.write(self.input, 'input')
+        self.write(self.output, 'output')
+        self.job = Job([self.input], [self.output], factor=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def path(self, name):
+        return os.path.join(self.workspace, name)
+
+    def write(self, path, data, mtime=None):
+        stream = open(path, 'w')
+        stream.write(data)
+        stream.close()
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def test_current(self):
+        self.assertFalse(self.manifest.is_current(self.job))
+        self.assertTrue(self.manifest.record(self.job))
+        self.assertTrue(self.manifest.is_current(self.job))
+        job = Job([self.input], [self.output], factor=2)
+        self.assertTrue(self.manifest.is_current(job))
+
+    def test_changed_parameters(self):
+        self.manifest.record(self.job)
+        job = Job([self.input], [self.output], factor=5)
+        self.assertFalse(self.manifest.is_current(job))
+
+    def test_changed_input(self):
+        self.manifest.record(self.job)
+        self.write(self.input, 'changed input')
+        self.assertFalse(self.manifest.is_current(self.job))
+
+    def test_changed_output(self):
+        self.manifest.record(self.job)
+        os.remove(self.output)
+        self.assertFalse(self.manifest.is_current(self.job))
+        self.write(self.output, 'other output')
+        self.assertFalse(self.manifest.is_current(self.job))
+
+    def test_checksum(self):
+        manifest = JobManifest(self.path('checksums'), checksum=True)
+        mtime = int(time.time()) - 60
+        self.write(self.input, 'input', mtime)
+        manifest.record(self.job)
+        self.manifest.record(self.job)
+        # Same size and modification time, different content
+        self.write(self.input, 'INPUT', mtime)
+        self.assertTrue(self.manifest.is_current(self.job))
+        self.assertFalse(manifest.is_current(self.job))
+
+    def test_no_outputs(self):
+        job = Job([self.input], [])
+        self.assertFalse(self.manifest.record(job))
+        self.assertFalse(self.manifest.is_current(job))
+
+    def test_stale_outputs(self):
+        # Outputs older than the run are not recorded
+        self.write(self.output, 'output', time.time() - 60)
+        self.assertFalse(self.manifest.record(self.job, since=time.time()))
+        self.assertFalse(self.manifest.is_current(self.job))
+
+    def test_forget(self):
+        self.manifest.record(self.job)
+        self.manifest.forget(self.job)
+        self.assertFalse(self.manifest.is_current(self.job))
+        self.manifest.record(self.job)
+        self.manifest.clear()
+        self.assertFalse(self.manifest.is_current(self.job))
+
+if __name__ == '__main__':
+    unittest.main()
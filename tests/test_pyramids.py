@@ -0,0 +1,93 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import threading
+import unittest
+
+from zupport.plugins.zarcgis import pyramids
+from zupport.plugins.zarcgis.pyramids import PyramidQueue
+
+class Geoprocessor(object):
+    ''' Keeps the rasters pyramids and statistics are built for.'''
+
+    def __init__(self):
+        self.pyramids = []
+        self.statistics = []
+
+    def BuildPyramids_management(self, path):
+        self.pyramids.append(path)
+
+    def CalculateStatistics_management(self, path):
+        self.statistics.append(path)
+
+class TestPyramidQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.gp = Geoprocessor()
+        self.overviews = []
+        self.thread = threading.currentThread()
+        # Background workers build with build_overviews, GDAL is not needed
+        self.gdal = pyramids.GDAL_AVAILABLE, pyramids.build_overviews
+        pyramids.GDAL_AVAILABLE = True
+        pyramids.build_overviews = self.build_overviews
+
+    def tearDown(self):
+        pyramids.GDAL_AVAILABLE, pyramids.build_overviews = self.gdal
+
+    def build_overviews(self, path, statistics=True):
+        if path.startswith('fail'):
+            raise IOError('Cannot build overviews for %s' % path)
+        self.overviews.append((path, threading.currentThread()))
+
+    def test_immediate(self):
+        queue = PyramidQueue(self.gp, 'immediate')
+        queue.add('a.tif')
+        self.assertEqual(self.gp.pyramids, ['a.tif'])
+        self.assertEqual(self.gp.statistics, ['a.tif'])
+        self.assertEqual(queue.finish(), 1)
+
+    def test_deferred(self):
+        queue = PyramidQueue(self.gp, 'DEFERRED', statistics=False)
+        queue.add('a.tif')
+        queue.add('b.img')
+        self.assertEqual(self.gp.pyramids, [])
+        self.assertEqual(queue.finish(), 2)
+        self.assertEqual(self.gp.pyramids, ['a.tif', 'b.img'])
+        self.assertEqual(self.gp.statistics, [])
+
+    def test_none(self):
+        queue = PyramidQueue(self.gp, 'NONE')
+        queue.add('a.tif')
+        self.assertEqual(queue.finish(), 0)
+        self.assertEqual(self.gp.pyramids, [])
+
+    def test_background(self):
+        queue = PyramidQueue(self.gp, None, workers=2)
+        self.assertEqual(queue.mode, 'BACKGROUND')
+        queue.add('a.tif')
+        queue.add('b.img')
+        # Rasters GDAL cannot write are built with the geoprocessor at the end
+        queue.add('c.gdb/raster')
+        queue.add('d.grd')
+        self.assertEqual(self.gp.pyramids, [])
+        self.assertEqual(queue.finish(), 4)
+        self.assertEqual(sorted([path for path, thread in self.overviews]),
+                         ['a.tif', 'b.img'])
+        for path, thread in self.overviews:
+            self.assertTrue(thread is not self.thread)
+        self.assertEqual(self.gp.pyramids, ['c.gdb/raster', 'd.grd'])
+
+    def test_background_error(self):
+        queue = PyramidQueue(self.gp, 'BACKGROUND')
+        queue.add('fail.tif')
+        queue.add('a.tif')
+        self.assertRaises(IOError, queue.finish)
+        self.assertEqual([path for path, thread in self.overviews], ['a.tif'])
+        # The error is reported once
+        self.assertEqual(queue.finish(), 1)
+
+    def test_unknown_mode(self):
+        self.assertRaises(ValueError, PyramidQueue, self.gp, 'LATER')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import unittest
+
+import numpy as np
+
+from zupport.raster import BinaryOp, Expression, Operand, compile_group
+
+ND = -9999
+
+class TestNoDataRules(unittest.TestCase):
+    """Each column of the arrays is one NoData case: both operands have data,
+    only the left one, only the right one and neither.
+    """
+
+    def setUp(self):
+        self.left = np.array([[6, 6, ND, ND]], dtype='int32')
+        self.right = np.array([[3, ND, 3, ND]], dtype='int32')
+
+    def evaluate(self, operator, rule):
+        expression = compile_group(operator, [ND, ND], ND, 'float32', rule)
+        return expression(self.left, self.right)
+
+    def assertResult(self, operator, rule, expected):
+        np.testing.assert_array_almost_equal(self.evaluate(operator, rule),
+                                             np.array([expected]))
+
+    def test_skip_sum(self):
+        self.assertResult('SUM', 'SKIP', [9, 6, 3, ND])
+
+    def test_skip_subtraction(self):
+        self.assertResult('SUBTRACTION', 'SKIP', [3, 6, -3, ND])
+
+    def test_skip_multiplication(self):
+        self.assertResult('MULTIPLICATION', 'SKIP', [18, 6, 3, ND])
+
+    def test_skip_division(self):
+        self.assertResult('DIVISION', 'SKIP', [2, 6, ND, ND])
+
+    def test_propagate(self):
+        self.assertResult('SUM', 'PROPAGATE', [9, ND, ND, ND])
+        self.assertResult('SUBTRACTION', 'PROPAGATE', [3, ND, ND, ND])
+        self.assertResult('MULTIPLICATION', 'PROPAGATE', [18, ND, ND, ND])
+        self.assertResult('DIVISION', 'PROPAGATE', [2, ND, ND, ND])
+
+class TestExpression(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.arrays = [random.randint(1, 9, (5, 6)).astype('float32')
+                       for i in range(4)]
+        for i, array in enumerate(self.arrays):
+            array[random.rand(5, 6) < 0.3] = ND
+
+    def reference(self, operator):
+        # Fold from the left replacing NoData operands as LEFT_IDENTITIES
+        # tells
+        ufunc = {'SUM': np.add, 'SUBTRACTION': np.subtract,
+                 'MULTIPLICATION': np.multiply,
+                 'DIVISION': np.divide}[operator]
+        result = np.empty(self.arrays[0].shape)
+        for index in np.ndindex(result.shape):
+            value = self.arrays[0][index]
+            if value == ND:
+                value = None
+            for array in self.arrays[1:]:
+                if array[index] == ND:
+                    continue
+                if value is None:
+                    if operator == 'DIVISION':
+                        continue
+                    value = ufunc({'SUM': 0, 'SUBTRACTION': 0,
+                                   'MULTIPLICATION': 1}[operator],
+                                  float(array[index]))
+                else:
+                    value = ufunc(value, float(array[index]))
+            result[index] = ND if value is None else value
+        return result
+
+    def test_group_skip(self):
+        for operator in ['SUM', 'SUBTRACTION', 'MULTIPLICATION', 'DIVISION']:
+            expression = compile_group(operator, [ND] * 4, ND, 'float64',
+                                       'SKIP')
+            np.testing.assert_array_almost_equal(expression(*self.arrays),
+                                                 self.reference(operator))
+
+    def test_right_subtree(self):
+        # a - (b + c), the right subtree is evaluated into its own buffers
+        tree = BinaryOp('SUBTRACTION', Operand(0, ND),
+                        BinaryOp('SUM', Operand(1, ND), Operand(2, ND)))
+        expression = Expression(tree, 'PROPAGATE', ND, 'float64')
+        a, b, c = self.arrays[:3]
+        expected = a.astype(float) - (b.astype(float) + c)
+        expected[(a == ND) | (b == ND) | (c == ND)] = ND
+        np.testing.assert_array_almost_equal(expression(a, b, c), expected)
+
+    def test_buffers_reused(self):
+        expression = compile_group('SUM', [ND] * 4, ND, 'float64')
+        first = expression(*self.arrays)
+        # A smaller block uses views of the same buffers
+        small = expression(*[array[:2, :3] for array in self.arrays])
+        np.testing.assert_array_almost_equal(small, first[:2, :3])
+
+    def test_unknown_operator(self):
+        self.assertRaises(ValueError, compile_group, 'POWER', [ND, ND])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import unittest
+
+import numpy as np
+
+from zupport.raster import (ArrayRaster, BlockEngine, RasterError, Window,
+                            aggregate, aggregate_pyramid, aggregate_raster,
+                            aggregate_template, block_shape, block_windows,
+                            ra_sigmoidal, to_pixel_type)
+
+class TestBlocks(unittest.TestCase):
+
+    def test_block_shape_rows(self):
+        # 10 bytes per row, 35 bytes fit 3 rows
+        self.assertEqual(block_shape((100, 10), 1, 35), (3, 10))
+        self.assertEqual(block_shape((2, 10), 1, 35), (2, 10))
+
+    def test_block_shape_natural(self):
+        self.assertEqual(block_shape((100, 10), 1, 75, natural=(4, 10)),
+                         (4, 10))
+
+    def test_block_shape_split_rows(self):
+        self.assertEqual(block_shape((100, 10), 2, 9), (1, 4))
+
+    def test_block_windows(self):
+        windows = list(block_windows((5, 4), (2, 3)))
+        self.assertEqual(windows[0], Window(0, 0, 2, 3))
+        self.assertEqual(windows[1], Window(0, 3, 2, 1))
+        self.assertEqual(windows[-1], Window(4, 3, 1, 1))
+        self.assertEqual(sum([window.nrows * window.ncols for window in
+                              windows]), 20)
+
+    def test_to_pixel_type(self):
+        self.assertEqual(to_pixel_type(np.dtype('int16')), 'int16')
+        self.assertRaises(RasterError, to_pixel_type, 'FOO')
+
+class TestBlockEngine(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.a = random.rand(50, 7)
+        self.b = random.rand(50, 7)
+
+    def test_run(self):
+        out = ArrayRaster(np.zeros((50, 7)))
+        engine = BlockEngine([ArrayRaster(self.a), ArrayRaster(self.b)], out,
+                             mem_max=2000)
+        self.assertTrue(engine.block[0] < 50)
+        nblocks = engine.run(lambda a, b: a * b)
+        self.assertEqual(nblocks, len(list(engine.windows())))
+        np.testing.assert_array_equal(out.array, self.a * self.b)
+
+    def test_several_outputs(self):
+        outputs = [ArrayRaster(np.zeros((50, 7))) for i in range(2)]
+        BlockEngine([ArrayRaster(self.a)], outputs,
+                    mem_max=2000).run(lambda a: [a + 1, a - 1])
+        np.testing.assert_array_equal(outputs[0].array, self.a + 1)
+        np.testing.assert_array_equal(outputs[1].array, self.a - 1)
+
+    def test_shape_mismatch(self):
+        self.assertRaises(RasterError, BlockEngine, [ArrayRaster(self.a)],
+                          ArrayRaster(np.zeros((5, 7))))
+
+class TestAggregateRaster(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.array = random.rand(50, 13)
+        self.array[random.rand(50, 13) < 0.3] = -9999
+        self.raster = ArrayRaster(self.array, nodata=-9999)
+
+    def output(self, factor):
+        template = aggregate_template(self.raster, factor)
+        return ArrayRaster(np.zeros(template.shape), nodata=-1,
+                           geotransform=template.geotransform)
+
+    def test_template(self):
+        template = aggregate_template(self.raster, 4)
+        self.assertEqual(template.shape, (13, 4))
+        self.assertEqual(template.geotransform, (0, 4, 0, 0, 0, -4))
+
+    def test_blocks(self):
+        # Blockwise result is the same as aggregating the whole array
+        output = self.output(3)
+        nblocks = aggregate_raster(self.raster, output, 3, 'MEAN',
+                                   mem_max=1000)
+        self.assertTrue(nblocks > 1)
+        expected = aggregate(self.array, 3, 'MEAN', -9999, -1, 'float64')[0]
+        np.testing.assert_array_almost_equal(output.array, expected)
+
+    def test_pyramid(self):
+        factors = [2, 3, 4, 6, 12]
+        for method in ['SUM', 'MAX', 'MEDIAN']:
+            outputs = dict([(factor, self.output(factor)) for factor in
+                            factors])
+            aggregate_pyramid(self.raster, outputs, method, mem_max=3000)
+            for factor in factors:
+                expected = self.output(factor)
+                aggregate_raster(self.raster, expected, factor, method,
+                                 mem_max=3000)
+                np.testing.assert_array_almost_equal(outputs[factor].array,
+                                                     expected.array)
+
+class TestRASigmoidal(unittest.TestCase):
+
+    def test_nodata(self):
+        array1 = np.array([[-1.0, 0.0, 1.0, -9999]])
+        array2 = np.array([[2.0, 2.0, -1, 2.0]])
+        out = ra_sigmoidal(array1, array2, -9999, -1, -3, asym=0.5)
+        self.assertEqual(out[0, 2], -3)
+        self.assertEqual(out[0, 3], -3)
+        # xmid is 0, the left side has asymptote asym
+        self.assertAlmostEqual(out[0, 1], 2 * 0.5 / 2)
+        self.assertTrue(0 < out[0, 0] < out[0, 1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import unittest
+
+import numpy as np
+
+from zupport.core import Manager, Tool
+from zupport.raster import ArrayRaster, LazyRaster, RasterGraph, Window
+
+class Outputs(object):
+    ''' Keeps the rasters written by a graph or a tool by path.'''
+
+    def __init__(self):
+        self.rasters = {}
+
+    def create(self, path, like, pixel_type, nodata):
+        output = ArrayRaster(np.zeros(like.shape, pixel_type), nodata,
+                             like.geotransform, like.projection, path)
+        self.rasters[path] = output
+        return output
+
+class Source(ArrayRaster):
+    ''' Raster that fails to be read once it is closed.'''
+
+    closed = False
+
+    def read_window(self, window):
+        if self.closed:
+            raise IOError('Reading a closed raster')
+        return ArrayRaster.read_window(self, window)
+
+    def close(self):
+        self.closed = True
+
+class TestRasterGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.array = np.arange(20, dtype='float32').reshape(4, 5)
+        self.outputs = Outputs()
+        self.graph = RasterGraph()
+        self.calls = 0
+
+    def double(self, array):
+        self.calls += 1
+        return array * 2
+
+    def defer(self, path):
+        raster = LazyRaster(self.double, [Source(self.array)],
+                            ArrayRaster(self.array), 'float32', -1)
+        self.graph.defer(path, raster, self.outputs.create)
+        return raster
+
+    def test_lazy_raster(self):
+        raster = self.defer('a.tif')
+        window = Window(1, 0, 2, 5)
+        raster.read_window(window)
+        block = raster.read_window(window)
+        # The latest window is computed only once
+        self.assertEqual(self.calls, 1)
+        np.testing.assert_array_equal(block, self.array[1:3] * 2)
+
+    def test_consumed(self):
+        self.defer('a.tif')
+        self.defer('b.tif')
+        self.assertTrue('a.tif' in self.graph)
+        self.assertEqual(self.graph.pending(), ['a.tif', 'b.tif'])
+        self.graph.get('a.tif')
+        self.assertEqual(self.graph.materialize(), ['b.tif'])
+        self.assertEqual(self.graph.pending(), [])
+        np.testing.assert_array_equal(self.outputs.rasters['b.tif'].array,
+                                      self.array * 2)
+
+    def test_materialize_paths(self):
+        self.defer('a.tif')
+        self.defer('b.tif')
+        self.assertEqual(self.graph.materialize(paths=['b.tif']), ['b.tif'])
+        self.assertEqual(self.graph.pending(), ['a.tif'])
+        # Written rasters are read from disk
+        self.assertFalse('b.tif' in self.graph)
+
+    def test_materialize_consumed(self):
+        raster = self.defer('a.tif')
+        self.graph.get('a.tif').close()
+        self.assertEqual(self.graph.materialize(), [])
+        self.assertEqual(self.graph.materialize(paths=['a.tif']), ['a.tif'])
+        np.testing.assert_array_equal(self.outputs.rasters['a.tif'].array,
+                                      self.array * 2)
+        self.assertEqual(len(self.graph), 0)
+        self.assertTrue(raster.sources[0].closed)
+
+    def test_several_readers(self):
+        raster = self.defer('a.tif')
+        first = self.graph.get('a.tif')
+        first.close()
+        # The graph still holds a reference
+        second = self.graph.get('a.tif')
+        window = Window(0, 0, 4, 5)
+        np.testing.assert_array_equal(second.read_window(window),
+                                      self.array * 2)
+        self.graph.close()
+        self.assertFalse(raster.sources[0].closed)
+        second.close()
+        self.assertTrue(raster.sources[0].closed)
+
+class Job(object):
+    ''' Runs a tool in a chain.'''
+
+    def __init__(self, tool, predesessor=None):
+        self.tool = tool
+        self.service = tool.service
+        self.successor = None
+        if predesessor is not None:
+            predesessor.successor = self
+
+    def run(self):
+        return self.tool.run()
+
+class Producer(Tool):
+    ''' Defers its output if run in a chain.'''
+
+    def __init__(self, array, path, outputs):
+        Tool.__init__(self, None, 'producer')
+        self.array = array
+        self.path = path
+        self.outputs = outputs
+
+    def run(self):
+        raster = LazyRaster(lambda array: array + 1, [Source(self.array)],
+                            ArrayRaster(self.array), 'float32', -1)
+        self.graph.defer(self.path, raster, self.outputs.create)
+        return True
+
+class Consumer(Tool):
+    ''' Reads its input by path (through the graph) or from the outputs 
+    written so far (like a tool listing a workspace).'''
+
+    def __init__(self, path, outputs, reads_deferred):
+        Tool.__init__(self, None, 'consumer')
+        self.path = path
+        self.outputs = outputs
+        self.reads_deferred = reads_deferred
+        self.result = None
+
+    def run(self):
+        if self.reads_deferred and self.path in self.graph:
+            raster = self.graph.get(self.path)
+        else:
+            raster = self.outputs.rasters[self.path]
+        self.result = np.array(raster.read_window(Window(0, 0, 
+                                                         *raster.shape)))
+        raster.close()
+        return True
+
+class TestChain(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = Manager()
+        self.array = np.arange(6, dtype='float32').reshape(2, 3)
+        self.outputs = Outputs()
+
+    def run_chain(self, *reads_deferred):
+        producer = Job(Producer(self.array, 'a.tif', self.outputs))
+        consumers = []
+        for reads in reads_deferred:
+            consumers.append(Job(Consumer('a.tif', self.outputs, reads), 
+                                 (consumers or [producer])[-1]))
+        self.manager.run_chain(producer)
+        self.assertEqual(producer.tool.graph, None)
+        return [consumer.tool.result for consumer in consumers]
+
+    def test_deferred(self):
+        result, = self.run_chain(True)
+        np.testing.assert_array_equal(result, self.array + 1)
+        # The intermediate raster was consumed and never written
+        self.assertEqual(self.outputs.rasters, {})
+
+    def test_written_before_consumer(self):
+        result, = self.run_chain(False)
+        np.testing.assert_array_equal(result, self.array + 1)
+        self.assertEqual(self.outputs.rasters.keys(), ['a.tif'])
+
+    def test_read_twice(self):
+        # The first reader closing the deferred raster does not close it for
+        # the second one
+        for reads_deferred in [(True, True), (True, False, True)]:
+            self.outputs.rasters = {}
+            for result in self.run_chain(*reads_deferred):
+                np.testing.assert_array_equal(result, self.array + 1)
+
+if __name__ == '__main__':
+    unittest.main()
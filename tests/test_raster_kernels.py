@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import unittest
+
+import numpy as np
+
+from zupport.raster import (ArrayRaster, aggregate, aggregate_pixel_type,
+                            class_split, group_reduce, set_null_nonpositive,
+                            unique_values)
+
+ND = -9999
+
+class TestGroupReduce(unittest.TestCase):
+
+    def test_position_of_nodata(self):
+        # The same values give the same result whichever raster has NoData,
+        # unless the operator depends on the order of the operands
+        a = np.array([[8, ND, 8]], dtype='float32')
+        b = np.array([[2, 2, ND]], dtype='float32')
+        c = np.array([[ND, 4, 4]], dtype='float32')
+        np.testing.assert_array_equal(
+            group_reduce([a, b, c], [ND] * 3, 'SUM', ND),
+            np.array([[10, 6, 12]]))
+        np.testing.assert_array_equal(
+            group_reduce([a, b, c], [ND] * 3, 'SUBTRACTION', ND),
+            np.array([[6, -6, 4]]))
+        np.testing.assert_array_equal(
+            group_reduce([a, b, c], [ND] * 3, 'DIVISION', ND, rule='SKIP'),
+            np.array([[4, ND, 2]]))
+
+    def test_default_rules(self):
+        # A NoData operand gives NoData for MULTIPLICATION and DIVISION, like
+        # the old tools replacing NoData with 0
+        a = np.array([[8, ND, 8]], dtype='float32')
+        b = np.array([[2, 2, ND]], dtype='float32')
+        for operator in ['MULTIPLICATION', 'DIVISION']:
+            self.assertEqual(
+                group_reduce([a, b], [ND] * 2, operator, ND)[0, 1:].tolist(),
+                [ND, ND])
+        np.testing.assert_array_equal(
+            group_reduce([a, b], [ND] * 2, 'SUBTRACTION', ND),
+            np.array([[6, -2, 8]]))
+
+    def test_all_nodata(self):
+        a = np.array([[ND, 1]], dtype='int16')
+        b = np.array([[ND, ND]], dtype='int16')
+        np.testing.assert_array_equal(
+            group_reduce([a, b], [ND, ND], 'MULTIPLICATION', -1, rule='SKIP'),
+            np.array([[-1, 1]]))
+
+    def test_no_nodata_value(self):
+        a = np.array([[1, 2]], dtype='uint8')
+        b = np.array([[3, 0]], dtype='uint8')
+        np.testing.assert_array_equal(
+            group_reduce([a, b], [None, None], 'SUBTRACTION', ND),
+            np.array([[-2, 2]]))
+
+class TestSetNullNonpositive(unittest.TestCase):
+
+    def test_set_null(self):
+        array = np.array([[-1.5, 0, 0.5, ND]], dtype='float32')
+        result = set_null_nonpositive(array, ND)
+        self.assertTrue(result is array)
+        np.testing.assert_array_equal(result, np.array([[ND, ND, 0.5, ND]]))
+
+class TestClassSplit(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.reference = random.randint(0, 6, (8, 9)).astype('int16')
+        self.reference[0, :3] = ND
+        self.values = random.rand(8, 9).astype('float32')
+        self.values[1, :3] = -1
+
+    def test_split(self):
+        classes = [1, 2, 5, 7]
+        outs = class_split(self.reference, self.values, classes, ND, -1, -2)
+        self.assertEqual(len(outs), len(classes))
+        for value, out in zip(classes, outs):
+            # Same as SetNull(reference != value, values)
+            expected = np.where((self.reference == value) &
+                                (self.values != -1), self.values, -2)
+            np.testing.assert_array_equal(out, expected)
+            self.assertEqual(out.dtype, self.values.dtype)
+
+    def test_no_classes(self):
+        self.assertEqual(class_split(self.reference, self.values, [], ND, -1,
+                                     -2), [])
+
+    def test_unique_values(self):
+        raster = ArrayRaster(self.reference, nodata=ND)
+        np.testing.assert_array_equal(unique_values(raster, mem_max=100),
+                                      np.arange(6))
+
+class TestAggregate(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.array = random.randint(0, 9, (7, 8)).astype('int16')
+        self.array[random.rand(7, 8) < 0.2] = ND
+        self.array[:3, :3] = ND
+
+    def reference(self, factor, method):
+        # Aggregate each cell from its source cells with data
+        func = {'SUM': np.sum, 'MEAN': np.mean, 'MIN': np.min,
+                'MAX': np.max, 'MEDIAN': np.median}[method]
+        rows = -(-self.array.shape[0] // factor)
+        cols = -(-self.array.shape[1] // factor)
+        result = np.empty((rows, cols))
+        for i, j in np.ndindex(rows, cols):
+            cells = self.array[i * factor:(i + 1) * factor,
+                               j * factor:(j + 1) * factor]
+            cells = cells[cells != ND]
+            result[i, j] = func(cells) if cells.size else -1
+        return result
+
+    def test_methods(self):
+        for method in ['SUM', 'MEAN', 'MIN', 'MAX', 'MEDIAN']:
+            for factor in [2, 3]:
+                result, counts = aggregate(self.array, factor, method, ND, -1,
+                                           'float64')
+                np.testing.assert_array_almost_equal(
+                    result, self.reference(factor, method))
+
+    def test_counts(self):
+        result, counts = aggregate(self.array, 3, 'SUM', ND, -1)
+        self.assertEqual(counts.shape, (3, 3))
+        self.assertEqual(counts[0, 0], 0)
+        self.assertEqual(result[0, 0], -1)
+        self.assertEqual(counts.sum(), (self.array != ND).sum())
+        # Partial cells at the edges
+        self.assertEqual(counts[2, 2], (self.array[6:, 6:] != ND).sum())
+
+    def test_pixel_type(self):
+        self.assertEqual(aggregate_pixel_type('int16', 'SUM'), 'int32')
+        self.assertEqual(aggregate_pixel_type('int16', 'MEAN'), 'float32')
+        result, counts = aggregate(self.array, 2, 'MAX', ND, ND)
+        self.assertEqual(str(result.dtype),
+                         aggregate_pixel_type('int16', 'MAX'))
+
+    def test_unknown_method(self):
+        self.assertRaises(ValueError, aggregate, self.array, 2, 'MODE')
+
+if __name__ == '__main__':
+    unittest.main()
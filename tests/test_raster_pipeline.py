@@ -0,0 +1,48 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import unittest
+
+import numpy as np
+
+from zupport.raster import ArrayRaster, BlockEngine, BlockPipeline
+
+class TestBlockPipeline(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.a = random.rand(200, 9)
+        self.b = random.rand(200, 9)
+
+    def run_engine(self, engine, func, **kwargs):
+        out = ArrayRaster(np.zeros((200, 9)))
+        nblocks = engine([ArrayRaster(self.a), ArrayRaster(self.b)], out,
+                         mem_max=20000, **kwargs).run(func)
+        return nblocks, out.array
+
+    def test_same_as_engine(self):
+        func = lambda a, b: np.sqrt(a) + b
+        expected = self.run_engine(BlockEngine, func)[1]
+        for workers in [1, 3]:
+            nblocks, result = self.run_engine(BlockPipeline, func,
+                                              workers=workers, prefetch=1)
+            self.assertTrue(nblocks > 1)
+            np.testing.assert_array_equal(result, expected)
+
+    def test_blocks_in_flight(self):
+        inputs = [ArrayRaster(self.a)]
+        output = ArrayRaster(np.zeros((200, 9)))
+        engine = BlockEngine(inputs, output, mem_max=20000)
+        pipeline = BlockPipeline(inputs, output, mem_max=20000, workers=2,
+                                 prefetch=2)
+        self.assertEqual(pipeline.in_flight, 6)
+        self.assertTrue(pipeline.block[0] < engine.block[0])
+
+    def test_error(self):
+        def fail(a, b):
+            raise ZeroDivisionError('block failed')
+        self.assertRaises(ZeroDivisionError, self.run_engine, BlockPipeline,
+                          fail, workers=2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import unittest
+
+from zope.interface import Interface
+
+from zupport import registry
+
+class ISpam(Interface):
+    pass
+
+class TestRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.loaded = []
+
+    def tearDown(self):
+        for plugin in registry.getPlugins(ISpam):
+            registry.unprovidePlugin(ISpam, plugin)
+
+    def loader(self, name, plugin):
+        def load():
+            self.loaded.append(name)
+            registry.provideUtility(name.upper(), ISpam, name=name, 
+                                    providedby=plugin)
+        return load
+
+    def test_indices(self):
+        registry.provideUtility('A', ISpam, name='a', providedby='p1')
+        registry.provideUtility('B', ISpam, name='b', providedby='p2')
+        self.assertEqual(registry.getNamesFor(ISpam), {'a': 'p1', 'b': 'p2'})
+        self.assertEqual(registry.getNamesFor(ISpam, providedby='p2'), 
+                         {'b': 'p2'})
+        self.assertEqual(registry.queryUtility(ISpam, 'a'), ('p1', 'A'))
+        self.assertEqual(registry.queryUtility(ISpam, 'c', 0), (None, 0))
+        self.assertEqual(sorted(registry.getUtilitiesFor(ISpam)), 
+                         [(u'p1::a', 'A'), (u'p2::b', 'B')])
+
+    def test_deferred(self):
+        registry.provideDeferredUtility(self.loader('a', 'p1'), ISpam, 
+                                        name='a', providedby='p1')
+        registry.provideDeferredUtility(self.loader('b', 'p1'), ISpam, 
+                                        name='b', providedby='p1')
+        # Listing the names does not create the utilities
+        self.assertEqual(sorted(registry.getNamesFor(ISpam, 'p1')), 
+                         ['a', 'b'])
+        self.assertEqual(self.loaded, [])
+        # Only the requested utility is created, and only once
+        self.assertEqual(registry.queryUtility(ISpam, 'b'), ('p1', 'B'))
+        registry.queryUtility(ISpam, 'b')
+        self.assertEqual(self.loaded, ['b'])
+        self.assertEqual(sorted(registry.getUtilitiesFor(ISpam, 'p1')), 
+                         [('a', 'A'), ('b', 'B')])
+        self.assertEqual(self.loaded, ['b', 'a'])
+
+    def test_failed_loader(self):
+        registry.provideDeferredUtility(lambda: None, ISpam, name='a', 
+                                        providedby='p1')
+        self.assertEqual(registry.queryUtility(ISpam, 'a'), (None, None))
+        self.assertEqual(registry.getNamesFor(ISpam), {})
+
+    def test_factories(self):
+        registry.provideFactory(list, ISpam, name='a', providedby='p1')
+        plugin, factory = registry.queryFactory(ISpam, 'a')
+        self.assertEqual(plugin, 'p1')
+        self.assertFalse(factory() is factory())
+
+    def test_unprovide(self):
+        registry.provideUtility('A', ISpam, name='a', providedby='p1')
+        registry.provideFactory(list, ISpam, name='a', providedby='p1')
+        registry.provideDeferredUtility(self.loader('b', 'p1'), ISpam, 
+                                        name='b', providedby='p1')
+        registry.provideUtility('C', ISpam, name='c', providedby='p2')
+        # Another plugin can not remove the utility
+        self.assertFalse(registry.unprovideUtility(ISpam, 'a', 'p2'))
+        registry.unprovidePlugin(ISpam, 'p1')
+        self.assertEqual(registry.getNamesFor(ISpam), {'c': 'p2'})
+        self.assertEqual(registry.getPlugins(ISpam), ['p2'])
+        self.assertEqual(registry.queryFactory(ISpam, 'a'), (None, None))
+        self.assertEqual(registry.queryUtility(ISpam, 'b'), (None, None))
+        self.assertEqual(self.loaded, [])
+
+if __name__ == '__main__':
+    unittest.main()
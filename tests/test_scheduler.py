@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import logging
+import unittest
+
+from zupport import registry
+from zupport.core import ParameterList, Tool
+from zupport.interfaces import ITool
+from zupport.scheduler import JobScheduler
+
+class Queue(object):
+    ''' Post-processing queue counting the items added and finishes.'''
+
+    # Queues used by the tools
+    used = []
+
+    def __init__(self):
+        self.items = []
+        self.finished = 0
+
+    def add(self, item):
+        self.items.append(item)
+
+    def finish(self):
+        self.finished += 1
+
+class Double(Tool):
+    ''' Doubles its value, fails for negative values.'''
+
+    def __init__(self):
+        parameters = ParameterList('Double')
+        parameters.add('value', 0)
+        Tool.__init__(self, parameters, 'double')
+        self.log = logging.getLogger('Zupport.Double')
+
+    def update(self, use_gp_params, gui, *args, **kwargs):
+        Tool.update(self, *args, **kwargs)
+
+    def run(self):
+        value = self.get_parameter('value')
+        if value < 0:
+            raise ValueError('Negative value %s' % value)
+        queue = self.post_queues.setdefault('test', Queue())
+        if queue not in Queue.used:
+            Queue.used.append(queue)
+        queue.add(value)
+        self.log.info('Doubled %s', value)
+        return value * 2
+
+class Job(object):
+
+    def __init__(self, value, inputs=(), outputs=(), predesessor=None):
+        self.service = 'double'
+        self.batch = True
+        self.args = ()
+        self.kwargs = {'value': value}
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.predesessor = predesessor
+        self.successor = None
+
+class Geoprocessor(object):
+    ''' Keeps the geoprocessing messages.'''
+
+    def __init__(self):
+        self.messages = []
+
+    def AddMessage(self, msg):
+        self.messages.append(msg)
+
+    AddWarning = AddError = AddMessage
+
+class TestJobScheduler(unittest.TestCase):
+
+    def setUp(self):
+        registry.provideFactory(Double, ITool, name='double', 
+                                providedby='tests')
+
+    def tearDown(self):
+        registry.unprovidePlugin(ITool, 'tests')
+        del Queue.used[:]
+
+    def test_dependencies(self):
+        first = Job(1, outputs=['a.tif'])
+        second = Job(2, inputs=['a.tif'], outputs=['b.tif'])
+        third = Job(3, predesessor=second)
+        scheduler = JobScheduler([third, second, first], processes=1)
+        self.assertEqual(scheduler.dependencies, [set([1]), set([2]), 
+                                                  set()])
+        self.assertEqual(scheduler.order(), [2, 1, 0])
+
+    def test_cycle(self):
+        first = Job(1, inputs=['b.tif'], outputs=['a.tif'])
+        second = Job(2, inputs=['a.tif'], outputs=['b.tif'])
+        self.assertRaises(ValueError, JobScheduler, [first, second])
+
+    def test_run(self):
+        first = Job(1, outputs=['a.tif'])
+        failing = Job(-1, inputs=['a.tif'], outputs=['b.tif'])
+        dependent = Job(3, inputs=['b.tif'])
+        report = JobScheduler([first, failing, dependent], 
+                              processes=1).run()
+        jobs = report['jobs']
+        self.assertEqual(jobs[0]['result'], 2)
+        self.assertEqual(jobs[0]['error'], None)
+        self.assertTrue(jobs[1]['error'].startswith('ValueError'))
+        self.assertEqual(jobs[2]['error'], 'Dependency failed')
+        self.assertTrue(report['critical_path'] <= report['wall_time'])
+
+    def test_shared_queues(self):
+        JobScheduler([Job(1), Job(2)], processes=1).run()
+        # Both jobs added to the same queue, finished once after the jobs
+        self.assertEqual(len(Queue.used), 1)
+        self.assertEqual(Queue.used[0].items, [1, 2])
+        self.assertEqual(Queue.used[0].finished, 1)
+
+    def test_worker_messages(self):
+        gp = Geoprocessor()
+        report = JobScheduler([Job(1), Job(2)], processes=2, gp=gp).run()
+        self.assertEqual([job['result'] for job in report['jobs']], [2, 4])
+        messages = [msg for msg in gp.messages if 'Doubled' in msg]
+        self.assertEqual(len(messages), 2)
+
+if __name__ == '__main__':
+    unittest.main()
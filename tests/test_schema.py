@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from zupport import schema
+from zupport.core import ParameterError, ParameterList
+from zupport.plugins.zarcgis import tools
+
+DEFINITION = '''---
+Spam:
+- name: 'factor'
+  required: True
+  tip: 'Integer'
+  value: 2
+
+- name: 'ratio'
+  value: 0.5
+
+- name: 'debug'
+  value: False
+
+- name: 'names'
+  value: ['a', 'b']
+
+- name: 'size'
+  type: 'float'
+  value: 0
+'''
+
+class TestCoercer(unittest.TestCase):
+
+    def test_bool(self):
+        to_bool = schema.coercer(False)
+        self.assertEqual(to_bool('Yes'), True)
+        self.assertEqual(to_bool(' false '), False)
+        self.assertEqual(to_bool(1), 1)
+        self.assertRaises(ValueError, to_bool, 'maybe')
+
+    def test_numbers(self):
+        self.assertEqual(schema.coercer(2)('10'), 10)
+        self.assertEqual(schema.coercer(0.5)('1.5'), 1.5)
+        self.assertRaises(ValueError, schema.coercer(2), '2,5')
+
+    def test_empty_values(self):
+        for value in ['', '#', None]:
+            self.assertEqual(schema.coercer(2)(value), value)
+            self.assertEqual(schema.coercer(True)(value), value)
+
+    def test_as_is(self):
+        self.assertEqual(schema.coercer('2')('2,5,10'), '2,5,10')
+        self.assertEqual(schema.coercer([])(['a']), ['a'])
+
+    def test_type(self):
+        # The declared type wins over the type of the default value
+        self.assertEqual(schema.coercer(0, 'float')('25.0'), 25.0)
+        self.assertEqual(schema.coercer(0.0, 'string')('25'), '25')
+        self.assertRaises(ValueError, schema.coercer, 0, 'decimal')
+
+class TestSchema(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.path = os.path.join(self.workspace, 'spam.yaml')
+        self.write(DEFINITION)
+
+    def tearDown(self):
+        cache_file = schema._cache_file(os.path.abspath(self.path))
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        shutil.rmtree(self.workspace)
+
+    def write(self, text):
+        definition = open(self.path, 'w')
+        definition.write(text)
+        definition.close()
+
+    def test_compile(self):
+        compiled = schema.load_schema(self.path)
+        self.assertEqual(compiled.name, 'Spam')
+        self.assertEqual(compiled.names, ['factor', 'ratio', 'debug', 
+                                          'names', 'size'])
+        self.assertEqual(compiled.index['debug'], 2)
+        self.assertEqual(compiled.defaults()[1], ('ratio', 0.5, False, ''))
+
+    def test_cached(self):
+        compiled = schema.load_schema(self.path)
+        self.assertTrue(schema.load_schema(self.path[:-5]) is compiled)
+        # Compiled again from the disk cache in a new process
+        schema._schemas.clear()
+        cached = schema.load_schema(self.path)
+        self.assertFalse(cached is compiled)
+        self.assertEqual(cached.names, compiled.names)
+        self.assertEqual(len(cached.coercers), 5)
+        self.assertEqual(cached.coercers[4]('2.5'), 2.5)
+
+    def test_changed_definition(self):
+        schema.load_schema(self.path)
+        self.write(DEFINITION.replace("'debug'", "'verbose'") + '\n')
+        self.assertEqual(schema.load_schema(self.path).names[2], 'verbose')
+
+    def test_mutable_defaults(self):
+        compiled = schema.load_schema(self.path)
+        compiled.defaults()[3][1].append('c')
+        self.assertEqual(compiled.defaults()[3][1], ['a', 'b'])
+
+    def test_parameters(self):
+        parameters = ParameterList('Spam', self.path)
+        parameters.set_parameter_value('factor', '10')
+        parameters.set_parameter_value(2, 'true')
+        self.assertEqual(parameters.get_parameter_value(0), 10)
+        self.assertEqual(parameters.get_parameter_value('debug'), True)
+        self.assertEqual(parameters.get_parameter_value('spam'), None)
+        self.assertRaises(ParameterError, parameters.set_parameter_value,
+                          'factor', 'ten')
+        self.assertRaises(ParameterError, parameters.set_parameter_value,
+                          'spam', 1)
+
+class TestToolDefinitions(unittest.TestCase):
+
+    def test_cell_factors(self):
+        path = os.path.join(os.path.dirname(tools.__file__), 
+                            'batch_aggregate.yaml')
+        parameters = ParameterList('BatchAggregate', path)
+        parameters.set_parameter_value('cell_factor', '2,5,10')
+        self.assertEqual(parameters.get_parameter_value('cell_factor'), 
+                         '2,5,10')
+
+    def test_pixel_size(self):
+        path = os.path.join(os.path.dirname(tools.__file__), 
+                            'multiconvertraster.yaml')
+        parameters = ParameterList('MultiConvertRaster', path)
+        for value in ['25.0', '25', 25]:
+            parameters.set_parameter_value('pixel_size', value)
+            self.assertEqual(parameters.get_parameter_value('pixel_size'), 
+                             25.0)
+
+if __name__ == '__main__':
+    unittest.main()
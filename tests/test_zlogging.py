@@ -0,0 +1,110 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import logging
+import sys
+import unittest
+import warnings
+
+from zupport.zlogging import Logger, format_message
+
+class Records(logging.Handler):
+    ''' Keeps the records handled.'''
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    @property
+    def messages(self):
+        return [record.getMessage() for record in self.records]
+
+class Result(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def addMessage(self, level, msg):
+        self.messages.append((level, msg))
+
+class Parent(object):
+
+    def __init__(self):
+        self.result = Result()
+
+class Unformattable(object):
+
+    def __str__(self):
+        raise AssertionError('Formatted a disabled message')
+
+class TestLogger(unittest.TestCase):
+
+    def setUp(self):
+        self.log = Logger('Zupport.TestLogger', debugging=True)
+        self.records = Records()
+        self.log.logger.addHandler(self.records)
+        self.log.logger.setLevel(logging.DEBUG)
+        self.parent = Parent()
+
+    def tearDown(self):
+        self.log.logger.removeHandler(self.records)
+
+    def test_arguments(self):
+        self.log.info('Processing %s of %s', 1, 2)
+        self.assertEqual(self.records.messages, ['Processing 1 of 2'])
+
+    def test_line_numbers(self):
+        line = sys._getframe().f_lineno + 1
+        self.log.debug('Checking %s', 'raster')
+        self.log.error('Failed')
+        self.assertEqual(self.records.messages, 
+                         ['line %s: Checking raster' % line, 'Failed'])
+
+    def test_disabled_debug(self):
+        self.log.debugging = False
+        del self.records.records[:]
+        self.log.debug('Not formatted %s', Unformattable())
+        self.assertEqual(self.records.records, [])
+        self.assertFalse(self.log.isEnabledFor(logging.DEBUG))
+
+    def test_exception(self):
+        try:
+            raise ValueError('spam')
+        except ValueError:
+            self.log.exception('Failed with %s', 'spam')
+        record = self.records.records[0]
+        self.assertEqual(record.getMessage(), 'Failed with spam')
+        self.assertEqual(record.exc_info[0], ValueError)
+
+    def test_parent(self):
+        self.log.info('Processing %s', 1, parent=self.parent)
+        self.log.warning('Warned', parent=self.parent)
+        self.assertEqual(self.parent.result.messages, [(20, 'Processing 1'),
+                                                       (40, 'Warned')])
+
+    def test_positional_parent(self):
+        with warnings.catch_warnings(record=True) as warned:
+            warnings.simplefilter('always')
+            self.log.info('Processing', self.parent)
+            self.log.error('Failed', self.parent)
+        self.assertEqual(len(warned), 2)
+        self.assertTrue(issubclass(warned[0].category, DeprecationWarning))
+        self.assertEqual(self.records.messages, ['Processing', 'Failed'])
+        self.assertEqual(self.parent.result.messages, [(20, 'Processing'),
+                                                       (40, 'Failed')])
+
+    def test_positional_parent_percent(self):
+        with warnings.catch_warnings(record=True):
+            warnings.simplefilter('always')
+            self.log.info('50% done', self.parent)
+        self.assertEqual(self.records.messages, ['50% done'])
+        self.assertEqual(self.parent.result.messages, [(20, '50% done')])
+
+    def test_format_mismatch(self):
+        self.assertEqual(format_message('%d done', ('all',)), '%d done all')
+
+if __name__ == '__main__':
+    unittest.main()
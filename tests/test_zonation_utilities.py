@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+
+import numpy as np
+
+from zupport.plugins.zonation.utilities import (compare_distributions,
+                                                compare_multi_distributions,
+                                                make_comparisons,
+                                                read_ascii_matrix)
+
+def write_grid(path, matrix, nodata=-1):
+    grid = open(path, 'w')
+    grid.write('ncols %s\nnrows %s\nxllcorner 0\nyllcorner 0\ncellsize 1\n'
+               'NODATA_value %s\n' % (matrix.shape[1], matrix.shape[0],
+                                      nodata))
+    for row in matrix:
+        grid.write(' '.join([str(value) for value in row]) + '\n')
+    grid.close()
+
+def count_distributions(matrix1, matrix2, NDs):
+    # Cell by cell reference implementation
+    results = {'matrix1': 0, 'both': 0, 'matrix2': 0}
+    for val1, val2 in zip(matrix1.ravel(), matrix2.ravel()):
+        if val1 not in NDs and val2 in NDs:
+            results['matrix1'] += 1
+        elif val1 not in NDs and val2 not in NDs:
+            results['both'] += 1
+        elif val1 in NDs and val2 not in NDs:
+            results['matrix2'] += 1
+    return results
+
+class TestCompareDistributions(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.matrix1 = random.randint(-2, 3, (37, 23))
+        self.matrix2 = random.randint(-2, 3, (37, 23))
+
+    def test_compare_distributions(self):
+        expected = count_distributions(self.matrix1, self.matrix2, [-1, -2])
+        for block_rows in [1, 5, 1024]:
+            self.assertEqual(compare_distributions(self.matrix1, self.matrix2,
+                                                   block_rows=block_rows),
+                             expected)
+
+    def test_compare_multi_distributions(self):
+        expected = count_distributions(self.matrix1, self.matrix2, [-1, -2])
+        results = compare_multi_distributions([-1, -2], self.matrix1,
+                                              self.matrix2, block_rows=7)
+        self.assertEqual(results['intersection'][0, 1], expected['both'])
+        self.assertEqual(results['counts'][0],
+                         expected['both'] + expected['matrix1'])
+        self.assertEqual(results['any'], sum(expected.values()))
+        self.assertEqual(results['patterns'][(True, False)],
+                         expected['matrix1'])
+
+class TestReadAsciiMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        self.matrix = np.arange(-1, 11).reshape(3, 4)
+        self.filename = os.path.join(self.workspace, 'grid.asc')
+        write_grid(self.filename, self.matrix)
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def test_read(self):
+        np.testing.assert_array_equal(read_ascii_matrix(self.filename),
+                                      self.matrix)
+
+    def test_skip_is_deprecated(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            matrix = read_ascii_matrix(self.filename, 6)
+        self.assertEqual([warning.category for warning in caught],
+                         [DeprecationWarning])
+        np.testing.assert_array_equal(matrix, self.matrix)
+
+class TestMakeComparisons(unittest.TestCase):
+
+    def setUp(self):
+        self.workspace = tempfile.mkdtemp()
+        random = np.random.RandomState(1)
+        for folder in ['1_ref', '2_a', '3_b', '4_c']:
+            os.mkdir(os.path.join(self.workspace, folder))
+            write_grid(os.path.join(self.workspace, folder, 'rank.asc'),
+                       random.randint(-1, 2, (9, 7)))
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace)
+
+    def results(self, processes):
+        make_comparisons(self.workspace, '1_ref', ['rank.asc'], [2, 3, 4],
+                         verbose=False, ext='_%s' % processes,
+                         processes=processes)
+        out_name = os.path.join(self.workspace, '1_ref',
+                                'com_dist_1_%s.txt' % processes)
+        # Leave out the time stamp and elapsed time columns
+        return [line.split('\t')[:-2] for line in open(out_name, 'r')]
+
+    def test_processes(self):
+        serial = self.results(1)
+        self.assertEqual(len(serial), 4)
+        self.assertEqual([line[1] for line in serial[1:]], ['2', '3', '4'])
+        self.assertEqual(self.results(2), serial)
+
+    def test_reference_memmap_removed(self):
+        temp = os.path.join(self.workspace, 'temp')
+        os.mkdir(temp)
+        tempdir = tempfile.tempdir
+        tempfile.tempdir = temp
+        try:
+            self.results(2)
+        finally:
+            tempfile.tempdir = tempdir
+        self.assertEqual(os.listdir(temp), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,10 +4,10 @@
 
 """
 
-import inspect
+import importlib
 import os
-import pkgutil
 import sys
+import time
 from types import IntType, StringType
 import yaml
 
@@ -15,6 +15,7 @@ from zope.interface import implements
 
 from zupport import registry
 from zupport.interfaces import IPlugin, ITool
+from zupport.schema import coercer, load_schema
 from zupport.utilities import Singleton, USER_DATA_DIR
 from zupport.utilities.odict import OrderedDict
 from zupport.zlogging import Logger
@@ -86,9 +87,15 @@ class Job(object):
         """
 
         self.batch = batch
+        self.args = args
+        self.kwargs = kwargs
+        # Paths of the rasters / files the job reads and writes, used for
+        # ordering jobs in parallel runs (see zupport.scheduler)
+        self.inputs = []
+        self.outputs = []
         self.logger = Logger('Zupport')
-        self._predesessor = None
-        self._successor = None
+        self.__predesessor = None
+        self.__successor = None
         self.service = service
 
         self.tool = None
@@ -113,7 +120,7 @@ class Job(object):
 
     def run(self):
         if self.tool and self.tool.ready:
-            self.tool.run()
+            return self.tool.run()
 
     def update_parameters(self, *args, **kwargs):
         self.tool.update(*args, **kwargs)
@@ -152,23 +159,18 @@ class Manager(Singleton):
         self.logger.debug('ZupportManager initialized')
         self._plugins = OrderedDict()
         try:
+            # Imported here to avoid circular imports
+            from zupport.discovery import PluginManifest
             import plugins
 
-            # Import all the plugin modules that do not raise ImportError
-            for loader, module_name, is_pkg in  pkgutil.iter_modules(plugins.__path__):
-                try:
-                    exec('from plugins import %s' % module_name)
-                except ImportError, e:
-                    self.logger.warning('Cannot load plugin: %s (%s)' %
-                                        (module_name, e))
-
-            # Load the initial plugins
-            plugins_modules = inspect.getmembers(plugins, inspect.ismodule)
+            # The plugins and their tools are listed from the plugin manifest,
+            # a tool module is imported only when the tool is first requested
             plugins_path = os.path.abspath(os.path.dirname(plugins.__file__))
-            for name, data in plugins_modules:
+            manifest = PluginManifest(plugins_path, log=self.logger)
+            for name, entries in manifest.plugins():
                 self.logger.debug('Loading plugin: %s (%s)' %
                                   (name, plugins_path))
-                self.load_plugin(name, plugins_path)
+                self.load_plugin(name, plugins_path, entries)
 
         except ImportError, e:
             self.logger.exception('Cannot load plugin: %s' % str(e))
@@ -185,20 +187,15 @@ class Manager(Singleton):
             return None
 
     def loaded_plugins(self):
-        all_tools = registry.getUtilitiesForBy(ITool)
-        plugins = []
-        # TODO: this sucks big time...
-        for tool_name, data in all_tools.iteritems():
-            plugins.append(data[0])
-        return set(plugins)
+        return set(registry.getPlugins(ITool))
 
-    def load_plugin(self, name, plugins_path):
+    def load_plugin(self, name, plugins_path, entries=None):
 
         try:
             if name in self.loaded_plugins():
                 self.logger.info('Plugin %s already loaded' % name)
             else:
-                self._plugins[name] = Plugin(name, plugins_path)
+                self._plugins[name] = Plugin(name, plugins_path, entries)
 
         except ImportError, e:
             self.logger.exception('Could not import plugin %s' % e)
@@ -208,32 +205,118 @@ class Manager(Singleton):
             self.logger.exception('%s Exiting...' % (e))
             return 0
 
-    def run_job(self, job):
-        """ Run a single job.
+    def unload_plugin(self, name):
+        """ Removes the tools of plugin name from the registry.
+        """
+        registry.unprovidePlugin(ITool, name)
+        if name in self._plugins.keys():
+            del self._plugins[name]
+
+    def run_job(self, job, manifest=None):
+        """ Run a single job. If a manifest (zupport.manifest.JobManifest)
+        is given, the job is skipped if its inputs, parameters and outputs
+        have not changed since it was last run, and recorded otherwise.
         """
+        if manifest is not None and manifest.is_current(job):
+            self.logger.info('Skipping job %s, inputs and outputs unchanged' %
+                             job.service)
+            return
         self.logger.debug('Running job %s' % job.service)
+        started = time.time()
         res = job.run()
+        if manifest is not None and manifest.record(job, since=started):
+            self.logger.debug('Recorded job %s in the manifest' % job.service)
         if res:
             self.logger.info('Finished job %s successfully' % job.service)
         else:
             self.logger.info('Job %s did not finish successfully' % job.service)
 
-    def run_jobs(self):
-        """ Run all jobs in the queue.
-        FIXME: this is broken as a single tool instance exists in the registry
-        and parameters are updated while creating a new Job instance. Either
-        the registry must allow multiple tool instances or then Job parameters
-        must be evaluated just before running the tool.
+    def run_chain(self, job):
+        """ Run a job and its successors as a lazy chain. Rasters computed by
+        the tools are not written but deferred into a shared raster graph. A
+        deferred raster is evaluated block by block when the next tool reads
+        it, and only the rasters no tool consumed (terminal outputs) are
+        written after the last job.
+
+        Deferred rasters can only be consumed by tools that read them by path
+        (Tool.reads_deferred, e.g. Aggregate and RASigmoidal). Before any
+        other tool (e.g. one listing its input workspace) is run, all the
+        rasters left in the graph are written, consumed or not. A written
+        raster is removed from the graph and read from disk by the later
+        tools.
         """
+        # Imported here to avoid importing NumPy with the core
+        from zupport.raster import RasterGraph
+
+        graph = RasterGraph()
+        chain = []
+        while job is not None and job not in chain:
+            chain.append(job)
+            job = job.successor
+        try:
+            for job in chain:
+                if job.tool:
+                    if not job.tool.reads_deferred and len(graph):
+                        # The tool finds its inputs on disk
+                        self.logger.debug('Writing deferred rasters for %s' %
+                                          job.service)
+                        graph.materialize(log=self.logger,
+                                          paths=graph.paths())
+                    job.tool.graph = graph
+                self.run_job(job)
+            written = graph.materialize(log=self.logger)
+            self.logger.debug('Chain of %s jobs wrote %s rasters' %
+                              (len(chain), len(written)))
+        finally:
+            graph.close()
+            for job in chain:
+                if job.tool:
+                    job.tool.graph = None
+
+    def run_jobs(self, lazy=False, processes=None, manifest=None, gp=None):
+        """ Run all jobs in the queue. If lazy is True, chained jobs (see
+        Job.successor) are run with run_chain starting from the first job of
+        each chain. If a manifest (zupport.manifest.JobManifest) is given,
+        jobs that are up to date are skipped (not in lazy chains, as their
+        intermediate outputs are never written).
+
+        If processes is given, jobs are run by zupport.scheduler.JobScheduler:
+        jobs that do not depend on each other run concurrently in at most
+        processes worker processes, each with its own tool instance. Returns
+        the scheduler report (wall time per job and the critical path length).
+        Lazy chains cannot span processes, so lazy is ignored in this case.
+        If the geoprocessor gp is given, the log records of the workers are
+        also added to the ArcGIS geoprocessing messages.
+        Post-processing queues of the tools (e.g. pyramids) are shared by the
+        jobs and finished after the last job.
+        FIXME: without processes, a single tool instance exists in the
+        registry and parameters are updated while creating a new Job instance.
+        Either the registry must allow multiple tool instances or then Job
+        parameters must be evaluated just before running the tool.
+        """
+        if processes is not None:
+            # Imported here, the scheduler imports the core
+            from zupport.scheduler import JobScheduler
+            scheduler = JobScheduler(self.jobqueue, processes, self.logger,
+                                     manifest, gp)
+            return scheduler.run()
+
+        queues = {}
         for job in self.jobqueue:
-            job.run()
-
-    def unload_plugin(self, toolname):
-        if toolname in self.plugins.keys():
-            del self.plugins[toolname]
-            self.logger.info('Unloaded tool: %s' % toolname)
-        else:
-            self.logger.info('Tool not Loaded.')
+            if job.tool:
+                job.tool.post_queues = queues
+        try:
+            for job in self.jobqueue:
+                if not lazy:
+                    self.run_job(job, manifest)
+                elif (job.predesessor is None or
+                      job.predesessor not in self.jobqueue):
+                    self.run_chain(job)
+        finally:
+            for job in self.jobqueue:
+                if job.tool:
+                    job.tool.post_queues = None
+            finish_queues(queues, self.logger)
 
 
 class Parameter(object):
@@ -253,7 +336,8 @@ class Parameter(object):
 
     """
 
-    attr_acceptable = ['name', 'value', 'required', 'tip']
+    __slots__ = ('name', 'value', 'required', 'tip')
+    attr_acceptable = list(__slots__)
 
     def __init__(self, *args, **kwargs):
 
@@ -273,13 +357,6 @@ class Parameter(object):
         if kwargs:
             self._init_dict(kwargs)
 
-    def __setattr__(self, name, value):
-        ''' Custom __setattr__ that controls the available attribute names. '''
-        if name in Parameter.attr_acceptable:
-            object.__setattr__(self, name, value)
-        else:
-            raise AttributeError('Name %s not valid for class attribute' % name)
-
     def __str__(self):
         return 'Name: %s\nValue: %s\nRequired: %s\nTip: %s\n' % (self.name,
                                                                  self.value,
@@ -349,6 +426,11 @@ class ParameterList(object):
     Class can be subclassed; in this case the subclass must re-implement the
     parse method in order to handle the provided parameters.
 
+    Templates are compiled into parameter schemas (see :mod:`zupport.schema`)
+    that are cached, so the yaml is only parsed when the template changes.
+    Parameters are looked up by name through an index and string values are
+    coerced to the type of the parameter's default value.
+
     """
 
     def __init__(self, name, template=None, data=None):
@@ -356,12 +438,19 @@ class ParameterList(object):
         self._name = name
 
         self._data = []
+        # Parameter indices by name and value coercers by index
+        self._index = {}
+        self._coercers = []
 
         if template is not None:
-            data = self.__read(template)
+            schema = load_schema(template)
             self.templatepath = template
-
-        self.parse(data)
+            for default in schema.defaults():
+                self._data.append(Parameter(*default))
+            self._index = dict(schema.index)
+            self._coercers = list(schema.coercers)
+        else:
+            self.parse(data)
 
         self.index = 0
 
@@ -375,7 +464,27 @@ class ParameterList(object):
         return '\n'.join([str(parameter) for parameter in self.data])
 
     def add(self, *args, **kwargs):
-        self.data.append(Parameter(*args, **kwargs))
+        parameter = Parameter(*args, **kwargs)
+        self.data.append(parameter)
+        self._index[parameter.name] = len(self.data) - 1
+        self._coercers.append(coercer(parameter.value))
+
+    def _reindex(self):
+        self._index = dict([(parameter.name, i) for i, parameter in
+                            enumerate(self.data)])
+        self._coercers = [coercer(parameter.value) for parameter in
+                          self.data]
+
+    def _lookup(self, token):
+        ''' Returns the index of a parameter name or index token, or None if
+        there is no parameter with the name.'''
+        if isinstance(token, basestring):
+            return self._index.get(token)
+        elif type(token) == int:
+            return token
+        else:
+            raise ValueError('Token type invalid for object Parameters: %s' % (
+                             type(token)))
 
     def missing(self):
         # TODO: should do parameter type specific checking
@@ -398,26 +507,14 @@ class ParameterList(object):
         return self._data
 
     def get_parameter(self, token):
-        if type(token) == str or type(token) == unicode:
-            for parameter in self.data:
-                if parameter.name == token:
-                    return parameter
-        elif type(token) == int:
-            return self.data[token]
-        else:
-            raise ValueError('Token type invalid for object Parameters: %s' % (
-                             type(token)))
+        index = self._lookup(token)
+        if index is not None:
+            return self.data[index]
 
     def get_parameter_value(self, token):
-        if type(token) == str or type(token) == unicode:
-            for parameter in self.data:
-                if parameter.name == token:
-                    return parameter.value
-        elif type(token) == int:
-            return self.data[token].value
-        else:
-            raise ValueError('Token type invalid for object Parameters: %s' % (
-                             type(token)))
+        index = self._lookup(token)
+        if index is not None:
+            return self.data[index].value
 
     def next(self):
         if self.index < len(self.data):
@@ -464,51 +561,30 @@ class ParameterList(object):
         ''' Property method returns all the parameter names in self.'''
         return [parameter.name for parameter in self.data]
 
-    def __read(self, infile):
-
-        if not infile.endswith('.yaml'):
-            infile = infile + '.yaml'
-        if os.path.exists(infile):
-            try:
-                data = yaml.safe_load(open(infile, 'r'))
-                # TODO: hack, there should be a way of comparing template name
-                # (key) and Parameters instance.name
-                return data.values()[0]
-            except (IOError, OSError):
-                raise
-        else:
-            raise ValueError('Template path does not exits: %s' % infile)
-
     def remove(self, name):
-        for parameter in self.data:
-            if parameter.name == name:
-                self.data.remove(parameter)
+        index = self._index.get(name)
+        if index is not None:
+            del self.data[index]
+            self._reindex()
 
     def set_parameter(self, token, object):
-        if type(token) == str or type(token) == unicode:
-            for parameter in self.data:
-                if parameter.name == token:
-                    parameter = object
-        elif type(token) == int:
-            self.data[token] = object
-        else:
-            raise ValueError('Token type invalid for object Parameters: %s' % (
-                             type(token)))
+        index = self._lookup(token)
+        if index is not None:
+            self.data[index] = object
+            self._reindex()
 
     def set_parameter_value(self, token, value):
 
-        if type(token) == str or type(token) == unicode:
-            # Check if parameter name exists
-            if token not in self.parameter_names:
-                raise ParameterError('Invalid parameter: %s' % token)
-            for parameter in self.data:
-                if parameter.name == token:
-                    parameter.value = value
-        elif type(token) == int:
-            self.data[token].value = value
-        else:
-            raise ValueError('Token type invalid for object Parameters: %s' % (
-                             type(token)))
+        index = self._lookup(token)
+        # Check if parameter name exists
+        if index is None:
+            raise ParameterError('Invalid parameter: %s' % token)
+        parameter = self.data[index]
+        try:
+            parameter.value = self._coercers[index](value)
+        except (TypeError, ValueError):
+            raise ParameterError('Invalid value for parameter %s: %r' %
+                                 (parameter.name, value))
 
 
 class ParameterError(Exception):
@@ -535,7 +611,7 @@ class Plugin(object):
 
     implements(IPlugin)
 
-    def __init__(self, name, package_path):
+    def __init__(self, name, package_path, entries=None):
         self._name = name
         self._ready = False
         self.logger = Logger('Zupport.Plugin')
@@ -548,6 +624,12 @@ class Plugin(object):
             self.logger.debug('Inserting %s to sys.path' % package_path)
             sys.path.insert(0, package_path)
 
+        if entries is not None:
+            # Tool entries from the plugin manifest (see zupport.discovery),
+            # the tools are created on first request
+            self._defer_tools(entries)
+            return
+
         # Load the module
         try:
             # module here is the same as the plugin module, it needs to
@@ -575,6 +657,29 @@ class Plugin(object):
         if self._ready:
             self.logger.info('Loaded plugin: %s' % name)
 
+    def _defer_tools(self, entries):
+        if not entries:
+            self.logger.warning('No tools available for plugin %s' %
+                                self._name)
+        for entry in entries:
+            factory = ToolFactory(entry['tool'], entry['module'],
+                                  entry['definition'])
+            registry.provideFactory(factory, ITool, name=entry['service'],
+                                    providedby=self._name)
+            registry.provideDeferredUtility(self._tool_loader(factory), ITool,
+                                            name=entry['service'],
+                                            providedby=self._name)
+        self._ready = True
+        self.logger.info('Loaded plugin: %s (%s tools)' % (self._name,
+                                                           len(entries)))
+
+    def _tool_loader(self, factory):
+        def load():
+            self.logger.debug('[%s] Importing %s' % (factory.name,
+                                                     factory.module_name))
+            return self._create_tool(factory)
+        return load
+
     def _load_tool(self, name, module):
 
         # TODO: implement checking for ITool interface
@@ -591,18 +696,30 @@ class Plugin(object):
                 self.logger.debug('[%s] Definition file:  %s' %
                                   (name, definition_file))
 
-            parameters = ParameterList(name, definition_file)
+            return self._create_tool(ToolFactory(name, module.__name__,
+                                                 definition_file))
+
+        except ImportError, e:
+            self.logger.exception('Could not import tool %s' % e)
 
-            tool = module.setup(parameters)
+        except ValueError, e:
+            self.logger.exception('%s Exiting...' % (e))
 
-            # Add the tool to registry
+    def _create_tool(self, factory):
+        try:
+            tool = factory()
+
+            # Add the tool and its factory to registry
             if ITool.providedBy(tool):
                 registry.provideUtility(tool, ITool, name=tool.service,
                                         providedby=self._name)
-                self.logger.debug('Added %s to registry' % name)
+                registry.provideFactory(factory, ITool, name=tool.service,
+                                        providedby=self._name)
+                self.logger.debug('Added %s to registry' % factory.name)
+                return tool
             else:
                 self.logger.error(('Tool %s does not provide ITool interface' +
-                                  ' and cannot be used') % name)
+                                  ' and cannot be used') % factory.name)
 
         except ImportError, e:
             self.logger.exception('Could not import tool %s' % e)
@@ -611,19 +728,47 @@ class Plugin(object):
             self.logger.exception('%s Exiting...' % (e))
 
     def _unload_tool(self, tool):
-        pass
+        registry.unprovideUtility(ITool, tool, providedby=self._name)
 
     def registered(self, tool):
-        tools = self.registered_tools()
-        if tool in [_tool[0] for _tool in tools]:
-            return True
-        else:
-            return False
+        return tool in registry.getNamesFor(ITool, providedby=self._name)
 
     def registered_tools(self):
         return list(registry.getUtilitiesFor(ITool, providedby=self._name))
 
 
+def finish_queues(queues, logger=None):
+    """ Finishes the post-processing queues {key: queue} shared by the jobs
+    of a run. A failing queue does not stop the others from finishing.
+    """
+    for key, queue in queues.items():
+        try:
+            queue.finish()
+        except Exception, e:
+            if logger is not None:
+                logger.error('Post-processing failed: %s' % e)
+    queues.clear()
+
+
+class ToolFactory(object):
+    """ Creates new instances of a tool. Only the names of the tool module
+    and its definition file are kept, the module is imported when the first
+    tool is created.
+    """
+
+    def __init__(self, name, module_name, definition_file):
+        self.name = name
+        self.module_name = module_name
+        self.definition_file = definition_file
+
+    def __call__(self):
+        """ Returns a new tool instance with its own parameters.
+        """
+        module = importlib.import_module(self.module_name)
+        parameters = ParameterList(self.name, self.definition_file)
+        return module.setup(parameters)
+
+
 class Project(object):
     """ Utility class for describing Zupport project structure.
 
@@ -822,6 +967,12 @@ class Tool(object):
     """
     """
 
+    # Tool reads its input rasters by path through open_raster, so it can
+    # consume rasters deferred by the previous tool of a lazy chain. Rasters
+    # deferred for other tools (e.g. ones listing a workspace) are written
+    # before the tool is run.
+    reads_deferred = False
+
     def __init__(self, parameters, service=None):
 
         self._parameters = parameters
@@ -830,6 +981,13 @@ class Tool(object):
         #self.status = self.result.status
         self.service = service
         self.provided_by = None
+        # Deferred rasters (zupport.raster.RasterGraph) shared by a lazy chain
+        # of jobs, None when results are written right away
+        self.graph = None
+        # Post-processing queues (e.g. pyramids) shared by the jobs of a run
+        # {key: queue}, finished after the last job (see finish_queues).
+        # None when the tool finishes its own queues.
+        self.post_queues = None
 
     @property
     def backend(self):
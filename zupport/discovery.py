@@ -0,0 +1,187 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Plugin discovery without imports. The tools of each plugin package are found
+by reading the sources: the tool modules are listed in the __all__ of the
+plugin's tools package, the service name is the string returned by the
+service() function of a tool module and the parameters are defined in a .yaml
+file next to it. Nothing is imported, so the registry can list the tools of
+all plugins and import a tool module only when the tool is first requested.
+
+The manifest is cached in the user cache folder (USER_CACHE_DIR/plugins) for
+each install, together with the fingerprints of the files it was built from.
+The plugins are scanned again only if some of these files have changed.
+"""
+
+import ast
+import hashlib
+import os
+import pkgutil
+
+from yaml import safe_load, safe_dump, YAMLError
+
+from zupport.utilities.cache import cache_dir, cache_key, replace_file
+
+def _parse(path):
+    return ast.parse(open(path, 'rU').read(), path)
+
+def module_all(path):
+    """Returns the names listed in the __all__ of a module source file or an
+    empty list if there is no __all__.
+    """
+    for node in _parse(path).body:
+        if not isinstance(node, ast.Assign):
+            continue
+        for target in node.targets:
+            if isinstance(target, ast.Name) and target.id == '__all__':
+                return [str(name) for name in ast.literal_eval(node.value)]
+    return []
+
+def module_service(path):
+    """Returns the string returned by the service() function of a tool
+    module source file or None if it cannot be read without running it.
+    """
+    for node in _parse(path).body:
+        if isinstance(node, ast.FunctionDef) and node.name == 'service':
+            for statement in node.body:
+                if (isinstance(statement, ast.Return) and
+                    isinstance(statement.value, ast.Str)):
+                    return statement.value.s
+    return None
+
+def schema_hash(path):
+    """Returns a hex digest of the contents of a tool definition file."""
+    return hashlib.sha1(open(path, 'rb').read()).hexdigest()
+
+class PluginManifest(object):
+    """Tools provided by the plugin packages in plugins_path. Each tool entry
+    is a dictionary with keys tool (the tool module name), service, plugin,
+    module (the importable module name), path (the module file), definition
+    (the parameter definition file) and schema_hash.
+
+    >>> manifest = PluginManifest(plugins_path)
+    >>> for plugin, entries in manifest.plugins():
+    ...     print plugin, [entry['service'] for entry in entries]
+    """
+
+    def __init__(self, plugins_path, path=None, log=None):
+        if path is None:
+            path = cache_dir('plugins')
+        elif not os.path.isdir(path):
+            os.makedirs(path)
+        self.plugins_path = os.path.abspath(plugins_path)
+        self.filename = os.path.join(path,
+                                     cache_key(self.plugins_path) + '.yaml')
+        self.log = log
+        self._plugins = None
+
+    def _stat(self, path):
+        return [os.path.getmtime(path), os.path.getsize(path)]
+
+    def _packages(self):
+        return sorted([name for loader, name, is_pkg in
+                       pkgutil.iter_modules([self.plugins_path]) if is_pkg])
+
+    def scan(self):
+        """Scans the plugin packages. Returns a tuple (plugins, files) where
+        plugins is a list of (plugin name, tool entries) and files holds the
+        fingerprints of the files read.
+        """
+        plugins = []
+        files = {}
+        for plugin in self._packages():
+            entries = []
+            tools_path = os.path.join(self.plugins_path, plugin, 'tools')
+            init_file = os.path.join(tools_path, '__init__.py')
+            if not os.path.exists(init_file):
+                plugins.append((plugin, entries))
+                continue
+            files[init_file] = self._stat(init_file)
+            for tool in module_all(init_file):
+                module_file = os.path.join(tools_path, tool + '.py')
+                definition_file = os.path.join(tools_path, tool + '.yaml')
+                if not os.path.exists(module_file):
+                    continue
+                files[module_file] = self._stat(module_file)
+                if not os.path.exists(definition_file):
+                    if self.log:
+                        self.log.error('[%s] Could not find defintion file %s'
+                                       % (tool, definition_file))
+                    continue
+                files[definition_file] = self._stat(definition_file)
+                service = module_service(module_file)
+                if service is None:
+                    service = tool
+                entries.append({'tool': tool,
+                                'service': service,
+                                'plugin': plugin,
+                                'module': '%s.tools.%s' % (plugin, tool),
+                                'path': module_file,
+                                'definition': definition_file,
+                                'schema_hash': schema_hash(definition_file)})
+            plugins.append((plugin, entries))
+        return plugins, files
+
+    def _read(self):
+        '''Returns the cached plugins or None if the cache is missing or out
+        of date.
+        '''
+        if not os.path.exists(self.filename):
+            return None
+        try:
+            stream = open(self.filename, 'r')
+            try:
+                data = safe_load(stream)
+            finally:
+                stream.close()
+        except (IOError, OSError, YAMLError):
+            return None
+        if not data or data.get('packages') != self._packages():
+            return None
+        for path, stat in data['files'].iteritems():
+            if not os.path.exists(path) or self._stat(path) != stat:
+                return None
+        return [(plugin['name'], plugin['tools'])
+                for plugin in data['plugins']]
+
+    def _write(self, plugins, files):
+        tmp_filename = self.filename + '.%s.tmp' % os.getpid()
+        try:
+            stream = open(tmp_filename, 'w')
+            safe_dump({'plugins_path': self.plugins_path,
+                       'packages': self._packages(),
+                       'files': files,
+                       'plugins': [{'name': plugin, 'tools': entries}
+                                   for plugin, entries in plugins]}, stream)
+            stream.close()
+            replace_file(tmp_filename, self.filename)
+        except (IOError, OSError), e:
+            # The manifest is only a cache, scanning works without it
+            if self.log:
+                self.log.warning('Could not write plugin manifest: %s' % e)
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    def plugins(self):
+        """Returns a list of (plugin name, tool entries) tuples. The cached
+        manifest is used if it is up to date, otherwise the plugins are
+        scanned and the manifest is written.
+        """
+        if self._plugins is None:
+            plugins = self._read()
+            if plugins is None:
+                if self.log:
+                    self.log.debug('Scanning plugins in %s' %
+                                   self.plugins_path)
+                plugins, files = self.scan()
+                self._write(plugins, files)
+            self._plugins = plugins
+        return self._plugins
+
+    def tools(self):
+        """Returns a dictionary of the tool entries keyed by service."""
+        tools = {}
+        for plugin, entries in self.plugins():
+            for entry in entries:
+                tools[entry['service']] = entry
+        return tools
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Run journals for resuming long batch loops. A tool records each unit of work
+(one or more output rasters) when it begins and when it is completed. If the
+run fails, a rerun with resume enabled skips the completed units and removes
+the outputs of units that were begun but not completed (partial outputs).
+
+Journals are kept in the user cache folder (USER_CACHE_DIR/journals) as text
+files with one tab separated record per line:
+
+begin   <output>
+done    <output>    <parameter hash>    <checksum>
+
+Each record is flushed to disk before the tool goes on, so the journal is
+valid even if the process is killed. A journal is removed when the run
+finishes.
+"""
+
+import os
+
+from zupport.utilities.cache import cache_dir, cache_key, sampled_checksum
+
+def _remove(path):
+    if os.path.isfile(path):
+        os.remove(path)
+
+class RunJournal(object):
+    """Journal of the units completed in a tool run. The journal is
+    identified by the tool name and key items (e.g. the tool parameters), so
+    only a run with the same parameters is resumed. If resume is False, an
+    existing journal is discarded. Remove is a function used to delete
+    partial outputs. If verify is True, completed outputs must also match
+    the recorded checksum. This is off by default, as building pyramids and
+    statistics modifies some formats (e.g. .img) after completion.
+
+    >>> journal = RunJournal('crossselect', parameters, resume=True)
+    >>> for unit in units:
+    ...     outputs = journal.pending(unit_outputs)
+    ...     if not outputs:
+    ...         continue
+    ...     journal.begin(outputs)
+    ...     compute(outputs)
+    ...     journal.complete(outputs)
+    >>> journal.finish()
+    """
+
+    def __init__(self, name, key_items=(), resume=False, remove=None,
+                 verify=False, path=None):
+        if path is None:
+            path = cache_dir('journals')
+        elif not os.path.isdir(path):
+            os.makedirs(path)
+        self.name = name
+        self.key = cache_key(name, *key_items)
+        self.filename = os.path.join(path, '%s_%s.journal' % (name, self.key))
+        if remove is None:
+            remove = _remove
+        self.remove = remove
+        self.resume = resume
+        self.verify = verify
+        # {output: (parameter hash, checksum)} and set of begun outputs
+        self.completed = {}
+        self.begun = set()
+        if resume:
+            self._read()
+        elif os.path.exists(self.filename):
+            os.remove(self.filename)
+        self._stream = None
+
+    def _key(self, path):
+        return os.path.normcase(os.path.abspath(str(path)))
+
+    def _read(self):
+        if not os.path.exists(self.filename):
+            return
+        for line in open(self.filename, 'r'):
+            # The last line may be incomplete if the process was killed
+            if not line.endswith('\n'):
+                break
+            fields = line.rstrip('\n').split('\t')
+            if fields[0] == 'begin' and len(fields) == 2:
+                self.begun.add(self._key(fields[1]))
+            elif fields[0] == 'done' and len(fields) == 4:
+                self.completed[self._key(fields[1])] = (fields[2], fields[3])
+
+    def _write(self, *fields):
+        if self._stream is None:
+            self._stream = open(self.filename, 'a')
+        self._stream.write('\t'.join([str(field) for field in fields]) + '\n')
+        self._stream.flush()
+        os.fsync(self._stream.fileno())
+
+    def _checksum(self, path):
+        if os.path.isfile(path):
+            return sampled_checksum(path)
+        return '-'
+
+    def is_complete(self, output, parameters=()):
+        """Returns True if output was completed with the same parameters and
+        still exists (and has not changed, if verify is True).
+        """
+        record = self.completed.get(self._key(output))
+        if record is None or not os.path.exists(output):
+            return False
+        if record[0] != cache_key(*parameters):
+            return False
+        return not self.verify or record[1] == self._checksum(output)
+
+    def pending(self, outputs, parameters=()):
+        """Returns the outputs that still need to be computed. Partial
+        outputs (begun but not completed) are removed.
+        """
+        pending = []
+        for output in outputs:
+            if self.is_complete(output, parameters):
+                continue
+            if self._key(output) in self.begun and os.path.exists(output):
+                self.remove(output)
+            pending.append(output)
+        return pending
+
+    def begin(self, outputs):
+        """Records that computing outputs has begun."""
+        for output in outputs:
+            self._write('begin', output)
+            self.begun.add(self._key(output))
+
+    def complete(self, outputs, parameters=()):
+        """Records that outputs have been completed."""
+        for output in outputs:
+            record = (cache_key(*parameters), self._checksum(output))
+            self._write('done', output, *record)
+            self.completed[self._key(output)] = record
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def finish(self):
+        """Closes and removes the journal, the run is complete."""
+        self.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
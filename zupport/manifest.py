@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Job manifest for skipping jobs whose inputs have not changed. When a job
+finishes, a hash of the tool name, the parameter values and the fingerprints
+of the input files is recorded together with the fingerprints of the output
+files. A later run of the same job is skipped if the hash is the same and the
+outputs still exist unchanged.
+
+Entries are kept in the user cache folder (USER_CACHE_DIR/jobs), one .yaml
+file per job identified by the tool name and the output paths.
+"""
+
+import glob
+import os
+
+from yaml import safe_load, safe_dump, YAMLError
+
+from zupport.utilities.cache import (cache_dir, cache_key, file_fingerprint,
+                                     replace_file, sampled_checksum)
+
+def _value_string(value):
+    # YAML gives the same representation for str and unicode values
+    try:
+        return safe_dump(value, default_flow_style=True)
+    except YAMLError:
+        return repr(value)
+
+class JobManifest(object):
+    """Records finished jobs and tells whether a job is up to date. Only jobs
+    declaring their outputs (Job.outputs) are recorded, inputs are taken from
+    Job.inputs. If checksum is True, a checksum of sampled parts of each file
+    is included in the fingerprints.
+
+    >>> manifest = JobManifest()
+    >>> if not manifest.is_current(job):
+    ...     job.run()
+    ...     manifest.record(job)
+    """
+
+    def __init__(self, path=None, checksum=False):
+        if path is None:
+            path = cache_dir('jobs')
+        elif not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.checksum = checksum
+
+    def _entry(self, job):
+        outputs = sorted([os.path.abspath(str(path)) for path in job.outputs])
+        return os.path.join(self.path,
+                            cache_key(job.service, *outputs) + '.yaml')
+
+    def fingerprint(self, path):
+        """Returns the fingerprint of a file or None if it does not exist."""
+        if not os.path.exists(path):
+            return None
+        fingerprint = file_fingerprint(path)
+        if self.checksum and os.path.isfile(path):
+            fingerprint['checksum'] = sampled_checksum(path)
+        return fingerprint
+
+    def input_hash(self, job):
+        """Returns a hash of the tool name, the parameter values and the
+        input file fingerprints of job.
+        """
+        items = [job.service]
+        if job.tool:
+            items.extend(['%s=%s' % (parameter.name,
+                                     _value_string(parameter.value))
+                          for parameter in job.parameters.data])
+        for path in job.inputs:
+            fingerprint = self.fingerprint(str(path))
+            if fingerprint is not None:
+                fingerprint = sorted(fingerprint.items())
+            items.append('%s:%s' % (path, fingerprint))
+        return cache_key(*items)
+
+    def _outputs(self, job):
+        return dict([(os.path.abspath(str(path)),
+                      self.fingerprint(str(path))) for path in job.outputs])
+
+    def is_current(self, job):
+        """Returns True if job has been recorded with the same input hash and
+        its outputs still exist unchanged.
+        """
+        entry = self._entry(job)
+        if not job.outputs or not os.path.exists(entry):
+            return False
+        try:
+            stream = open(entry, 'r')
+            try:
+                data = safe_load(stream)
+            finally:
+                stream.close()
+        except (IOError, OSError):
+            return False
+        if not data or data.get('input_hash') != self.input_hash(job):
+            return False
+        outputs = self._outputs(job)
+        if None in outputs.values():
+            return False
+        return data.get('outputs') == outputs
+
+    def record(self, job, since=None):
+        """Records a finished job. Returns False (and records nothing) if the
+        job does not declare outputs or some of them do not exist. If since
+        (a time stamp) is given, all outputs must also have been modified
+        after it, so stale outputs of a failed run are never recorded.
+        """
+        outputs = self._outputs(job)
+        if not outputs or None in outputs.values():
+            return False
+        if since is not None:
+            for fingerprint in outputs.itervalues():
+                if fingerprint['mtime'] < since:
+                    return False
+        entry = self._entry(job)
+        tmp_entry = entry + '.%s.tmp' % os.getpid()
+        try:
+            stream = open(tmp_entry, 'w')
+            safe_dump({'service': job.service,
+                       'input_hash': self.input_hash(job),
+                       'outputs': outputs}, stream)
+            stream.close()
+        except:
+            if os.path.exists(tmp_entry):
+                os.remove(tmp_entry)
+            raise
+        replace_file(tmp_entry, entry)
+        return True
+
+    def forget(self, job):
+        """Removes the entry of job, the next run will not be skipped."""
+        entry = self._entry(job)
+        if os.path.exists(entry):
+            os.remove(entry)
+
+    def clear(self):
+        """Removes all entries from the manifest."""
+        for entry in glob.glob(os.path.join(self.path, '*.yaml')):
+            os.remove(entry)
@@ -1,14 +1,275 @@
 import glob
 import os
 import re
+from itertools import islice
 from types import IntType
 
-from yaml import safe_load, dump
+import numpy as np
+from yaml import safe_load, safe_dump, dump
 
+from zupport.utilities.cache import (cache_dir, cache_key, file_fingerprint,
+                                     replace_file)
 from zupport.utilities.odict import OrderedDict
 
 from errors import ParseError
 
+class AsciiGrid(object):
+    """Streaming reader for ESRI ASCII grids. 
+    
+    Only the header is read when the object is created, the actual data rows 
+    are parsed block by block on demand so that the whole file never needs to 
+    be held in memory as text. Data can be read into a preallocated array, 
+    into an on-disk :class:`numpy.memmap` or iterated over as row blocks.
+    
+    >>> grid = AsciiGrid('output.rank.asc')
+    >>> for row, block in grid.iter_blocks(block_rows=512):
+    ...     process(row, block)
+    """
+    
+    # Header keywords and the types used to cast their values
+    HEADER_KEYS = {'ncols': int,
+                   'nrows': int,
+                   'xllcorner': float,
+                   'xllcenter': float,
+                   'yllcorner': float,
+                   'yllcenter': float,
+                   'cellsize': float,
+                   'nodata_value': float}
+
+    def __init__(self, path, dtype=float):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.header = {}
+        # Byte offset of the first data row
+        self._offset = 0
+        self.read_header()
+        
+    def __str__(self):
+        return '%s (%s rows, %s columns)' % (self.path, self.nrows, self.ncols)
+
+    @property
+    def cellsize(self):
+        return self.header['cellsize']
+
+    @property
+    def ncols(self):
+        return self.header['ncols']
+
+    @property
+    def nodata(self):
+        """NoData value cast to the grid dtype, None if the header does not 
+        define one."""
+        if 'nodata_value' in self.header:
+            return self.dtype.type(self.header['nodata_value'])
+        else:
+            return None
+
+    @property
+    def nrows(self):
+        return self.header['nrows']
+
+    @property
+    def shape(self):
+        return (self.nrows, self.ncols)
+
+    @property
+    def xllcorner(self):
+        if 'xllcorner' in self.header:
+            return self.header['xllcorner']
+        else:
+            return self.header['xllcenter'] - self.cellsize / 2.0
+
+    @property
+    def yllcorner(self):
+        if 'yllcorner' in self.header:
+            return self.header['yllcorner']
+        else:
+            return self.header['yllcenter'] - self.cellsize / 2.0
+
+    def read_header(self):
+        """Parses the header lines of the grid. Header ends at the first line
+        that does not start with a known keyword, so the number of header
+        lines does not need to be known beforehand.
+        """
+        infile = open(self.path, 'r')
+        try:
+            while True:
+                offset = infile.tell()
+                line = infile.readline()
+                fields = line.split()
+                if not fields or fields[0].lower() not in self.HEADER_KEYS:
+                    break
+                key = fields[0].lower()
+                try:
+                    self.header[key] = self.HEADER_KEYS[key](fields[1])
+                except (IndexError, ValueError):
+                    raise ParseError('Invalid header line in %s: %s' % 
+                                     (self.path, line.strip()))
+        finally:
+            infile.close()
+        
+        self._offset = offset
+        
+        for key in ['ncols', 'nrows', 'cellsize']:
+            if key not in self.header:
+                raise ParseError('Header keyword %s missing from %s' % 
+                                 (key, self.path))
+        if not ('xllcorner' in self.header or 'xllcenter' in self.header) or \
+           not ('yllcorner' in self.header or 'yllcenter' in self.header):
+            raise ParseError('Lower left coordinates missing from %s' % 
+                             self.path)
+
+    def iter_blocks(self, block_rows=256):
+        """Generator yielding (row, array) tuples where row is the index of 
+        the first row in the block and array is a (block_rows, ncols) array.
+        The last block may hold less rows. 
+        """
+        if block_rows < 1:
+            raise ValueError('block_rows must be a positive integer')
+        
+        infile = open(self.path, 'r')
+        try:
+            infile.seek(self._offset)
+            row = 0
+            leftover = np.empty(0, dtype=self.dtype)
+            while row < self.nrows:
+                lines = list(islice(infile, block_rows))
+                if not lines:
+                    break
+                values = np.fromstring(''.join(lines), dtype=self.dtype, 
+                                       sep=' ')
+                if leftover.size:
+                    values = np.concatenate((leftover, values))
+                # Rows may be wrapped on several lines, only yield full rows
+                nfull = min(values.size // self.ncols, self.nrows - row)
+                if nfull > 0:
+                    yield row, values[:nfull * self.ncols].reshape(nfull, 
+                                                                   self.ncols)
+                leftover = values[nfull * self.ncols:]
+                row += nfull
+        finally:
+            infile.close()
+            
+        if row < self.nrows or leftover.size:
+            raise ParseError('Grid %s should have %s x %s values' % 
+                             (self.path, self.nrows, self.ncols))
+
+    def read(self, out=None, block_rows=256):
+        """Reads the whole grid into array out, which must have the same shape
+        as the grid. If out is not provided, a new array is allocated.
+        """
+        if out is None:
+            out = np.empty(self.shape, dtype=self.dtype)
+        elif out.shape != self.shape:
+            raise ValueError('Output shape %s does not match grid shape %s' %
+                             (out.shape, self.shape))
+        for row, block in self.iter_blocks(block_rows):
+            out[row:row + block.shape[0]] = block
+        return out
+
+    def to_memmap(self, filename, block_rows=256):
+        """Reads the whole grid into an on-disk memory map in filename and
+        returns the memory mapped array.
+        """
+        out = np.memmap(filename, dtype=self.dtype, mode='w+', 
+                        shape=self.shape)
+        self.read(out, block_rows)
+        out.flush()
+        return out
+
+class GridCache(object):
+    """Binary cache for parsed ESRI ASCII grids. 
+    
+    A grid is parsed from text only once and stored as a .npy file together 
+    with a .yaml file holding the grid header and the fingerprint (path, 
+    modification time and size) of the source file. Later reads of an 
+    unchanged source are served as memory maps from the cache. A changed
+    source replaces the old cache entry.
+    """
+    
+    def __init__(self, path=None):
+        if path is None:
+            path = cache_dir('grids')
+        elif not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+
+    def _entry(self, filename, dtype):
+        key = cache_key(os.path.abspath(filename), np.dtype(dtype).str)
+        return (os.path.join(self.path, key + '.npy'), 
+                os.path.join(self.path, key + '.yaml'))
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        for entry in glob.glob(os.path.join(self.path, '*.npy')) + \
+                     glob.glob(os.path.join(self.path, '*.yaml')):
+            os.remove(entry)
+
+    def get(self, filename, dtype=float, mmap_mode='r'):
+        """Returns a tuple (array, header) for filename if an up-to-date entry
+        exists in the cache, otherwise None.
+        """
+        datafile, metafile = self._entry(filename, dtype)
+        if not os.path.exists(datafile) or not os.path.exists(metafile):
+            return None
+        try:
+            stream = open(metafile, 'r')
+            try:
+                meta = safe_load(stream)
+            finally:
+                stream.close()
+        except (IOError, OSError):
+            return None
+        if not meta or meta.get('fingerprint') != file_fingerprint(filename):
+            return None
+        return np.load(datafile, mmap_mode=mmap_mode), meta['header']
+
+    def load(self, filename, dtype=float, block_rows=256, mmap_mode='r'):
+        """Returns a tuple (array, header) for filename, parsing and caching
+        the grid first if needed.
+        """
+        entry = self.get(filename, dtype, mmap_mode)
+        if entry is None:
+            self.put(filename, dtype, block_rows)
+            entry = self.get(filename, dtype, mmap_mode)
+        return entry
+
+    def put(self, filename, dtype=float, block_rows=256):
+        """Parses filename and stores the result in the cache. The grid is 
+        streamed straight into the .npy file so it never needs to fit into
+        memory.
+        """
+        grid = AsciiGrid(filename, dtype=dtype)
+        fingerprint = file_fingerprint(filename)
+        datafile, metafile = self._entry(filename, dtype)
+        
+        # Write into per process temporary files first so that an interrupted
+        # write never leaves a valid looking entry behind and concurrent 
+        # workers putting the same grid do not write over each other
+        suffix = '.%s.tmp' % os.getpid()
+        tmp_datafile = datafile + suffix
+        tmp_metafile = metafile + suffix
+        try:
+            out = np.lib.format.open_memmap(tmp_datafile, mode='w+', 
+                                            dtype=grid.dtype, 
+                                            shape=grid.shape)
+            grid.read(out, block_rows)
+            out.flush()
+            del out
+            
+            meta = {'fingerprint': fingerprint, 'header': grid.header}
+            stream = open(tmp_metafile, 'w')
+            safe_dump(meta, stream)
+            stream.close()
+        except:
+            for tmpfile in [tmp_datafile, tmp_metafile]:
+                if os.path.exists(tmpfile):
+                    os.remove(tmpfile)
+            raise
+        
+        replace_file(tmp_datafile, datafile)
+        replace_file(tmp_metafile, metafile)
+
 class FileGroupIterator(object):
     
     def __init__(self, inputws, wildcard, template, grouptags=None, 
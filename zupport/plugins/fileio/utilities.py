@@ -165,6 +165,19 @@ def get_nodata_number(dtype):
         return -3.40282346639e+38
     elif dtype in ['float64', 'F64', '64_BIT']:
         return -1.79769313486e+308
+    # Unsigned integers use the largest and signed integers the smallest value
+    elif dtype in ['uint8', 'U8', '8_BIT_UNSIGNED']:
+        return 255
+    elif dtype in ['uint16', 'U16', '16_BIT_UNSIGNED']:
+        return 65535
+    elif dtype in ['uint32', 'U32', '32_BIT_UNSIGNED']:
+        return 4294967295
+    elif dtype in ['int8', 'S8', '8_BIT_SIGNED']:
+        return -128
+    elif dtype in ['int16', 'S16', '16_BIT_SIGNED']:
+        return -32768
+    elif dtype in ['int32', 'S32', '32_BIT_SIGNED']:
+        return -2147483648
     
 def pixeltype_to_pixeltype(from_type, to_type):
     '''Function to convert different types of pixel type abbreviations to other
@@ -6,7 +6,9 @@
 #except ImportError, e:
 #    raise e
 
+from attributes import *
 from core import *
 from errors import *
+from pyramids import *
 from tools import *
 from utilities import *
\ No newline at end of file
@@ -0,0 +1,184 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Attribute profiles of tables and feature classes. A profile holds the unique
+values, value counts and value combinations (co-occurrence) of a set of fields
+and is collected in a single pass over the rows. Profiles are cached in the
+user cache folder and validated against the modification time of the dataset,
+so tools working on the same fields of an unchanged dataset do not need to
+scan it again.
+"""
+
+import glob
+import os
+
+from yaml import safe_load, safe_dump
+
+from zupport.utilities.cache import (cache_dir, cache_key, file_fingerprint,
+                                     replace_file)
+
+# Extensions of the file system geodatabases
+GEODATABASE_TYPES = ['.gdb', '.mdb']
+
+class AttributeProfile(object):
+    """Counts of the value combinations of fields. Value counts and unique
+    values of the individual fields are derived from the combinations.
+
+    >>> profile = AttributeProfile.from_rows(gp.SearchCursor(table),
+    ...                                      ['LAND', 'SOIL'])
+    >>> profile.uniques('LAND')
+    [1, 2, 3]
+    """
+
+    def __init__(self, fields, combinations=None):
+        self.fields = list(fields)
+        # {(value1, value2, ...): count}
+        self.combinations = {}
+        if combinations:
+            self.combinations.update(combinations)
+
+    @classmethod
+    def from_rows(cls, rows, fields):
+        """Returns a profile of fields collected from rows (a geoprocessor
+        cursor or any iterable of objects with a getValue method).
+        """
+        profile = cls(fields)
+        combinations = profile.combinations
+        for row in rows:
+            combination = tuple([row.getValue(field) for field in fields])
+            combinations[combination] = combinations.get(combination, 0) + 1
+        return profile
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['fields'],
+                   [(tuple(combination), count) for combination, count
+                    in data['combinations']])
+
+    def to_dict(self):
+        return {'fields': self.fields,
+                'combinations': [[list(combination), count] for
+                                 combination, count in
+                                 self.combinations.iteritems()]}
+
+    @property
+    def nrows(self):
+        return sum(self.combinations.itervalues())
+
+    def counts(self, field):
+        """Returns a dictionary {value: count} for field."""
+        i = self.fields.index(field)
+        counts = {}
+        for combination, count in self.combinations.iteritems():
+            value = combination[i]
+            counts[value] = counts.get(value, 0) + count
+        return counts
+
+    def uniques(self, field):
+        """Returns a sorted list of the unique values of field. NULL values
+        are not included.
+        """
+        return sorted([value for value in self.counts(field)
+                       if value is not None])
+
+    def select(self, conditions):
+        """Returns a dictionary {combination: count} of the combinations
+        matching conditions. Conditions is a dictionary {field: values} where
+        values is a list of accepted values or None for all values.
+        Combinations with NULL values are never selected.
+        """
+        selectors = [(self.fields.index(field), values) for field, values
+                     in conditions.iteritems()]
+        selected = {}
+        for combination, count in self.combinations.iteritems():
+            if None in combination:
+                continue
+            for i, values in selectors:
+                if values is not None and combination[i] not in values:
+                    break
+            else:
+                selected[combination] = count
+        return selected
+
+def dataset_fingerprint(dataset):
+    """Returns the fingerprint of the file holding the attributes of dataset
+    or None if dataset is not in the file system (e.g. in_memory). Feature
+    classes in geodatabases use the geodatabase and shapefiles the .dbf file.
+    """
+    if dataset.lower().startswith('in_memory'):
+        return None
+    path = os.path.abspath(dataset)
+    if not os.path.exists(path):
+        # Feature class or table in a geodatabase
+        while os.path.splitext(path)[1].lower() not in GEODATABASE_TYPES:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+        if not os.path.exists(path):
+            return None
+    if path.lower().endswith('.shp'):
+        dbf = os.path.splitext(path)[0] + '.dbf'
+        if os.path.exists(dbf):
+            path = dbf
+    return file_fingerprint(path)
+
+class AttributeProfileCache(object):
+    """Cache for attribute profiles. Each entry is a .yaml file holding the
+    profile and the fingerprint of the dataset it was collected from.
+    Profiles of datasets that are not in the file system are not cached.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            path = cache_dir('attributes')
+        elif not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+
+    def _entry(self, dataset, fields):
+        key = cache_key(os.path.abspath(dataset), *fields)
+        return os.path.join(self.path, key + '.yaml')
+
+    def clear(self):
+        """Removes all entries from the cache."""
+        for entry in glob.glob(os.path.join(self.path, '*.yaml')):
+            os.remove(entry)
+
+    def get(self, dataset, fields):
+        """Returns the profile of fields in dataset if an up-to-date entry
+        exists in the cache, otherwise None.
+        """
+        fingerprint = dataset_fingerprint(dataset)
+        entry = self._entry(dataset, fields)
+        if fingerprint is None or not os.path.exists(entry):
+            return None
+        try:
+            stream = open(entry, 'r')
+            try:
+                data = safe_load(stream)
+            finally:
+                stream.close()
+        except (IOError, OSError):
+            return None
+        if not data or data.get('fingerprint') != fingerprint:
+            return None
+        return AttributeProfile.from_dict(data['profile'])
+
+    def put(self, dataset, profile):
+        """Stores profile of dataset in the cache."""
+        fingerprint = dataset_fingerprint(dataset)
+        if fingerprint is None:
+            return
+        entry = self._entry(dataset, profile.fields)
+        tmp_entry = entry + '.%s.tmp' % os.getpid()
+        try:
+            stream = open(tmp_entry, 'w')
+            safe_dump({'fingerprint': fingerprint,
+                       'profile': profile.to_dict()}, stream)
+            stream.close()
+        except:
+            if os.path.exists(tmp_entry):
+                os.remove(tmp_entry)
+            raise
+        replace_file(tmp_entry, entry)
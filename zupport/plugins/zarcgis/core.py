@@ -4,14 +4,26 @@
 import os
 import sys
 import glob
+import tempfile
 
+import numpy as np
 from arcpy import Result
 
 from zupport.core import ParameterError, Tool
+from zupport.journal import RunJournal
 from zupport.plugins.fileio import (FileGroupIterator, ParseError, 
 								    ParsedFileName, Workspace)
-from zupport.plugins.zarcgis.utilities import get_geoprocessor
+from zupport.plugins.zarcgis.attributes import (AttributeProfile, 
+											 AttributeProfileCache)
+from zupport.plugins.zarcgis.utilities import (checkout_extension, 
+											   shared_geoprocessor)
 from zupport.plugins.zarcgis.errors import LicenseError
+from zupport.plugins.zarcgis.pyramids import PyramidQueue
+from zupport.raster import (ArrayRaster, BlockEngine, GDAL_AVAILABLE, 
+							GDAL_DRIVERS, LazyRaster, RasterAdapter, 
+							to_pixel_type)
+from zupport.raster import create_raster as create_gdal_raster
+from zupport.raster import open_raster as open_gdal_raster
 from zupport.zlogging import ArcLogger
 
 #===============================================================================
@@ -105,6 +117,70 @@ class ArcRasterGroupIterator(FileGroupIterator):
 	def parse_workspace(self, template, inputws, wildcard):
 		return ArcParsedRasterWorkspace(self.parent, template, inputws, wildcard)
 
+class ArcRaster(RasterAdapter):
+	"""Raster adapter reading windows of an ArcGIS raster (e.g. a raster in a
+	file geodatabase) with RasterToNumPyArray.
+	"""
+	
+	def __init__(self, gp, path):
+		self.gp = gp
+		self.raster = gp.Raster(path)
+		self.path = path
+		self.shape = (self.raster.height, self.raster.width)
+		self.pixel_type = to_pixel_type(self.raster.pixelType)
+		self.nodata = self.raster.noDataValue
+		self.geotransform = (self.raster.extent.XMin, 
+							self.raster.meanCellWidth, 0, 
+							self.raster.extent.YMax, 0, 
+							-self.raster.meanCellHeight)
+		if self.raster.spatialReference:
+			self.projection = self.raster.spatialReference.exportToString()
+		
+	def read_window(self, window):
+		# RasterToNumPyArray needs the lower left corner of the window in map
+		# coordinates
+		llc = self.gp.Point(self.geotransform[0] + 
+							window.col * self.geotransform[1],
+							self.geotransform[3] + 
+							(window.row + window.nrows) * self.geotransform[5])
+		return self.gp.RasterToNumPyArray(self.raster, lower_left_corner=llc,
+										ncols=window.ncols, nrows=window.nrows)
+
+class ArcOutputRaster(ArrayRaster):
+	"""Raster adapter for outputs that GDAL can not write (e.g. rasters in a 
+	file geodatabase). Blocks are written into a temporary memory map which is
+	converted into an ArcGIS raster with NumPyArrayToRaster when the adapter is
+	closed.
+	"""
+	
+	def __init__(self, gp, path, like, pixel_type, nodata):
+		self.gp = gp
+		fd, self._tmpfile = tempfile.mkstemp(suffix='.mmap')
+		os.close(fd)
+		array = np.memmap(self._tmpfile, dtype=to_pixel_type(pixel_type), 
+						mode='w+', shape=like.shape)
+		ArrayRaster.__init__(self, array, nodata, like.geotransform, 
+							like.projection, path)
+		
+	def close(self):
+		if self.array is None:
+			return
+		self.array.flush()
+		llc = self.gp.Point(self.geotransform[0], 
+							self.geotransform[3] + 
+							self.shape[0] * self.geotransform[5])
+		raster = self.gp.NumPyArrayToRaster(self.array, lower_left_corner=llc,
+											x_cell_size=self.geotransform[1],
+											y_cell_size=-self.geotransform[5],
+											value_to_nodata=self.nodata)
+		raster.save(self.path)
+		del raster
+		self.array = None
+		os.remove(self._tmpfile)
+
+# Parameters that do not affect the outputs of a tool run
+JOURNAL_IGNORED = ['debug', 'help', 'pyramids', 'resume']
+
 class ArcTool(Tool):
 	
 	"""
@@ -128,12 +204,14 @@ class ArcTool(Tool):
 
 	Setting the workspace is the responsibility of subclasses.
 	"""
+	
+	# ArcGIS extensions (e.g. 'spatial') the tool needs in order to run
+	extensions = []
 
 	def __init__(self, parameters, service, *args, **kwargs):
-		"""Constructor initializes the Geoprocessor using
-		:mod:`arcgisscripting` and loops thorugh all the available parameters
-		in the Geoprocessor. Will raise an exception if problems occur with the
-		Geoprocessor. Parameters are intended to be used in subclasses.
+		"""Constructor only sets up the tool, the Geoprocessor is acquired and
+		extension licenses are checked out when the tool is used. Parameters 
+		are intended to be used in subclasses.
 		
 		Parameters:
 		parameters - parameters object holding parameter information
@@ -143,74 +221,214 @@ class ArcTool(Tool):
 		
 		self._backend = 'arcgis'
 		
-		# TODO: handle the ArcGIS versions correctly
-		try:
-		
-			# Inialize the logger for this tool. Logging system must be set up
-			# before doing thishis
-			self.logger = ArcLogger("Zupport.ArcTool", debugging=True)
-			self.logger.debug('[%s] Acquiring geoprocessor' % service)
-			self.gp = get_geoprocessor(10)
-			# Set the scratch workspace explicitly to ESRI default
-			self.gp.ScratchWorkspace = os.path.join(os.path.expanduser('~'), 
-														'AppData', 'Local', 
-														'Temp')
-		
-		except ImportError, e:
-			self.logger.error('ArcGIS not present in the system.')
-			sys.exit(1)
-		except:
-			raise
+		# Inialize the logger for this tool. Logging system must be set up
+		# before doing thishis
+		self.logger = ArcLogger("Zupport.ArcTool", debugging=True)
+		# The geoprocessor is acquired on first use (see gp)
+		self._gp = None
+		# Parameters are read from the geoprocessor when the tool is run
+		self._gp_parameters = False
+
+	@property
+	def gp(self):
+		"""Geoprocessor shared by all the tools. It is acquired when a tool 
+		first needs it, so creating tools does not touch ArcGIS.
+		"""
+		if self._gp is None:
+			# TODO: handle the ArcGIS versions correctly
+			try:
+				self.logger.debug('[%s] Acquiring geoprocessor', self.service)
+				self._gp = shared_geoprocessor(10)
+			except ImportError, e:
+				self.logger.error('ArcGIS not present in the system.')
+				sys.exit(1)
+		return self._gp
 
 	def register_extension(self, extension):
+		"""Checks out a license for extension right away. Raises LicenseError
+		if the extension is not available.
+		"""
+		checkout_extension(self.gp, extension)
+
+	def validate_parameters(self):
+		"""Validates the parameters and checks out the licenses for the 
+		extensions the tool needs (self.extensions). Tools call this when run,
+		so licenses are checked out only for the tools that are actually run.
+		Parameters provided by ArcGIS (see update) are read first. Invalid
+		parameters and missing licenses are logged and the tool is not ready,
+		so tools must check self.ready afterwards.
+		"""
+		if self._gp_parameters:
+			try:
+				self.read_gp_parameters()
+			except ParameterError, e:
+				self.logger.exception('%s' % e)
+				self.ready = False
+				return
+		self.gp.LogHistory = self.logger.debugging
+		Tool.validate_parameters(self)
+		for extension in self.extensions:
+			try:
+				self.register_extension(extension)
+			except LicenseError, e:
+				self.logger.error(e)
+				self.ready = False
+				return
+
+	def open_raster(self, path):
+		"""Returns a raster adapter (see :mod:`zupport.raster`) for reading a
+		raster. GDAL is used if it is available and the raster is in the file
+		system, otherwise the raster is read through ArcGIS. In a lazy chain 
+		of tools, rasters deferred by the previous tools are returned as is.
+		"""
+		if self.graph is not None and path in self.graph:
+			return self.graph.get(path)
+		if GDAL_AVAILABLE and '.gdb' not in path.lower():
+			return open_gdal_raster(path)
+		if not self.gp.Exists(path):
+			raise ParameterError('Path provided does not exist: %s' % path)
+		return ArcRaster(self.gp, path)
+
+	def write_deferred(self, path):
+		"""Writes raster path if it was deferred by a previous tool of a lazy
+		chain, so that it can be read by ArcGIS. Returns path.
+		"""
+		if self.graph is not None and path in self.graph:
+			self.graph.materialize(log=self.logger, paths=[path])
+		return path
+
+	def create_raster(self, path, like, pixel_type, nodata):
+		"""Returns a raster adapter for a new raster with the same dimensions
+		and georeferencing as raster adapter like. GDAL is used for the raster
+		formats it can write, otherwise the raster is written through ArcGIS.
+		"""
+		ext = os.path.splitext(path)[1].lower()
+		if (GDAL_AVAILABLE and '.gdb' not in path.lower() and 
+			ext in GDAL_DRIVERS):
+			return create_gdal_raster(path, like, pixel_type, nodata)
+		return ArcOutputRaster(self.gp, path, like, pixel_type, nodata)
+
+	def open_journal(self, resume=False):
+		"""Returns a run journal (see :mod:`zupport.journal`) for this tool.
+		The journal is identified by the parameter values, so only a run with
+		the same parameters is resumed. Partial outputs are deleted through 
+		the geoprocessor.
+		"""
+		key_items = ['%s=%r' % (parameter.name, parameter.value) for parameter
+					 in self.parameters.data 
+					 if parameter.name not in JOURNAL_IGNORED]
+		return RunJournal(self.service, key_items, resume=bool(resume),
+						  remove=self.gp.Delete_management)
+
+	def pyramid_queue(self, mode):
+		"""Returns a PyramidQueue building pyramids in mode. In a run of 
+		several jobs (self.post_queues is set) the queue is shared by the jobs
+		and finished after the last job, otherwise the tool finishes it with
+		finish_queue.
+		"""
+		queue = PyramidQueue(self.gp, mode, log=self.logger)
+		if self.post_queues is not None:
+			queue = self.post_queues.setdefault(('pyramids', queue.mode), 
+												queue)
+		return queue
+
+	def finish_queue(self, queue):
+		"""Finishes queue unless it is shared by the jobs of a run."""
+		if self.post_queues is None:
+			queue.finish()
+
+	def compute_raster(self, inputs, path, func, pixel_type, nodata, 
+					   engine=BlockEngine, **kwargs):
+		"""Computes raster path by applying func to the blocks of the input
+		raster adapters with engine (BlockEngine or BlockPipeline, kwargs are
+		passed to it). The inputs are closed afterwards. 
+		
+		In a lazy chain of tools (self.graph is set) nothing is computed yet,
+		the raster is deferred into the graph and owns the inputs. Returns the
+		number of blocks processed, 0 if the raster was deferred.
+		"""
+		if self.graph is not None:
+			self.logger.debug('Deferring %s', path)
+			self.graph.defer(path, LazyRaster(func, inputs, inputs[0], 
+											  pixel_type, nodata), 
+							 self.create_raster)
+			return 0
+		
+		output = self.create_raster(path, like=inputs[0], 
+									pixel_type=pixel_type, nodata=nodata)
 		try:
-			if self.gp.CheckExtension(extension ) == "Available":
-				self.gp.CheckOutExtension(extension)
-			else:
-				raise LicenseError(extension)
-		except LicenseError, e:
-			raise
+			nblocks = engine(inputs, output, **kwargs).run(func)
+		finally:
+			for raster in inputs + [output]:
+				raster.close()
+		return nblocks
+
+	def profile_fields(self, dataset, fields):
+		"""Returns an attribute profile (unique values, counts and value
+		combinations) of fields in dataset. The dataset is scanned only if no 
+		up-to-date profile of the same fields is found in the cache.
+		"""
+		cache = AttributeProfileCache()
+		profile = cache.get(dataset, fields)
+		if profile is None:
+			self.logger.debug('Profiling fields %s of %s', ', '.join(fields), 
+							  dataset)
+			# Only the profiled fields are read
+			rows = self.gp.SearchCursor(dataset, '', '', ';'.join(fields))
+			profile = AttributeProfile.from_rows(rows, fields)
+			del rows
+			try:
+				cache.put(dataset, profile)
+			except (IOError, OSError), e:
+				self.logger.warning('Could not cache attribute profile: %s' % e)
+		return profile
+
+	def read_gp_parameters(self):
+		""" Sets the parameter values provided by the geoprocessor (tool 
+		called from ArcGIS). Nothing is done if there are none.
+		"""
+		self._gp_parameters = False
+		paramsno = int(self.gp.GetArgumentCount())
+		if paramsno == 0:
+			return
+		
+		# Last parameter toggles debugging
+		self.logger.debugging = bool(self.gp.GetParameter(paramsno - 1))
+		
+		self.logger.debug(str(paramsno))
+		
+		gp_parameters = self.gp.GetParameterInfo()
+		#self.logger.debug(self.parameters.parameter_names)
+		for n in range(paramsno):
+			self.logger.debug('param: ' + str(n))
+			self.logger.debug('name: ' + gp_parameters[n].name)
+			self.logger.debug('value: ' + str(gp_parameters[n].value))
+			self.parameters.set_parameter_value(n, gp_parameters[n].value)
 
 	def update(self, use_gp_params, gui, *args, **kwargs):
 		""" Parse the provided *args and **kwargs into Parameters object 
-		(self.parameters).
+		(self.parameters). If use_gp_params is True (tool called from ArcGIS),
+		the parameters provided by the geoprocessor override them when the 
+		tool is run, so updating a tool does not acquire the geoprocessor.
 		"""
-			
-		paramsno = int(self.gp.GetArgumentCount())
 		
 		try:
 			if gui:
 				self.logger.gui = True
 			
-			# If parameters come from gp -> Tool being called from ArcGIS
-			if paramsno > 0 and use_gp_params:
-		
-				# Last parameter toggles debugging
-				self.logger.debugging = bool(self.gp.GetParameter(paramsno - 1))
-				
-				self.logger.debug(str(paramsno))
-				
-				gp_parameters = self.gp.GetParameterInfo()
-				#self.logger.debug(self.parameters.parameter_names)
-				for n in range(paramsno):
-					self.logger.debug('param: ' + str(n))
-					self.logger.debug('name: ' + gp_parameters[n].name)
-					self.logger.debug('value: ' + str(gp_parameters[n].value))
-					self.parameters.set_parameter_value(n, gp_parameters[n].value)
-					
-			# Otherwise parameters are provided as args or kwargs, this is also
-			# the case if parameters are processed and provided for at batch 
+			# Parameters are provided as args or kwargs, this is also the 
+			# case if parameters are processed and provided for at batch 
 			# operation (parameters from ArcGIS form are different to those
 			# provided for the actual tool)
-			else:
-				Tool.update(self, *args, **kwargs)
-				self.logger.debugging = bool(self.get_parameter('debug'))
+			Tool.update(self, *args, **kwargs)
+			self.logger.debugging = bool(self.get_parameter('debug'))
 			
-			self.gp.LogHistory = self.logger.debugging
+			# If parameters come from gp -> Tool being called from ArcGIS
+			self._gp_parameters = use_gp_params
 			self.ready = True
 		
 		except ParameterError, e:
-			self.log.exception('%s' % e)
+			self.logger.exception('%s' % e)
 
 	def _setWorkspace(self, value):
 		if value is None or self.gp.Exists(value):
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Post-processing queue for building pyramids and statistics of output rasters.
+Instead of building pyramids right after each output, tools add the outputs
+into a PyramidQueue which builds them according to the selected mode:
+
+IMMEDIATE  - build right away (the old behaviour)
+DEFERRED   - build all at the end of the run
+BACKGROUND - build concurrently with the run on worker threads
+NONE       - do not build pyramids or statistics
+
+Background workers build pyramids with GDAL (which releases the GIL), so only
+rasters GDAL can write are built in the background. The geoprocessor is not
+thread safe, other rasters are built at the end of the run.
+
+Tools get their queue from ArcTool.pyramid_queue. When several jobs are run
+(Manager.run_jobs) the queue is shared by the jobs and finished after the last
+job, so pyramids of earlier outputs are built while the later jobs run.
+"""
+
+import os
+import sys
+import threading
+from Queue import Queue
+
+from zupport.raster import GDAL_AVAILABLE, GDAL_DRIVERS, build_overviews
+
+PYRAMID_MODES = ['IMMEDIATE', 'DEFERRED', 'BACKGROUND', 'NONE']
+
+# Marks the end of the rasters in the queue
+_STOP = object()
+
+class PyramidQueue(object):
+    """Builds pyramids and statistics for output rasters.
+
+    >>> pyramids = PyramidQueue(self.gp, 'BACKGROUND', log=self.log)
+    >>> pyramids.add(outraster)
+    >>> pyramids.finish()
+    """
+
+    def __init__(self, gp, mode='BACKGROUND', workers=1, statistics=True,
+                 log=None):
+        if mode is None:
+            mode = 'BACKGROUND'
+        mode = str(mode).upper()
+        if mode not in PYRAMID_MODES:
+            raise ValueError('Unknown pyramid mode: %s' % mode)
+        self.gp = gp
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.statistics = statistics
+        self.log = log
+        self.built = []
+        self._deferred = []
+        self._queue = None
+        self._threads = []
+        self._errors = []
+
+    def _in_background(self, path):
+        ext = os.path.splitext(path)[1].lower()
+        return (GDAL_AVAILABLE and '.gdb' not in path.lower() and
+                ext in GDAL_DRIVERS)
+
+    def _build(self, path):
+        if self.log:
+            self.log.debug('Building pyramids for %s', path)
+        self.gp.BuildPyramids_management(path)
+        if self.statistics:
+            self.gp.CalculateStatistics_management(path)
+        self.built.append(path)
+
+    def _work(self):
+        while True:
+            path = self._queue.get()
+            if path is _STOP:
+                return
+            try:
+                if self.log:
+                    self.log.debug('Building pyramids for %s in the '
+                                   'background', path)
+                build_overviews(path, statistics=self.statistics)
+                self.built.append(path)
+            except:
+                self._errors.append(sys.exc_info())
+
+    def _start(self):
+        self._queue = Queue()
+        self._threads = [threading.Thread(target=self._work)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def add(self, path):
+        """Adds an output raster into the queue."""
+        if self.mode == 'NONE':
+            return
+        elif self.mode == 'IMMEDIATE':
+            self._build(path)
+        elif self.mode == 'BACKGROUND' and self._in_background(path):
+            if self._queue is None:
+                self._start()
+            self._queue.put(path)
+        else:
+            self._deferred.append(path)
+
+    def finish(self):
+        """Builds the deferred rasters and waits for the background workers
+        to finish. The first error raised by a worker is reraised. Returns
+        the number of rasters built.
+        """
+        if self._deferred and self.log:
+            self.log.info('Building pyramids for %s rasters' %
+                          len(self._deferred))
+        while self._deferred:
+            self._build(self._deferred.pop(0))
+
+        if self._queue is not None:
+            for thread in self._threads:
+                self._queue.put(_STOP)
+            for thread in self._threads:
+                thread.join()
+            self._queue = None
+            self._threads = []
+
+        if self._errors:
+            error = self._errors[0]
+            self._errors = []
+            raise error[0], error[1], error[2]
+        return len(self.built)
@@ -3,7 +3,11 @@ import types
 from zope.interface import implements
 from zupport.interfaces import IGISTool
 
-from ..core import ArcTool, LicenseError
+from ..core import ArcTool
+from ..utilities import aggregate_with_nodata, optional_parameter
+from zupport.plugins.fileio import get_nodata_number
+from zupport.raster import (AGGREGATE_METHODS, aggregate_pixel_type, 
+                            aggregate_raster, aggregate_template)
 from zupport.utilities import (ARC_RASTER_TYPES, msgInitStart, msgInitSuccess)
 from zupport.zlogging import ArcLogger
 
@@ -57,12 +61,29 @@ class Aggregate(ArcTool):
     (7) Raster type [raster_type] 
     
         String file extension for output raster type (optional)
+        
+    (8) Debug [debug]
+    
+        Boolean defining whether debugging is enabled
+        
+    (9) Method [method]
+    
+        String aggregation method: SUM, MEAN, MIN, MAX or MEDIAN 
+        (optional, default: SUM)
+    
+    If neither extent nor mask is given, the raster is aggregated block by 
+    block without Spatial Analyst.
     
 
     """
     implements(IGISTool)
 
     id = 0
+    # Input raster is read by path, it can be deferred by the previous tool
+    reads_deferred = True
+    # Tool needs spatial analyst in order to run, the license is checked out
+    # when the tool is run
+    extensions = ['spatial']
 
     def __init__(self, parameters, service, *args, **kwargs):
         ArcTool.__init__(self, parameters, service, *args, **kwargs)
@@ -76,14 +97,6 @@ class Aggregate(ArcTool):
                                              debugging=True)
         
         self.log.debug(msgInitStart)
-        # Tool needs spatial analyst in order to run
-        # TODO: this should be moved to ToolValidator
-        try:
-            self.register_extension('spatial')
-        except LicenseError, e:
-            self.log.error(e)
-            return 1
-        
         self.service = service
         
         self.log.debug(msgInitSuccess)
@@ -98,79 +111,84 @@ class Aggregate(ArcTool):
         if self.ready:
             try:
     
-                inraster = str(self.get_parameter(0))
-                outraster = str(self.get_parameter(1))
-                factor = self.get_parameter(2)
-                nodata = self.get_parameter(3)
-                raster_type = str(self.get_parameter(4))
-                extent = str(self.get_parameter(5))
-                snap_raster = str(self.get_parameter(6))
-                mask = self.get_parameter(7)
+                inraster = str(self.get_parameter('input_raster'))
+                outraster = str(self.get_parameter('output_raster'))
+                factor = self.get_parameter('cell_factor')
+                nodata = self.get_parameter('nodata_mode')
+                extent = optional_parameter(self.get_parameter('extent'))
+                mask = optional_parameter(self.get_parameter('mask'))
+                raster_type = str(self.get_parameter('raster_type'))
                 raster_type = ARC_RASTER_TYPES[raster_type]
-                self.log.debugging = self.get_parameter(8)
+                self.log.debugging = self.get_parameter('debug')
+                method = self.get_parameter('method')
+                if method not in AGGREGATE_METHODS:
+                    raise ValueError('Unknown aggregation method: %s' % method)
+                pyramids = self.pyramid_queue(self.get_parameter('pyramids'))
                 
                 # Fix the outraster name
                 # TODO: do this is more sensible way
                 if outraster.endswith('.'):
                     outraster = outraster.replace('.', raster_type)
-                    self.log.debug('Output raster name extension fixed to: %s' % outraster)
+                    self.log.debug('Output raster name extension fixed to: %s', outraster)
                 
                 # Set the extent if provided
-                if extent is not None and extent != '':
+                if extent is not None:
                     self.log.debug(extent)
                     self.gp.env.extent = extent
                     
-                # Set the snap raster if provided
-                if snap_raster is not None:
-                    self.gp.env.snapRaster = snap_raster
-                    self.log.debug('Snapping to raster %s' % snap_raster)
-                    
                 # Set the mask if provided
-                if mask != '':
+                if mask is not None:
                     self.gp.env.mask = mask
                     
                 # Loop through all the target rasters
                 self.log.info('Using cell factor: %s' % factor)
                 
                 self.log.debug(inraster)
-                inraster = self.gp.Raster(inraster)
-                
-                # Get the native resolution from the raster
-                yresolution = inraster.meanCellHeight
-                xresolution = inraster.meanCellWidth
                 
-                if yresolution != xresolution:
-                    self.log.warning('Cell width (%s) and height (%s) do not match for raster %s' % (xresolution,
-                                                                yresolution,
-                                                                inraster))
-                
-                self.log.info('Aggregating %s' % (inraster))
-                
-                # Aggregate the original grid to desired resolution
-                # FIXME: ArcGIS Spatial Analyst Aggregate tool will
-                # create zeros instead of NoData unless all NoData is taken
-                # into account ("NODATA" instead of "DATA"). The current 
-                # version will convert all zeros back to NoData if nodata
-                # mode is on under the assumption that the data has no 
-                # real zeros. This should be handled better.
+                # Extent and mask environments are only honoured by Spatial
+                # Analyst, otherwise the raster is aggregated block by block
+                if extent is not None or mask is not None:
+                    self.log.info('Aggregating %s' % (inraster))
+                    out_agg = aggregate_with_nodata(
+                                        self.write_deferred(inraster), factor,
+                                        method, nodata)
+                    out_agg.save(outraster)
+                else:
+                    inraster = self.open_raster(inraster)
                     
-                out_agg = self.gp.sa.Aggregate(inraster, factor, "SUM", 
-                                               "EXPAND", "DATA")
-                
-                # If NoData mode is on, set all zeros null
-                if nodata:
-                    self.log.debug('Setting zeros to null for %s' % outraster)
-                    out_agg = self.gp.sa.SetNull(out_agg,
-                                                 out_agg,
-                                                 "VALUE = 0")
-                
-                out_agg.save(outraster)
-                #self.log.add_result(out_agg)
+                    # Get the native resolution from the raster
+                    yresolution = -inraster.geotransform[5]
+                    xresolution = inraster.geotransform[1]
+                    
+                    if yresolution != xresolution:
+                        self.log.warning('Cell width (%s) and height (%s) do not match for raster %s' % (xresolution,
+                                                                    yresolution,
+                                                                    inraster))
+                    
+                    self.log.info('Aggregating %s' % (inraster))
+                    
+                    # Each aggregated cell keeps count of the cells with data,
+                    # cells without any data are set to NoData if NoData mode
+                    # is on (and to 0 otherwise)
+                    out_pixel_type = aggregate_pixel_type(inraster.pixel_type,
+                                                          method)
+                    if nodata:
+                        out_nodata = get_nodata_number(out_pixel_type)
+                    else:
+                        out_nodata = None
+                    output = self.create_raster(outraster, 
+                                    like=aggregate_template(inraster, factor),
+                                    pixel_type=out_pixel_type, 
+                                    nodata=out_nodata)
+                    aggregate_raster(inraster, output, factor, method, 
+                                     log=self.log)
+                    output.close()
+                    inraster.close()
                 
-                self.log.debug('Finished with %s' % outraster)
-                self.log.debug('Building pyramids')
+                self.log.debug('Finished with %s', outraster)
                 
-                self.gp.BuildPyramids_management(outraster)
+                pyramids.add(outraster)
+                self.finish_queue(pyramids)
                     
                 self.log.success = True
     
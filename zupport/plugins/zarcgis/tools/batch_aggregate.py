@@ -4,7 +4,10 @@ import types
 from zope.interface import implements
 from zupport.interfaces import IGISTool
 
-from zupport.plugins.zarcgis import ArcTool, LicenseError
+from zupport.plugins.fileio import get_nodata_number
+from zupport.plugins.zarcgis import ArcTool
+from zupport.raster import (AGGREGATE_METHODS, aggregate_pixel_type, 
+                            aggregate_pyramid, aggregate_template)
 from zupport.utilities import (ARC_RASTER_TYPES, msgInitStart, msgInitSuccess)
 from zupport.zlogging import ArcLogger
 
@@ -33,7 +36,9 @@ class Aggregate(ArcTool):
     (3) Cell factor [factors] 
         - Integer cell factor (multiplier) to be used in the aggregation. 
           Original cell size will be taken from the rasters in the input 
-          workspace. (required)
+          workspace. A list (or comma separated string) of factors can be 
+          given to produce all the resolutions in one pass over each raster. 
+          (required)
     
     (4) Nodata mode [nodata] 
         - Boolean defining whether NoData mode is used. 
@@ -53,12 +58,19 @@ class Aggregate(ArcTool):
     (7) Raster type [raster_type] 
         - String file extension for output raster type 
           (optional)
+          
+    (8) Method [method]
+        - String aggregation method: SUM, MEAN, MIN, MAX or MEDIAN 
+          (optional, default: SUM)
     
 
     """
     implements(IGISTool)
 
     id = 0
+    # Tool needs spatial analyst in order to run, the license is checked out
+    # when the tool is run
+    extensions = ['spatial']
 
     def __init__(self, parameters, service, *args, **kwargs):
         ArcTool.__init__(self, parameters, service, *args, **kwargs)
@@ -72,14 +84,6 @@ class Aggregate(ArcTool):
                                              debugging=True)
         
         self.log.debug(msgInitStart)
-        # Tool needs spatial analyst in order to run
-        # TODO: this should be moved to ToolValidator
-        try:
-            self.register_extension('spatial')
-        except LicenseError, e:
-            self.log.error(e)
-            return 1
-        
         self.service = service
         
         self.log.debug(msgInitSuccess)
@@ -91,7 +95,8 @@ class Aggregate(ArcTool):
     def run(self):
         
         # Lazy loading of tools!
-        from ..utilities import generate_rastername
+        from ..utilities import (aggregate_with_nodata, generate_rastername,
+                                 optional_parameter)
         
         self.validate_parameters()
         if self.ready:
@@ -101,25 +106,39 @@ class Aggregate(ArcTool):
                 outworkspace = str(self.get_parameter(1))
                 factor = self.get_parameter(2)
                 nodata = self.get_parameter(3)
-                extent = self.get_parameter(4)
-                mask = self.get_parameter(5)
+                extent = optional_parameter(self.get_parameter(4))
+                mask = optional_parameter(self.get_parameter(5))
                 include = self.get_parameter(6)
                 raster_type = self.get_parameter(7)
                 raster_type = ARC_RASTER_TYPES[raster_type]
+                method = self.get_parameter('method')
+                
+                # Several cell factors can be given as a list or as a comma
+                # separated string
+                if isinstance(factor, basestring):
+                    factors = [int(item) for item in factor.split(',')]
+                elif type(factor) in [types.ListType, types.TupleType]:
+                    factors = [int(item) for item in factor]
+                else:
+                    factors = [int(factor)]
+                if method not in AGGREGATE_METHODS:
+                    raise ValueError('Unknown aggregation method: %s' % method)
+                pyramids = self.pyramid_queue(self.get_parameter('pyramids'))
+                journal = self.open_journal(self.get_parameter('resume'))
                 
                 # Set the extent if provided
-                if extent is not None and extent != '':
+                if extent is not None:
                     self.log.debug(extent)
                     if type(extent) is types.StringType:
                         extent = [float(coord) for coord in extent.split(',')]
                     self.gp.env.extent = self.gp.Extent(extent)
                     
                 # Set the mask if provided
-                if mask != '':
+                if mask is not None:
                     self.gp.env.mask = mask
                     
                 rasters_all = self.gp.ListRasters()
-                self.log.debug('Rasters found:\n%s' % rasters_all)
+                self.log.debug('Rasters found:\n%s', rasters_all)
                     
                 if include:
                     job_length = len(include)
@@ -132,19 +151,31 @@ class Aggregate(ArcTool):
                 check_resolutions = []
                     
                 # Loop through all the target rasters
-                self.log.info('Using cell factor: %s' % factor)
+                self.log.info('Using cell factor(s): %s' % factors)
                 for raster in rasters_all:
                     
                     # If includes are provided, see if current raster is in
                     if include and raster not in include:
                         continue
                     
-                    # Convert raster string into a Raster object
-                    raster = self.gp.sa.Raster(raster)
+                    # Extent and mask environments are only honoured by 
+                    # Spatial Analyst, otherwise the raster is aggregated block
+                    # by block
+                    use_sa = extent is not None or mask is not None
                     
-                    # Get the native resolution from the raster
-                    yresolution = raster.meanCellHeight
-                    xresolution = raster.meanCellWidth
+                    if use_sa:
+                        raster = self.gp.sa.Raster(raster)
+                        name = raster.name
+                        # Get the native resolution from the raster
+                        yresolution = raster.meanCellHeight
+                        xresolution = raster.meanCellWidth
+                    else:
+                        name = raster
+                        raster = self.open_raster(os.path.join(self.workspace,
+                                                               raster))
+                        # Get the native resolution from the raster
+                        yresolution = -raster.geotransform[5]
+                        xresolution = raster.geotransform[1]
                     
                     if counter > 1:
                         if xresolution not in check_resolutions:
@@ -158,56 +189,80 @@ class Aggregate(ArcTool):
                                                                     yresolution,
                                                                     raster))
                     
-                    # Calculate the desired target resolution and figure out
-                    # if suitable sub folders exist
-                    target_resolution = factor * xresolution
-                    outdir = os.path.join(outworkspace, str(int(target_resolution)))
-                    if not os.path.exists(outdir):
-                        self.log.info('Creating directory %s' % outdir)
-                        try:
-                            os.mkdir(outdir)
-                        except OSError, e:
-                            self.log.error('Could not create directory %s: %s' % (outdir, e))
-                    
                     self.log.info('[%s/%s] Aggregating %s' % (counter, 
                                                               job_length,
                                                               raster))
                     
-                    output = generate_rastername(raster.name, 
-                                                 outdir, 
-                                                 ext=raster_type, 
-                                                 suffix='%s' % int(target_resolution))
-                    
-                    # Aggregate the original grid to desired resolution
-                    # FIXME: ArcGIS Spatial Analyst Aggregate tool will
-                    # create zeros instead of NoData unless all NoData is taken
-                    # into account ("NODATA" instead of "DATA"). The current 
-                    # version will convert all zeros back to NoData if nodata
-                    # mode is on under the assumption that the data has no 
-                    # real zeros. This should be handled better.
+                    # Calculate the desired target resolutions and figure out
+                    # if suitable sub folders exist
+                    outputs = {}
+                    for factor in factors:
+                        target_resolution = factor * xresolution
+                        outdir = os.path.join(outworkspace, str(int(target_resolution)))
+                        if not os.path.exists(outdir):
+                            self.log.info('Creating directory %s' % outdir)
+                            try:
+                                os.mkdir(outdir)
+                            except OSError, e:
+                                self.log.error('Could not create directory %s: %s' % (outdir, e))
                         
-                    out_agg = self.gp.sa.Aggregate(raster, 
-                                                       factor, 
-                                                       "SUM", 
-                                                       "EXPAND", 
-                                                       "DATA")
-                    
-                    # If NoData mode is on, set all zeros null
-                    if nodata:
-                        self.log.debug('Setting zeros to null for %s' % out_agg)
-                        out_agg = self.gp.sa.SetNull(out_agg,
-                                                         out_agg,
-                                                         "VALUE = 0")
-                    
-                    out_agg.save(output)
-                    #self.log.add_result(out_agg)
-                    
-                    self.log.debug('Finished with %s' % output)
-                    self.log.debug('Building pyramids')
-                    
-                    self.gp.BuildPyramids_management(output)
+                        outputs[factor] = generate_rastername(name, 
+                                                    outdir, 
+                                                    ext=raster_type, 
+                                                    suffix='%s' % int(target_resolution))
+                    
+                    # Only the resolutions not completed in a previous run are
+                    # aggregated
+                    pending = journal.pending(outputs.values())
+                    todo = [factor for factor in factors if 
+                            outputs[factor] in pending]
+                    if not todo:
+                        self.log.info('Skipping %s, already completed' % name)
+                        if not use_sa:
+                            raster.close()
+                        counter += 1
+                        continue
+                    journal.begin(pending)
+                    
+                    if use_sa:
+                        for factor in todo:
+                            out_agg = aggregate_with_nodata(raster, factor, 
+                                                            method, nodata)
+                            out_agg.save(outputs[factor])
+                    else:
+                        # Each aggregated cell keeps count of the cells with 
+                        # data, cells without any data are set to NoData if 
+                        # NoData mode is on (and to 0 otherwise)
+                        out_pixel_type = aggregate_pixel_type(raster.pixel_type,
+                                                              method)
+                        if nodata:
+                            out_nodata = get_nodata_number(out_pixel_type)
+                        else:
+                            out_nodata = None
+                        out_rasters = {}
+                        for factor in todo:
+                            out_rasters[factor] = self.create_raster(outputs[factor], 
+                                            like=aggregate_template(raster, factor),
+                                            pixel_type=out_pixel_type, 
+                                            nodata=out_nodata)
+                        # All the factors are aggregated in one read
+                        aggregate_pyramid(raster, out_rasters, method, 
+                                          log=self.log)
+                        for out_raster in out_rasters.values():
+                            out_raster.close()
+                        raster.close()
+                    
+                    journal.complete(pending)
+                    
+                    # Pyramids are built while the next raster is aggregated
+                    for factor in todo:
+                        self.log.debug('Finished with %s', outputs[factor])
+                        pyramids.add(outputs[factor])
                         
                     counter += 1
+                
+                self.finish_queue(pyramids)
+                journal.finish()
                         
                 self.log.success = True
     
@@ -9,7 +9,9 @@ from zupport.interfaces import IGISTool
 
 from ..core import ArcRasterTool, ArcRasterGroupIterator
 from zupport.core import ParameterError
-from zupport.plugins.fileio import parse_operator
+from zupport.plugins.fileio import get_nodata_number
+from zupport.raster import (REDUCE_OPERATORS, compile_group, 
+							set_null_nonpositive)
 from zupport.utilities import msgInitSuccess
 from zupport.zlogging import ArcLogger
 
@@ -58,6 +60,10 @@ class CalculateRasterGroup(ArcRasterTool):
 									  from <ID1> in field A to a value in field
 									  "B".
 									  
+	NoData cells are skipped for SUM and SUBTRACTION, for MULTIPLICATION and 
+	DIVISION a NoData cell gives NoData (see zupport.raster.group_reduce). As
+	before, results that are zero or negative are set to NoData, unless 
+	parameter keep_nonpositive is True.
 
 	"""
 	implements(IGISTool)
@@ -87,20 +93,27 @@ class CalculateRasterGroup(ArcRasterTool):
 		
 		try:
 			self.validate_parameters()
+			if not self.ready:
+				return 0
 				
 			self.workspace = str(self.get_parameter(0))
-			self.log.debug('Found %s rasters in workspace %s' % (len(self.files),
-																 self.workspace))
+			self.log.debug('Found %s rasters in workspace %s', len(self.files),
+						   self.workspace)
 			wildcard = self.get_parameter(1)
 			template = self.get_parameter(2)
 			grouptags = self.get_parameter(3)
-			operator = parse_operator(self.get_parameter(4))
+			operator = self.get_parameter(4)
+			if operator not in REDUCE_OPERATORS:
+				raise ValueError('Operator %s not suitable for simple algebra.' %
+								 (operator))
 			
 			outws = self.get_parameter(5)
 			# These will be None if not provided
 			reftable = self.get_parameter(6)
 			reffields = self.get_parameter(7)
 			self.log.debugging = bool(self.get_parameter(8))
+			journal = self.open_journal(self.get_parameter('resume'))
+			keep_nonpositive = bool(self.get_parameter('keep_nonpositive'))
 			
 			# Use mapping reffields[0] -> reffields[1] from reftable
 			
@@ -129,6 +142,10 @@ class CalculateRasterGroup(ArcRasterTool):
 			# queue length
 			job_length = len(rasteriterator)
 			
+			# Results are written as 32 bit float with the matching NoData
+			out_pixel_type = 'float32'
+			NODATA = get_nodata_number(out_pixel_type)
+			
 			# Set the tool progressor
 			if self.log.gui:
 				self.log.setProgressor("Summing multiple rasters...",
@@ -138,9 +155,8 @@ class CalculateRasterGroup(ArcRasterTool):
 			# of ParsedFileNames
 			for group_id, group in rasteriterator.iteritems():
 				
-				self.log.debug('Group %s (%s) has %s rasters' % (int(group_id), 
-																 reffields[1],
-																 len(group)))
+				self.log.debug('Group %s (%s) has %s rasters', int(group_id), 
+							   reffields[1], len(group))
 				
 				# Each raster within the group is summed to a common result 
 				# raster -> each group has one output raster
@@ -156,34 +172,46 @@ class CalculateRasterGroup(ArcRasterTool):
 				else:
 					extension = ""
 				
-				output_zero = os.path.join(outws, '%s_%s_%s%s%s' % (group[0].get_tag('BODY1'),
-																  int(group_id),
-																  group[0].get_tag('BODY3'),
-																  "TMP",
-																  extension))																  
-				cmds = []
+				output = os.path.join(outws, '%s_%s_%s%s' % (group[0].get_tag('BODY1'),
+													  int(group_id),
+													  group[0].get_tag('BODY3'),
+													  extension))
 				
-				for raster in group:
-					
-					cmds.append("self.gp.sa.Con(self.gp.sa.IsNull('%s'), 0, '%s')" % (raster, raster))
-					
-				cmd = operator.join(cmds)
+				# Groups completed in a previous run are skipped
+				if not journal.pending([output]):
+					self.log.info('Skipping group %s, already completed' % 
+								  int(group_id))
+					if self.log.gui:
+						self.log.setProgressorPosition()
+					continue
 				
-				self.log.info('Summing rasters in group %s' % int(group_id))
-				#res = self.gp.sa.SingleOutputMapAlgebra(cmd, output_zero)
-				op1 = eval(cmd)
-				op1.save(output_zero)
+				# All the rasters in the group are read block by block and reduced
+				# into a single buffer, only the final output is written
+				rasters = [self.open_raster(os.path.join(self.workspace, str(raster)))
+						   for raster in group]
+				nodatas = [raster.nodata for raster in rasters]
+				
+				# The group operation is compiled once per group and evaluated 
+				# in place into reused buffers for every block
+				expression = compile_group(operator, nodatas, NODATA, 
+										   out_pixel_type)
+				self.log.debug('Compiled group operation: %r', expression)
+				if keep_nonpositive:
+					func = expression
+				else:
+					func = lambda *arrays: set_null_nonpositive(
+												expression(*arrays), NODATA)
 				
-				self.log.debug('Reclassifying NoData for group %s' % int(group_id))
-				output = output_zero.replace('TMP', '')
-				cmd = 'self.gp.sa.SetNull(%s == 0)' % output_zero
-				op2 = self.gp.sa.SetNull(output_zero, output_zero, "VALUE <= 0")
-				op2.save(output)
-				self.gp.Delete_management(output_zero)
+				self.log.info('Summing rasters in group %s' % int(group_id))
+				journal.begin([output])
+				self.compute_raster(rasters, output, func, out_pixel_type,
+									NODATA, work_copies=3, log=self.log)
+				journal.complete([output])
 				
 				if self.log.gui:
 					self.log.setProgressorPosition()
 			
+			journal.finish()
 			return 1
 					
 		except Exception, e:
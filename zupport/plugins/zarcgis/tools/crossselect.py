@@ -1,13 +1,17 @@
 #!/usr/bin/python
 # coding=utf-8
 
+import os
+from functools import partial
+
 from zope.interface import implements
 from zupport.interfaces import IGISTool
 
 from zupport.core import ParameterError
-from ..errors import LicenseError
 from ..utilities import generate_rastername
 from ..core import ArcTool
+from zupport.plugins.fileio import get_nodata_number
+from zupport.raster import BlockEngine, class_split, unique_values
 from zupport.utilities import msgInitStart, msgInitSuccess, ARC_RASTER_TYPES
 from zupport.zlogging import ArcLogger
 
@@ -42,7 +46,8 @@ class CrossSelect(ArcTool):
     (2) Output workspace [outworkspace] - String for the location of the
                                           resulting rasters (required)
     (3) Include values [include] - List holding values in the reference raster
-                                   to include (optional, default: None)
+                                   to include (optional, default: all the
+                                   unique values in the reference raster)
     (4) Exclude values [exclude] - List holding values in the reference raster
                                    to exclude (optional, default: None)
     (5) Raster format [raster_type] - String for the output raster format
@@ -53,6 +58,9 @@ class CrossSelect(ArcTool):
     """
 
     id = 0
+    # Tool needs spatial analyst in order to run, the license is checked out
+    # when the tool is run
+    extensions = ['spatial']
 
     def __init__(self, parameters, service, *args, **kwargs):
         ArcTool.__init__(self, parameters, service, *args, **kwargs)
@@ -66,14 +74,6 @@ class CrossSelect(ArcTool):
 
         self.log.debug(msgInitStart)
 
-        # Tool needs spatial analyst in order to run
-        # TODO: this should be moved to ToolValidator
-        try:
-            self.register_extension('spatial')
-        except LicenseError, e:
-            self.log.error(e)
-            return 1
-
         self.service = service
 
         self.log.debug(msgInitSuccess)
@@ -86,26 +86,34 @@ class CrossSelect(ArcTool):
 
         try:
             self.validate_parameters()
+            if not self.ready:
+                return 0
 
-            refraster = self.gp.sa.Raster(self.get_parameter(0))
+            refraster = self.open_raster(self.get_parameter(0))
             self.workspace = self.get_parameter(1)
             outworkspace = self.get_parameter(2)
-            # FIXME: currently there is no way of reading all the unique values
-            # in the raster, but they must be provided as a list
+            # If no include values are provided, all the unique values in the
+            # reference raster are used
             include = self.get_parameter(3)
             exclude = self.get_parameter(4)
             raster_type = self.get_parameter(5)
             tag = self.get_parameter(6)
             raster_type = ARC_RASTER_TYPES[raster_type]
+            journal = self.open_journal(self.get_parameter('resume'))
 
             # Get all the rasters in the input workspace
             rasters_all = self.gp.ListRasters()
 
+            if not include:
+                self.log.info('Reading unique values from %s' % refraster.path)
+                include = unique_values(refraster).tolist()
+                self.log.debug('Found values: %s', include)
+
             # Get exclude out of include
-            include = set(include) - set(exclude)
+            include = sorted(set(include) - set(exclude))
 
-            # Calculate the job queue length based on provided options
-            job_length = len(rasters_all) * len(include)
+            # Each raster is read only once and split into all the classes
+            job_length = len(rasters_all)
 
             # Set the tool progressor
             if self.log.gui:
@@ -114,24 +122,58 @@ class CrossSelect(ArcTool):
 
             # Loop through all the rasters in the input workspace
             for raster in rasters_all:
-                # Loop through all the values in include list
-                for value in include:
-
-                    self.log.info('Selecting from %s with %s value %s' %
-                                  (raster, refraster.name, value))
 
-                    output = generate_rastername(raster,
+                names = {}
+                for value in include:
+                    names[value] = generate_rastername(raster,
                                                  outworkspace,
                                                  ext=raster_type,
                                                  suffix='%s_%s' % (tag, value))
 
-                    outCon = self.gp.sa.Con(refraster, raster,
-                                            "#", "VALUE = %s" % value)
-                    outCon.save(output)
-                    #self.log.add_result(outCon)
-
+                # Only the classes not completed in a previous run are
+                # selected
+                pending = journal.pending([names[value] for value in include])
+                classes = [value for value in include if names[value] in
+                           pending]
+                if not classes:
+                    self.log.info('Skipping %s, already completed' % raster)
                     if self.log.gui:
                         self.log.setProgressorPosition()
+                    continue
+
+                self.log.info('Selecting from %s with %s values %s' %
+                              (raster, refraster.path, classes))
+
+                valueraster = self.open_raster(os.path.join(self.workspace,
+                                                            raster))
+                nodata = valueraster.nodata
+                if nodata is None:
+                    nodata = get_nodata_number(valueraster.pixel_type)
+
+                journal.begin(pending)
+                outputs = []
+                for value in classes:
+                    outputs.append(self.create_raster(names[value],
+                                                like=valueraster,
+                                                pixel_type=valueraster.pixel_type,
+                                                nodata=nodata))
+
+                engine = BlockEngine([refraster, valueraster], outputs,
+                                     log=self.log)
+                engine.run(partial(class_split, classes=classes,
+                                   ref_nodata=refraster.nodata,
+                                   value_nodata=valueraster.nodata,
+                                   out_nodata=nodata))
+
+                for opened in [valueraster] + outputs:
+                    opened.close()
+                journal.complete(pending)
+
+                if self.log.gui:
+                    self.log.setProgressorPosition()
+
+            refraster.close()
+            journal.finish()
 
         except Exception, error_desc:
                 self.log.exception(error_desc)
@@ -4,7 +4,7 @@ from zope.interface import implements
 from zupport.interfaces import IGISTool
 
 from ..core import ArcTool
-from ..errors import FeatureTypeError, FieldError, LicenseError
+from ..errors import FeatureTypeError, FieldError
 from zupport.utilities import (msgInitStart, msgInitSuccess)
 from zupport.zlogging import ArcLogger
 
@@ -22,6 +22,9 @@ class DiscrertizeFields(ArcTool):
     implements(IGISTool)
 
     id = 0
+    # Tool needs spatial analyst in order to run, the license is checked out
+    # when the tool is run
+    extensions = ['spatial']
 
     def __init__(self, parameters, service, *args, **kwargs):
         ArcTool.__init__(self, parameters, service, *args, **kwargs)
@@ -35,14 +38,6 @@ class DiscrertizeFields(ArcTool):
                                              debugging=True)
         
         self.log.debug(msgInitStart)
-        # Tool needs spatial analyst in order to run
-        # TODO: this should be moved to ToolValidator
-        try:
-            self.register_extension('spatial')
-        except LicenseError, e:
-            self.log.error(e)
-            return 1
-        
         self.service = service
         
         self.log.debug(msgInitSuccess)
@@ -54,6 +49,8 @@ class DiscrertizeFields(ArcTool):
     def run(self):
         
         self.validate_parameters()
+        if not self.ready:
+            return 0
         
         intable = str(self.get_parameter(0))
         intable_discrete_field = str(self.get_parameter(1))
@@ -75,11 +72,11 @@ class DiscrertizeFields(ArcTool):
             if fc_desc.ShapeType != "Polygon":
                 raise FeatureTypeError("Input Feature Class type (%s) not polygon." % fc_desc.ShapeType)
             
-            self.log.debug('Checking if input feature join field %s exists' % infeature_join_field)
+            self.log.debug('Checking if input feature join field %s exists', infeature_join_field)
             if not self.gp.ListFields(infeature, infeature_join_field):
                 raise FieldError(infeature_join_field, infeature)
         
-            self.log.debug('Checking if input table %s fields exist' % intable)
+            self.log.debug('Checking if input table %s fields exist', intable)
             fields = [field.name for field in self.gp.ListFields(intable)]
             self.log.debug(fields)
             if intable_discrete_field not in fields:
@@ -90,25 +87,18 @@ class DiscrertizeFields(ArcTool):
             # STEP 1: Get the unique values ###################################
             
             # Get the unique values in the discrete field
-            self.log.debug('Getting all unique values for field %s' % intable_discrete_field)
+            self.log.debug('Getting all unique values for field %s', intable_discrete_field)
             
-            # Use a set to get the unique field identifiers
-            values = set()
+            # The profile is cached so the table is only scanned when it has
+            # changed
+            profile = self.profile_fields(intable, [intable_discrete_field])
+            self.log.debug("Row count: %s", profile.nrows)
             
-            # FIXME: using search cursor can be slow...
-            nrows = self.gp.GetCount_management(intable)
-            self.log.debug("Row count: %s" % nrows)
-    
-            #rows = self.gp.SearchCursor(intable)
-
-            #for row in rows:
-            #    values.add(int(row.getValue(intable_discrete_field)))
-             
-            # HACK!
-            values = set([1, 2, 3, 4, 5, 6, 7, 8, 9])
+            values = [int(value) for value in 
+                      profile.uniques(intable_discrete_field)]
                 
-            self.log.debug('Unique values for %s: %s' % (intable_discrete_field, 
-                                                         values))
+            self.log.debug('Unique values for %s: %s', intable_discrete_field, 
+                           values)
             
             for value in values:
                 
@@ -120,7 +110,7 @@ class DiscrertizeFields(ArcTool):
                 
                 where_clause = '"%s" = %s' % (intable_discrete_field, value)
                 
-                self.log.debug('Making table view from table %s with %s' % (intable, where_clause))
+                self.log.debug('Making table view from table %s with %s', intable, where_clause)
                 
                 # Make a table view with the where selection
                 self.gp.MakeTableView_management(intable, selection_table, 
@@ -128,14 +118,13 @@ class DiscrertizeFields(ArcTool):
                 
                 # STEP 3: Join the selected table with a Feature layers created
                 # out of the input feature (geometry feature)
-                self.log.debug('Creating a feature layer from %s' % (infeature))
+                self.log.debug('Creating a feature layer from %s', infeature)
                 
                 self.gp.MakeFeatureLayer_management(infeature, join_layer)
                 
-                self.log.debug('Joining %s and %s' % (infeature, 
-                                                      intable))
+                self.log.debug('Joining %s and %s', infeature, intable)
                 
-                self.log.debug('Using join type: %s ' % join_type)
+                self.log.debug('Using join type: %s ', join_type)
                 
                 self.gp.AddJoin_management(join_layer, infeature_join_field,
                                            selection_table, intable_join_field,
@@ -144,12 +133,12 @@ class DiscrertizeFields(ArcTool):
                 
                 nrows = int(self.gp.GetCount_management(join_layer).getOutput(0))
                 if join_type == 'KEEP_COMMON':
-                    self.log.debug('%s rows selected and joined' % nrows)
+                    self.log.debug('%s rows selected and joined', nrows)
                     if nrows < 1:
                         self.log.debug('No records selected, continuing')
                         continue
                 else:
-                    self.log.debug('All geometry rows (%s) selected.' % nrows)
+                    self.log.debug('All geometry rows (%s) selected.', nrows)
                     
                 # STEP 4: Make a temporary feature class out of the Feature 
                 # class
@@ -157,7 +146,7 @@ class DiscrertizeFields(ArcTool):
                 out_path = os.path.dirname(output_feature)
                 out_name = os.path.basename(output_feature)
                 temp_feature = os.path.join(out_path, out_name + '_temp')
-                self.log.debug('Creating temporary feature class %s' % temp_feature)
+                self.log.debug('Creating temporary feature class %s', temp_feature)
                 self.gp.CopyFeatures_management(join_layer, 
                                                 temp_feature)
                 
@@ -168,7 +157,7 @@ class DiscrertizeFields(ArcTool):
                     
                     geometry_type = "POLYGON"
                     
-                    self.log.debug('Creating output feature class %s to %s' % (out_name, out_path))
+                    self.log.debug('Creating output feature class %s to %s', out_name, out_path)
                     
                     self.gp.CreateFeatureclass_management(out_path, out_name, 
                                                           geometry_type,
@@ -178,7 +167,7 @@ class DiscrertizeFields(ArcTool):
                 # selection/join to the output feature class
                 
                 nrows = int(self.gp.GetCount_management(temp_feature).getOutput(0))
-                self.log.debug('Appending %s features to %s' % (nrows, out_name))
+                self.log.debug('Appending %s features to %s', nrows, out_name)
                 self.gp.Append_management(temp_feature, output_feature, 
                                           schema_type="TEST")
 
@@ -38,6 +38,9 @@ class ArcMultiClipRaster(ArcTool):
 	#implements(IGisTool)
 
 	id = 0
+	# Tool needs spatial analyst in order to run, the license is checked out
+	# when the tool is run
+	extensions = ['spatial']
 
 	def __init__(self, backend, parameters, *args, **kwargs):
 		ArcTool.__init__(self, backend, parameters, *args, **kwargs)
@@ -48,14 +51,6 @@ class ArcMultiClipRaster(ArcTool):
 		
 		self.log = ArcLogger("%s [%s]" % (self.__module__, backend))
 
-		# Tool needs spatial analyst in order to run
-		# TODO: this should be moved to ToolValidator
-		try:
-			self.register_extension('spatial')
-		except LicenseError, e:
-			self.log.error(e)
-			return 1
-
 	def __del__(self):
 		if ArcMultiClipRaster:
 			ArcMultiClipRaster.id = ArcMultiClipRaster.id - 1
@@ -64,6 +59,8 @@ class ArcMultiClipRaster(ArcTool):
 		
 		try:
 			self.validate_parameters()
+			if not self.ready:
+				return 0
 				
 			rasters = multisplit(self.get_parameter(0))
 			outws = self.get_parameter(1)
@@ -82,6 +79,7 @@ class ArcMultiClipRaster(ArcTool):
 
 		clipper = self.get_parameter(3)
 		id_field = self.get_parameter(4)
+		pyramids = self.pyramid_queue(self.get_parameter('pyramids'))
 
 		try:
 			# Check clipper feature properties
@@ -101,12 +99,8 @@ class ArcMultiClipRaster(ArcTool):
 					raise FieldError(id_field, clipper)
 				else:
 					# Get all the *unique* values in the id field
-					rows = self.gp.SearchCursor(clipper)
-					row = rows.Next()
-
-					while row:
-						uniques.add(row.Getvalue(id_field))
-						row = rows.Next()
+					uniques.update(self.profile_fields(clipper, 
+													   [id_field]).uniques(id_field))
 
 			# Calculate the job queue length based on provided options. If no
 			# identifying field is used, the length of rasters defines the job
@@ -145,9 +139,7 @@ class ArcMultiClipRaster(ArcTool):
 							self.gp.ExtractByMask_sa(raster, "clip_feature",
 														 out_raster)
 
-							# Build pyramids
-							self.log.progressor("Building pyramids", log='info')
-							self.gp.BuildPyramids_management(out_raster)
+							pyramids.add(out_raster)
 
 							self.log.info("Finished extracting %s with %s value %s" %
 									 	  (raster, id_field, field_value))
@@ -167,9 +159,7 @@ class ArcMultiClipRaster(ArcTool):
 						self.gp.ExtractByMask_sa(raster, clipper,
 													  out_raster)
 
-						# Build pyramids
-						self.log.progressor("Building pyramids", log='info')
-						self.gp.BuildPyramids_management(out_raster)
+						pyramids.add(out_raster)
 
 						self.log.info("Finished extracting %s with %s" %
 									 (raster, clipper))
@@ -180,6 +170,9 @@ class ArcMultiClipRaster(ArcTool):
 
 				self.log.setProgressorPosition()
 
+			self.log.progressor("Building pyramids", log='info')
+			self.finish_queue(pyramids)
+
 		except FeatureTypeError, fte:
 			self.log.exception(fte.value)
 			raise
@@ -1,21 +1,33 @@
 #!/usr/bin/python
 # coding=utf-8
 
+import os
+import shutil
+import tempfile
 import types
+from functools import partial
 
 from zope.interface import implements
 from zupport.interfaces import IGISTool
 
-from itertools import product
-
 from ..core import ArcTool
-from ..errors import FeatureTypeError, FieldError, LicenseError
+from ..errors import FeatureTypeError, FieldError
 from ..utilities import generate_rastername
 
 from zupport.core import ParameterError
+from zupport.plugins.fileio import get_nodata_number
+from zupport.raster import BlockEngine, class_split
 from zupport.utilities import ARC_RASTER_TYPES, msgInitSuccess
 from zupport.zlogging import ArcLogger
 
+# Temporary field holding the combination identifiers
+COMBINATION_FIELD = 'ZCOMBO'
+# Number of outputs split from the value raster in one pass. Outputs that
+# GDAL can not write are kept in temporary files of the full raster size
+# until they are closed (see ArcOutputRaster), so the batches bound the
+# temporary disk space.
+OUTPUT_BATCH = 16
+
 def service():
 	return 'multiconvertraster'
 
@@ -55,7 +67,7 @@ class MultiConvertRaster(ArcTool):
 		
 	(4) Pixel size [pixelsize]: 
 	
-		Integer defining the output resolution (required)
+		Number defining the output resolution (required)
 	
 	(5) Raster type [raster_type]:
 		
@@ -75,6 +87,9 @@ class MultiConvertRaster(ArcTool):
 	implements(IGISTool)
 
 	id = 0
+	# Tool needs spatial analyst in order to run, the license is checked out
+	# when the tool is run
+	extensions = ['spatial']
 
 	def __init__(self, parameters, service, *args, **kwargs):
 		ArcTool.__init__(self, parameters, service, *args, **kwargs)
@@ -87,14 +102,6 @@ class MultiConvertRaster(ArcTool):
 											 debugging=True)
 		
 
-		# Tool needs spatial analyst in order to run
-		# TODO: this should be moved to ToolValidator
-		try:
-			self.register_extension('spatial')
-		except LicenseError, e:
-			self.log.error(e)
-			return 1
-		
 		self.service = service
 		
 		self.log.debug(msgInitSuccess)
@@ -108,17 +115,21 @@ class MultiConvertRaster(ArcTool):
 		
 		try:
 			self.validate_parameters()
+			if not self.ready:
+				return 0
 				
 			infeature = self.get_parameter(0)
 			inconfields = self.get_parameter(1)
 			invalue = str(self.get_parameter(2))
 			outputws = str(self.get_parameter(3))
-			pixelsize = int(str(self.get_parameter(4)))
+			pixelsize = float(self.get_parameter(4))
 			raster_type = self.get_parameter(5)
 			raster_type = ARC_RASTER_TYPES[raster_type]
 			extent = str(self.get_parameter(6))
 			snap_raster = str(self.get_parameter(7))
 			self.log.debugging = bool(self.get_parameter(8))
+			pyramids = self.pyramid_queue(self.get_parameter('pyramids'))
+			journal = self.open_journal(self.get_parameter('resume'))
 			
 			try:
 				# Is it a ValueField object?
@@ -136,12 +147,12 @@ class MultiConvertRaster(ArcTool):
 			# Set the extent if provided
 			if extent is not None and extent != '':
 				self.gp.env.extent = extent
-				self.log.debug('Extent set to %s' % self.gp.env.extent)
+				self.log.debug('Extent set to %s', self.gp.env.extent)
 		
 			# Set the snap raster if provided
 			if snap_raster is not None:
 				self.gp.env.snapRaster = snap_raster
-				self.log.debug('Snapping to raster %s' % self.gp.env.snapRaster)
+				self.log.debug('Snapping to raster %s', self.gp.env.snapRaster)
 		
 			# Check input feature properties
 			self.log.debug('Getting Feature Class properties')
@@ -150,12 +161,12 @@ class MultiConvertRaster(ArcTool):
 				raise FeatureTypeError("Input Feature Class type (%s) not polygon." % fc_desc.ShapeType)
 
 			# Check the input fields
-			self.log.debug('Checking if input conditions field(s) %s exists' % ';'.join([key for key in inconfields.keys()]))
+			self.log.debug('Checking if input conditions field(s) %s exists', ';'.join([key for key in inconfields.keys()]))
 			for field in inconfields.keys():
 				if not self.gp.ListFields(infeature, field):
 					raise FieldError(field, infeature)
 
-			self.log.debug('Checking if output value field %s exists' % invalue)
+			self.log.debug('Checking if output value field %s exists', invalue)
 			if not self.gp.ListFields(infeature, invalue):
 				raise FieldError(invalue, infeature)
 		
@@ -168,112 +179,164 @@ class MultiConvertRaster(ArcTool):
 			raise
 
 		try:
-			# all_values is a list of lists holding ALL values for ALL fields
-			all_values = []
-			field_names = []
+			field_names = inconfields.keys()
 			
-			# Iterate through a list holding {field_name: fiel_values} 
-			# dictionaries
-			for field_name, values in inconfields.iteritems():
-				field_names.append(field_name)
-				
-				# Check if values are provided
-				if values == 'all':
-					# No values provided, get unique values
-					self.log.debug('Getting all unique values for field %s' % field_name)
-					# Use a set to get the unique field identifiers
-					values = set()
-	
-					rows = self.gp.SearchCursor(infeature)
-	
-					for row in rows:
-						values.add(int(row.getValue(field_name)))
-						
-					self.log.debug('Unique values for %s: %s' % (field_name, values))
-						
-
-				all_values.append(values)
-				
-			# Cross product all possible combinations of field values
-			products = list(product(*all_values))
-				
-			# Calculate the job queue length based on the number of products
-			job_length = len(products)
-
-			# Set the tool progressor
-			if self.log.gui:
-				self.log.setProgressor("Extracting feature class with multiple field values...",
-										max=job_length)
-
-			# Make a feature layer from the feature class
-			self.gp.MakeFeatureLayer_management(infeature, "input_feature")
-
-			for i, combination in enumerate(products):
+			# Values to be used for each field, None means all values
+			field_values = []
+			for field_name in field_names:
+				values = inconfields[field_name]
+				if values == 'all' or values == ['all']:
+					field_values.append(None)
+				else:
+					field_values.append(set([int(value) for value in values]))
+			
+			# Features are copied into memory and each feature gets an integer
+			# identifying its combination of condition field values. Only 
+			# combinations that actually exist in the features are produced,
+			# they are collected in the same pass.
+			self.log.debug('Identifying condition field value combinations')
+			combo_feature = 'in_memory\\zupport_combinations'
+			tmpdir = tempfile.mkdtemp()
+			combo_path = os.path.join(tmpdir, 'combinations.img')
+			value_path = os.path.join(tmpdir, 'values.img')
+			try:
 				try:
+					self.gp.CopyFeatures_management(infeature, combo_feature)
+					self.gp.AddField_management(combo_feature, 
+												COMBINATION_FIELD, 'LONG')
 					
-					# Create a valid name for the ouput raster
-					raster = '_'.join([name + '_' + str(value) for name, value in zip(field_names, combination)])
-					raster = generate_rastername(raster, outputws, raster_type,
-												suffix=invalue)
-					
-					msg = "Selecting and converting %s with following configuration: %s (%s / %s)" % (invalue, (' '.join([name + ': ' + str(value) for name, value in zip(field_names, combination)])), i + 1, job_length)
-					
-					self.log.progressor(msg, log='info')
-					
-					# Check that field names and values correspond
-					if len(field_names) != len(combination):
-						raise ParameterError('Number of field names <%> and values <%s> does not match' % 
-											(len(field_names), len(combination)))
+					combinations = {}
+					rows = self.gp.UpdateCursor(combo_feature)
+					for row in rows:
+						values = [row.getValue(field_name) for field_name 
+								  in field_names]
+						if None in values:
+							continue
+						combination = tuple([int(value) for value in values])
+						selected = [accepted is None or value in accepted 
+									for value, accepted 
+									in zip(combination, field_values)]
+						if not all(selected):
+							continue
+						if combination not in combinations:
+							combinations[combination] = len(combinations) + 1
+						row.setValue(COMBINATION_FIELD, 
+									 combinations[combination])
+						rows.updateRow(row)
+					del rows
 					
-					# Make the selections
-					for name, value in zip(field_names, combination):
-						# Set the selection types -> first is a new selection,
-						# all consecutive selection are subsets
-						if name == field_names[0]:
-							selection = "NEW_SELECTION"
-						else:
-							selection = "SUBSET_SELECTION"
-						self.gp.SelectLayerByAttribute_management("input_feature", 
-													   	   selection, 
-													       "%s = %s" % 
-													   		(name, value))
-						
-					# See if any features are selected
-					result = self.gp.GetCount_management("input_feature")
-					count = int(result.getOutput(0)) 
+					# Calculate the job queue length based on the number of 
+					# combinations
+					job_length = len(combinations)
+					self.log.info('Found %s combinations of %s' % (job_length, 
+															   ', '.join(field_names)))
+					if job_length == 0:
+						self.log.warning('No features match the conditions')
+						self.log.info('Finished running tool %s' % self.name)
+						return 0
 					
-					self.log.progressor("Polygons: %s." % count, log='info')
-					#continue
+					# Create a valid name for the ouput raster of each 
+					# combination
+					names = {}
+					for combination in combinations:
+						raster = '_'.join([name + '_' + str(value) for name, value in zip(field_names, combination)])
+						names[combination] = generate_rastername(raster, 
+																 outputws, 
+																 raster_type,
+																 suffix=invalue)
 					
-					if not count > 0:
-						self.log.progressor("Empty selection, skipping.", log='info')
-						continue	
+					# Only the combinations not completed in a previous run 
+					# are converted
+					pending = journal.pending([names[combination] for 
+											   combination 
+											   in sorted(combinations)])
+					todo = [combination for combination in sorted(combinations) 
+							if names[combination] in pending]
+					if not todo:
+						self.log.info('All combinations already completed')
+						journal.finish()
+						self.log.info('Finished running tool %s' % self.name)
+						return 0
 					
-					self.log.debug('Extent STILL is %s' % self.gp.env.extent)
+					# Set the tool progressor
+					if self.log.gui:
+						self.log.setProgressor("Extracting feature class with multiple field values...",
+												max=len(todo))
 					
-					# Make the actual conversion
-					self.gp.FeatureToRaster_conversion("input_feature", invalue, 
-													   raster, pixelsize)
+					# Rasterize the combination identifiers and the values 
+					# only once, both rasters are aligned as they use the same
+					# environment
+					self.log.info('Converting combinations and %s into rasters' 
+								  % invalue)
+					self.gp.FeatureToRaster_conversion(combo_feature, 
+													   COMBINATION_FIELD,
+													   combo_path, pixelsize)
+					self.gp.FeatureToRaster_conversion(combo_feature, invalue, 
+													   value_path, pixelsize)
+				finally:
+					if self.gp.Exists(combo_feature):
+						self.gp.Delete_management(combo_feature)
+				
+				opened = []
+				try:
+					combo_raster = self.open_raster(combo_path)
+					opened.append(combo_raster)
+					value_raster = self.open_raster(value_path)
+					opened.append(value_raster)
+					nodata = value_raster.nodata
+					if nodata is None:
+						nodata = get_nodata_number(value_raster.pixel_type)
 					
-					# Build pyramids
-					self.log.progressor("Building pyramids", log='info')
-					self.gp.BuildPyramids_management(raster)
-
-					self.log.info("Finished conversion")
-
-					# Clear the selection
-					self.gp.SelectLayerByAttribute_management("input_feature", 
-													   "CLEAR_SELECTION", 
-													   "%s = %s" % 
-													   (name, value))
-
-					self.log.setProgressorPosition()
-
-				except Exception, error_desc:
-					self.log.exception("Failed to convert %s: %s" % (raster, error_desc))
-					raise
-
-				self.log.setProgressorPosition()
+					# The value raster is split into the combinations in
+					# batches of OUTPUT_BATCH outputs, each batch in a single
+					# pass
+					for start in xrange(0, len(todo), OUTPUT_BATCH):
+						batch = todo[start:start + OUTPUT_BATCH]
+						paths = [names[combination] for combination in batch]
+						journal.begin(paths)
+						
+						# Create the output rasters in the order of the 
+						# combinations
+						ids = []
+						outputs = []
+						for combination in batch:
+							ids.append(combinations[combination])
+							outputs.append(self.create_raster(names[combination], 
+															  like=value_raster,
+															  pixel_type=value_raster.pixel_type,
+															  nodata=nodata))
+							
+							msg = "Converting %s with following configuration: %s" % (invalue, (' '.join([name + ': ' + str(value) for name, value in zip(field_names, combination)])))
+							self.log.debug(msg)
+						
+						self.log.info('Splitting %s into %s rasters' % 
+									  (invalue, len(batch)))
+						engine = BlockEngine([combo_raster, value_raster], 
+											 outputs, log=self.log)
+						engine.run(partial(class_split, classes=ids, 
+										   ref_nodata=combo_raster.nodata,
+										   value_nodata=value_raster.nodata,
+										   out_nodata=nodata))
+						
+						for raster in outputs:
+							raster.close()
+							pyramids.add(raster.path)
+							self.log.setProgressorPosition()
+						journal.complete(paths)
+				finally:
+					for raster in opened:
+						raster.close()
+			finally:
+				for path in [combo_path, value_path]:
+					if self.gp.Exists(path):
+						self.gp.Delete_management(path)
+				shutil.rmtree(tmpdir, ignore_errors=True)
+			
+			self.log.progressor("Building pyramids", log='info')
+			self.finish_queue(pyramids)
+			journal.finish()
+			
+			self.log.info("Finished conversion")
 			
 			#self.gp.setParameterAsText(1, outputws)
 			
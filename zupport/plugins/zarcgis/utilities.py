@@ -23,8 +23,14 @@ Updated: Sep 19, 2007
 import copy
 import os
 
+from zupport.plugins.zarcgis.errors import LicenseError
 from zupport.zlogging import Logger
 
+# Geoprocessors shared by all the tools {version: gp} and the extensions
+# checked out in this process
+_geoprocessors = {}
+_extensions = set()
+
 def get_geoprocessor(version):
     try:
         if version == 9.3:
@@ -39,6 +45,31 @@ def get_geoprocessor(version):
     except ImportError, e:
         raise e
 
+def shared_geoprocessor(version=10):
+    '''Returns the geoprocessor shared by all the tools in this process. It
+    is created on the first call.
+    '''
+    if version not in _geoprocessors:
+        gp = get_geoprocessor(version)
+        # Set the scratch workspace explicitly to ESRI default
+        gp.ScratchWorkspace = os.path.join(os.path.expanduser('~'), 
+                                           'AppData', 'Local', 'Temp')
+        _geoprocessors[version] = gp
+    return _geoprocessors[version]
+
+def checkout_extension(gp, extension):
+    '''Checks out a license for an ArcGIS extension (e.g. 'spatial'). The
+    license is checked out only once per process. Raises LicenseError if the
+    extension is not available.
+    '''
+    if extension in _extensions:
+        return
+    if gp.CheckExtension(extension) == "Available":
+        gp.CheckOutExtension(extension)
+        _extensions.add(extension)
+    else:
+        raise LicenseError(extension)
+
 #Define message constants so they may be translated easily
 msgErrorGenOutput = "Problem generating Output Name"
 msgErrorGenOutputRaster = "Problem generating Output Raster Name"
@@ -366,6 +397,35 @@ def multisplit(multiInputs):
     except:
         raise Exception, msgErrorSplittingInput
 
+def optional_parameter(value):
+    ''' Returns None for the placeholder values a tool gets for an optional
+    parameter that was left empty ('', '#', 'PATH' or 'None'), otherwise 
+    the value itself.
+    '''
+    if value is None or str(value) in ['', '#', 'PATH', 'None']:
+        return None
+    return value
+
+def aggregate_with_nodata(raster, factor, method='SUM', nodata=True):
+    ''' Aggregates a raster with Spatial Analyst Aggregate (using "EXPAND" and
+    "DATA") honouring the current geoprocessing environment (extent, mask). If
+    nodata is True, cells that have no data in the source raster are set to
+    NoData based on a count of the cells with data instead of the aggregated
+    values, so real zeros are preserved. Returns the aggregated Raster.
+    '''
+    
+    # Create the geoprocessing object
+    gp = get_geoprocessor(10)
+    
+    arc_method = {'MIN': 'MINIMUM', 'MAX': 'MAXIMUM'}.get(method, method)
+    out_agg = gp.sa.Aggregate(raster, factor, arc_method, "EXPAND", "DATA")
+    
+    if nodata:
+        count = gp.sa.Aggregate(gp.sa.Con(gp.sa.IsNull(raster), 0, 1), factor,
+                                "SUM", "EXPAND", "DATA")
+        out_agg = gp.sa.SetNull(count == 0, out_agg)
+    return out_agg
+
 def chop_raster(height, width, nrows, ncols, origin='llc'):
     '''Chops up a given raster (matrix) into as-equal-as-possible chunks based
     on raster width and height. If the raster has odd number of rows or columns
@@ -3,10 +3,16 @@ import pylab as P
 import os
 import sys
 import re
-from types import TupleType
+import shutil
+import tempfile
+import time
+import warnings
+from types import ListType, TupleType
 from datetime import date
+from hashlib import md5
 
 from core import Sppfactory, Zigcommander
+from zupport.plugins.fileio import AsciiGrid, GridCache
 
 def count_alpha(cell_km, cell_actual, input_value): 
     return (2 * cell_km) / (input_value * cell_actual)
@@ -46,68 +52,142 @@ def read_array(filename, dtype, separator=' '):
     
     return N.rec.array(data, dtype=dtype)
 
-def read_ascii_matrix(filename, skip=6, dtype=int):
-    """Read in a ESRI ASCII grid skipping first 6 rows and using int as 
-    a default dtype. Return a ndarray matrix.
+def read_ascii_matrix(filename, skip=None, dtype=int, memmap=None, 
+                      block_rows=1024, cache=False):
+    """Read in a ESRI ASCII grid using int as a default dtype. The header is
+    parsed and the data rows are read in blocks of block_rows. If memmap is 
+    a file path, the grid is read into an on-disk memory map instead of 
+    memory. If cache is True, the grid is parsed only once and later served
+    as a read-only memory map from the binary grid cache in USER_CACHE_DIR 
+    (memmap is then ignored). Return a ndarray matrix.
+    
+    skip is deprecated: if it is given, the grid is read as before with
+    numpy.loadtxt skipping the first skip rows.
     """
     sys.stdout.write('Reading file <%s>...\n' % filename)
     try:
-        return N.loadtxt(filename, skiprows=skip, dtype=dtype)
+        if skip is not None:
+            warnings.warn('skip is deprecated, the number of header rows is '
+                          'read from the grid header', DeprecationWarning, 
+                          stacklevel=2)
+            return N.loadtxt(filename, skiprows=skip, dtype=dtype)
+        if cache:
+            matrix, header = GridCache().load(filename, dtype=dtype, 
+                                              block_rows=block_rows)
+            return matrix
+        grid = AsciiGrid(filename, dtype=dtype)
+        if memmap:
+            return grid.to_memmap(memmap, block_rows=block_rows)
+        else:
+            return grid.read(block_rows=block_rows)
     except IOError:
         print 'given filename <%s> invalid.' % filename
         print 'Exiting.'
         sys.exit(0)
     
 # Different stats & analysis functions
-        
-def compare_multi_distributions(ND=-1, *args):
+
+def _data_mask(matrix, NDs):
+    """Return a boolean array that is True for all the elements in matrix that
+    hold a value (i.e. are not any of the NoData values in NDs).
+    """
+    if type(NDs) not in (ListType, TupleType):
+        NDs = [NDs]
+    mask = N.ones(matrix.shape, dtype=bool)
+    for ND in NDs:
+        mask &= (matrix != ND)
+    return mask
+
+def compare_multi_distributions(ND=-1, *args, **kwargs):
     """Comparers distributions for an arbitrary list of matrices. Function
-    loops through all matrices and defines which elements overlap (=have value
-    in all matrices). All matrices MUST be of same dimensions!
+    goes through all matrices and defines which elements overlap (=have value
+    in all matrices). All matrices MUST be of same dimensions! ND can be a 
+    single NoData value or a list of them.
+    
+    Matrices are processed in blocks of rows (keyword argument block_rows) so
+    that memory mapped matrices never have to be read in as a whole.
+    
+    Returns a dictionary with the following items:
+    
+    'counts'        1-D array: number of elements with value per matrix
+    'intersection'  2-D array: pairwise number of elements with value in both
+                    matrices (diagonal is the same as 'counts')
+    'union'         2-D array: pairwise number of elements with value in 
+                    either of the matrices
+    'all'           number of elements with value in all matrices
+    'any'           number of elements with value in any of the matrices
+    'patterns'      dictionary with a tuple of booleans (one per matrix) as 
+                    the key and the number of elements sharing this presence
+                    pattern as the value
     """
     
-    # Initialize the resulst list
-    results = []
+    block_rows = kwargs.get('block_rows', 1024)
+    nmatrices = len(args)
     
-    # Check that all matrices have the same dimensions and type
-    reftype = type (args[0])
+    if nmatrices < 2:
+        raise ValueError('At least 2 matrices are needed for comparison')
+    if nmatrices > 62:
+        raise ValueError('Maximum number of matrices is 62, %s provided' 
+                         % nmatrices)
+    
+    # Check that all matrices have the same dimensions
     refdims = (N.size(args[0], 0), N.size(args[0], 1))
     
     for i, matrix in enumerate(args):
         dims = (N.size(matrix, 0), N.size(matrix, 1))
         try:
-            assert type(matrix) is reftype, "Mismatch of type <%s> for matrix %s: %s"  \
-                                        % (reftype, i+1, type(matrix))
             assert refdims == dims, "Mismatch of dimensions for matrix: " + \
                                     str(i+1) + " " + str(dims)
         except AssertionError, e:
             print '%s, exiting...' % e
             sys.exit(0)
+    
+    intersection = N.zeros((nmatrices, nmatrices), dtype=N.int64)
+    patterns = {}
+    # Bit weights for encoding presence patterns as integers
+    weights = (N.int64(1) << N.arange(nmatrices, dtype=N.int64))
+    
+    # Loop through the matrices one block of rows at a time
+    for row in xrange(0, refdims[0], block_rows):
+        # presence is a (nmatrices, ncells) array of 0/1 values
+        presence = N.vstack([_data_mask(matrix[row:row + block_rows], 
+                                        ND).ravel() 
+                             for matrix in args]).astype(N.int64)
+        intersection += N.dot(presence, presence.T)
         
-        # Append an empty list to results list for later use
-        results.append([])
-    
-    # Loop through matrices
-    for i in refdims[0]:
-        for j in refdims[1]:
-            elems = []
-            for i, matrix in enumerate(args):
-                elems[i] = matrix[i, j]
-        # for elems
+        codes = N.dot(weights, presence)
+        uniques, inverse = N.unique(codes, return_inverse=True)
+        for code, count in zip(uniques, N.bincount(inverse)):
+            patterns[code] = patterns.get(code, 0) + count
+    
+    counts = intersection.diagonal().copy()
+    union = counts[:, N.newaxis] + counts[N.newaxis, :] - intersection
+    
+    results = {'counts': counts,
+               'intersection': intersection,
+               'union': union,
+               'all': int(patterns.get(int(weights.sum()), 0)),
+               'any': int(sum([count for code, count in patterns.iteritems() 
+                               if code != 0])),
+               'patterns': {}}
+    
+    for code, count in patterns.iteritems():
+        key = tuple([bool(code & weight) for weight in weights])
+        results['patterns'][key] = int(count)
+    
+    return results
             
-def compare_distributions(matrix1, matrix2, NDs=[-1, -2]):
+def compare_distributions(matrix1, matrix2, NDs=[-1, -2], block_rows=1024):
     """Comparers distributions for two matrices. Function
-    loops through the two matrices and defines which elements overlap (=have value
-    in all matrices). Both matrices MUST be of same dimensions! Also assumes
-    that NoData values of an matrix are negative integers and actual values
-    positive integers.
+    goes through the two matrices and defines which elements overlap (=have 
+    value in all matrices). Both matrices MUST be of same dimensions! Also 
+    assumes that NoData values of an matrix are negative integers and actual 
+    values positive integers. Matrices are processed in blocks of block_rows
+    rows.
     """
     
     sys.stdout.write('Comparing distributions...\n')
     
-    # Initialize the results dictionary: 
-    results = {'matrix1': 0, 'both':0, 'matrix2': 0}
-    
     # Check that all matrices have the same dimensions and type
     type1 = type(matrix1)
     dims1 = (N.size(matrix1, 0), N.size(matrix1, 1))
@@ -119,17 +199,15 @@ def compare_distributions(matrix1, matrix2, NDs=[-1, -2]):
         print '%s, exiting...' % e
         sys.exit(0)
 
-    # Loop through matrices
-    for i in xrange(dims1[0]):
-        for j in xrange(dims1[1]):
-            val1 = matrix1[i, j]
-            val2 = matrix2[i, j]
-            if val1 not in NDs and  val2 in NDs:
-                results['matrix1'] += 1
-            elif val1 not in NDs and  val2 not in NDs:
-                results['both'] += 1
-            elif val1 in NDs and  val2 not in NDs:
-                results['matrix2'] += 1
+    results = {'matrix1': 0, 'both': 0, 'matrix2': 0}
+    
+    for row in xrange(0, dims1[0], block_rows):
+        data1 = _data_mask(matrix1[row:row + block_rows], NDs)
+        data2 = _data_mask(matrix2[row:row + block_rows], NDs)
+        both = int(N.count_nonzero(data1 & data2))
+        results['both'] += both
+        results['matrix1'] += int(N.count_nonzero(data1)) - both
+        results['matrix2'] += int(N.count_nonzero(data2)) - both
     
     print 'done.'
     return results
@@ -149,12 +227,62 @@ def create_matrix(x, y, p):
     return matrix
 
 
-def make_comparisons(wdir, basedir, files, sequence, verbose=True, ext=''):
+def _memmap_name(path, memmap_dir):
+    if memmap_dir:
+        return os.path.join(memmap_dir, '%s.mmap' % 
+                            md5(os.path.abspath(path)).hexdigest())
+
+def _matrix_source(matrix, path):
+    """Returns a picklable description of how a worker process can get hold 
+    of an already read matrix: memory mapped matrices are re-opened read-only
+    from disk, others need to be read from the original path.
+    """
+    if isinstance(matrix, N.memmap) and matrix.filename:
+        return ('memmap', matrix.filename, matrix.dtype.str, matrix.shape, 
+                matrix.offset)
+    else:
+        return ('file', path)
+
+def _compare_pair(task):
+    """Worker function for make_comparisons. Task is a tuple (reference 
+    source, target file, memmap_dir, cache). Returns a tuple (distsums, 
+    elapsed seconds).
+    """
+    source, target, memmap_dir, cache = task
+    t1 = time.time()
+    if source[0] == 'memmap':
+        matrix1 = N.memmap(source[1], dtype=source[2], mode='r', 
+                           shape=source[3], offset=source[4])
+    else:
+        matrix1 = read_ascii_matrix(source[1], cache=cache)
+    matrix2 = read_ascii_matrix(target, memmap=_memmap_name(target, memmap_dir),
+                                cache=cache)
+    # The reference is memory mapped even if the target is not, the matrices
+    # are compared as plain arrays (views, nothing is copied)
+    distsums = compare_distributions(N.asarray(matrix1), N.asarray(matrix2))
+    return distsums, time.time() - t1
+
+def make_comparisons(wdir, basedir, files, sequence, verbose=True, ext='',
+                     memmap_dir=None, cache=False, processes=1):
     """Function to go through all Z solution folders in a given wdir folder
     based on sequence provided by tuple sequence. Each folder is identified
     by integer id number in the beginning of the folder name. Single basedir
     is given followed by files which is a list of files in basedir that will
-    work as reference for comaprison. 
+    work as reference for comaprison. If memmap_dir is provided, grids are
+    read into on-disk memory maps in that folder instead of memory.
+    
+    If cache is True, grids are read through the binary grid cache 
+    (USER_CACHE_DIR/grids) so that re-running comparisons does not re-parse
+    the same files. Each grid is then also stored as a .npy file in the
+    cache. Cached grids are used only if the modification time and size of
+    the source file have not changed.
+    
+    If processes is larger than 1, the (reference file, target folder) pairs
+    are compared in a pool of worker processes. The references are then
+    always memory mapped (into a temporary folder if memmap_dir is not
+    given), so that the workers do not parse them again. Results are always
+    written in the same order as in serial mode and each line records the 
+    time spent on the pair.
     """
     # Determine whether the sequence is a list of folders or a range
     # Else it is assumed that sequnce is already a list containing folder ids
@@ -177,7 +305,8 @@ def make_comparisons(wdir, basedir, files, sequence, verbose=True, ext=''):
     if ref_id in folder_ids:
         folder_ids.remove(ref_id)
     
-    # Create a dictionary where folder id is key and target file name value
+    # Create a dictionary where (folder id, reference file) is key and target
+    # file name value
     f_dict = {}
     
     for folder in folders:
@@ -187,7 +316,7 @@ def make_comparisons(wdir, basedir, files, sequence, verbose=True, ext=''):
                 t_name = os.path.join(wdir, folder, os.path.basename(file))
                 if f_id in folder_ids and f_id:
                     if os.path.exists(t_name):
-                        f_dict[f_id] = t_name
+                        f_dict[(f_id, file)] = t_name
                     else:
                         print 'Target file %s does not exist!' % t_name
                         sys.exit(0)
@@ -201,7 +330,8 @@ def make_comparisons(wdir, basedir, files, sequence, verbose=True, ext=''):
                 'Matrxi1',
                 'Matrix2',
                 'File',
-                'Time']
+                'Time',
+                'Elapsed']
     s_header = '\t'.join(l_header)
     
     # Open output file
@@ -212,31 +342,78 @@ def make_comparisons(wdir, basedir, files, sequence, verbose=True, ext=''):
         out_file = open(out_name, 'w')
         out_file.write(s_header + '\n')
     
-    for file in files:
-        matrix1 = read_ascii_matrix(file)
-        for i, case in enumerate(folder_ids):
-            matrix2 = read_ascii_matrix(f_dict[case])
-            distsums = compare_distributions(matrix1, matrix2)
-            msum = sum([s for s in distsums.values()])
-
-            s_results = '\t'.join(map(str, [(i + 1),
-                                  case,
-                                  msum, 
-                                  distsums['both'], 
-                                  (float(distsums['both']) / float(msum)),
-                                  distsums['matrix1'],
-                                  distsums['matrix2'],
-                                  f_dict[case],
-                                  date.today().isoformat()]))
+    if processes > 1:
+        from multiprocessing import Pool
+        pool = Pool(processes)
+        # Workers re-open the references from memory maps, parsing the grid
+        # again in each task would take most of the time saved by the pool
+        ref_dir = memmap_dir or tempfile.mkdtemp(prefix='zupport_')
+    else:
+        pool = None
+        ref_dir = memmap_dir
+    
+    matrix1 = None
+    try:
+        for file in files:
+            # The reference is read only once, workers re-open it from disk if 
+            # it is memory mapped
+            matrix1 = read_ascii_matrix(file, memmap=_memmap_name(file, ref_dir), 
+                                        cache=cache)
+            source = _matrix_source(matrix1, file)
             
-            out_file.write(s_results + '\n')
-            if verbose:
-                print
-                print s_header
-                print s_results
-                print
+            if pool:
+                tasks = [(source, f_dict[(case, file)], memmap_dir, cache) 
+                         for case in folder_ids]
+                # imap returns the results in the order of the tasks
+                results = pool.imap(_compare_pair, tasks)
+            else:
+                results = None
+                
+            for i, case in enumerate(folder_ids):
+                if results is not None:
+                    distsums, elapsed = results.next()
+                else:
+                    t1 = time.time()
+                    matrix2 = read_ascii_matrix(f_dict[(case, file)], 
+                                                memmap=_memmap_name(f_dict[(case, file)],
+                                                                    memmap_dir),
+                                                cache=cache)
+                    distsums = compare_distributions(matrix1, matrix2)
+                    elapsed = time.time() - t1
+                msum = sum([s for s in distsums.values()])
 
-    out_file.close()
+                s_results = '\t'.join(map(str, [(i + 1),
+                                      case,
+                                      msum, 
+                                      distsums['both'], 
+                                      (float(distsums['both']) / float(msum)),
+                                      distsums['matrix1'],
+                                      distsums['matrix2'],
+                                      f_dict[(case, file)],
+                                      date.today().isoformat(),
+                                      '%.2f' % elapsed]))
+                
+                out_file.write(s_results + '\n')
+                out_file.flush()
+                if verbose:
+                    print
+                    print s_header
+                    print s_results
+                    print
+    except:
+        if pool:
+            pool.terminate()
+            pool.join()
+            pool = None
+        raise
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        out_file.close()
+        if ref_dir != memmap_dir:
+            matrix1 = None
+            shutil.rmtree(ref_dir, ignore_errors=True)
 
 def check_folder(folder, suffix):
     today = date.today().isoformat().replace('-', '')
@@ -0,0 +1,6 @@
+from algebra import *
+from core import *
+from errors import *
+from graph import *
+from kernels import *
+from pipeline import *
\ No newline at end of file
@@ -0,0 +1,206 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Small raster algebra compiler. Operations on groups of rasters are compiled
+into an expression tree of operands and binary operators, which is then
+evaluated block by block. Evaluation uses in-place NumPy ufuncs and scratch
+buffers that are reused from block to block, so the cost of an expression
+does not grow with temporary arrays for every term.
+
+>>> expression = compile_group('SUM', [raster.nodata for raster in rasters])
+>>> BlockEngine(rasters, output).run(expression)
+"""
+
+import threading
+
+import numpy as np
+
+from kernels import REDUCE_OPERATORS
+
+# How NoData operands are treated: SKIP computes the result from the operands
+# that have data (like nansum), PROPAGATE gives NoData if any operand has
+# NoData.
+NODATA_RULES = ['SKIP', 'PROPAGATE']
+
+# Values standing in for a left operand with NoData under the SKIP rule, so
+# NoData - b is -b. None means that the result has NoData where the left
+# operand has NoData (NoData / b is NoData). A right operand with NoData is
+# skipped, i.e. a - NoData is a and a * NoData is a.
+LEFT_IDENTITIES = {'SUM': 0,
+                   'SUBTRACTION': 0,
+                   'MULTIPLICATION': 1,
+                   'DIVISION': None}
+
+# Rules used by compile_group unless a rule is given. The old ArcGIS tools
+# replaced NoData with 0 and set results <= 0 to NoData, so a * NoData and
+# a / NoData were NoData. Only SUM and SUBTRACTION skip NoData operands.
+DEFAULT_RULES = {'SUM': 'SKIP',
+                 'SUBTRACTION': 'SKIP',
+                 'MULTIPLICATION': 'PROPAGATE',
+                 'DIVISION': 'PROPAGATE'}
+
+class Operand(object):
+    """Leaf of an expression tree, the index-th input array of a block."""
+
+    def __init__(self, index, nodata=None):
+        self.index = index
+        self.nodata = nodata
+
+    def __repr__(self):
+        return 'Operand(%s)' % self.index
+
+class BinaryOp(object):
+    """Node of an expression tree applying operator (see REDUCE_OPERATORS)
+    to the results of the left and right subtrees.
+    """
+
+    def __init__(self, operator, left, right):
+        if operator not in REDUCE_OPERATORS:
+            raise ValueError('Operator %s not suitable for simple algebra.' %
+                             (operator))
+        self.operator = operator
+        self.ufunc = REDUCE_OPERATORS[operator]
+        self.left = left
+        self.right = right
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (self.operator, self.left, self.right)
+
+    @property
+    def depth(self):
+        '''Number of nested levels of scratch buffers needed to evaluate the
+        tree.
+        '''
+        depths = [1]
+        if isinstance(self.left, BinaryOp):
+            depths.append(self.left.depth)
+        if isinstance(self.right, BinaryOp):
+            depths.append(self.right.depth + 1)
+        return max(depths)
+
+class Expression(object):
+    """Compiled expression tree. Calling the expression with the input arrays
+    of a block returns the result array with out_nodata where the result has
+    no data. Rule tells how NoData operands are treated (see NODATA_RULES and
+    LEFT_IDENTITIES). Scratch buffers are kept per thread, so an expression
+    can be used by the workers of a BlockPipeline.
+    """
+
+    def __init__(self, tree, rule='SKIP', out_nodata=None,
+                 pixel_type='float32'):
+        if rule not in NODATA_RULES:
+            raise ValueError('Unknown NoData rule: %s' % rule)
+        self.tree = tree
+        self.rule = rule
+        self.out_nodata = out_nodata
+        self.pixel_type = pixel_type
+        self._local = threading.local()
+
+    def __repr__(self):
+        return 'Expression(%r, %s)' % (self.tree, self.rule)
+
+    def _buffers(self, shape):
+        '''Returns a list of (values, has_data) scratch buffer pairs and a
+        boolean mask buffer, all views of flat buffers of this thread.
+        '''
+        size = int(np.prod(shape))
+        # The level below the deepest one holds the data mask of the right
+        # operand
+        depth = 1
+        if isinstance(self.tree, BinaryOp):
+            depth = self.tree.depth + 1
+        local = self._local
+        if getattr(local, 'size', 0) < size:
+            local.values = [np.empty(size, dtype=np.float64)
+                            for i in xrange(depth)]
+            local.has_data = [np.empty(size, dtype=bool)
+                              for i in xrange(depth)]
+            local.mask = np.empty(size, dtype=bool)
+            local.size = size
+        pairs = [(values[:size].reshape(shape), has_data[:size].reshape(shape))
+                 for values, has_data in zip(local.values, local.has_data)]
+        return pairs, local.mask[:size].reshape(shape)
+
+    def _data_mask(self, operand, array, out):
+        if operand.nodata is None:
+            out.fill(True)
+        else:
+            np.not_equal(array, operand.nodata, out=out)
+        return out
+
+    def _eval(self, node, arrays, buffers, level, mask):
+        '''Evaluates node into the scratch buffers at level.'''
+        values, has_data = buffers[level]
+        if isinstance(node, Operand):
+            array = arrays[node.index]
+            self._data_mask(node, array, has_data)
+            np.copyto(values, array, casting='unsafe')
+            return
+
+        self._eval(node.left, arrays, buffers, level, mask)
+        if isinstance(node.right, Operand):
+            right = arrays[node.right.index]
+            right_has_data = self._data_mask(node.right, right,
+                                             buffers[level + 1][1])
+        else:
+            self._eval(node.right, arrays, buffers, level + 1, mask)
+            right, right_has_data = buffers[level + 1]
+
+        identity = LEFT_IDENTITIES[node.operator]
+        if self.rule == 'SKIP' and identity is not None:
+            # Where only the right side has data, the left side is the
+            # identity of the operator
+            np.greater(right_has_data, has_data, out=mask)
+            np.copyto(values, identity, where=mask)
+            node.ufunc(values, right, out=values, where=right_has_data)
+            np.logical_or(has_data, right_has_data, out=has_data)
+        else:
+            # Apply the operator where both sides have data
+            np.logical_and(has_data, right_has_data, out=mask)
+            node.ufunc(values, right, out=values, where=mask)
+            if self.rule == 'PROPAGATE':
+                np.logical_and(has_data, right_has_data, out=has_data)
+
+    def __call__(self, *arrays):
+        shape = arrays[0].shape
+        buffers, mask = self._buffers(shape)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            self._eval(self.tree, arrays, buffers, 0, mask)
+        values, has_data = buffers[0]
+
+        out = np.empty(shape, dtype=self.pixel_type)
+        np.copyto(out, values, casting='unsafe')
+        np.logical_not(has_data, out=mask)
+        out[mask] = self.out_nodata if self.out_nodata is not None else 0
+        return out
+
+def compile_group(operator, nodatas, out_nodata=None, pixel_type='float32',
+                  rule=None):
+    '''Compiles a group operation (SUM, SUBTRACTION, MULTIPLICATION or
+    DIVISION applied from left to right to rasters with the given NoData
+    values) into an Expression. If rule is None, the rule of the operator in
+    DEFAULT_RULES is used.
+    '''
+    if operator not in REDUCE_OPERATORS:
+        raise ValueError('Operator %s not suitable for simple algebra.' %
+                         (operator))
+    if rule is None:
+        rule = DEFAULT_RULES[operator]
+    tree = Operand(0, nodatas[0])
+    for i in xrange(1, len(nodatas)):
+        tree = BinaryOp(operator, tree, Operand(i, nodatas[i]))
+    return Expression(tree, rule, out_nodata, pixel_type)
+
+def group_reduce(arrays, nodatas, operator, out_nodata, pixel_type='float32',
+                 rule=None):
+    '''Reduces a list of arrays into one with a raster algebra operator (see
+    REDUCE_OPERATORS) applied from left to right. By default (see
+    DEFAULT_RULES) NoData cells are skipped for SUM and SUBTRACTION, i.e. the
+    result is computed from the cells that have data in order, much like
+    nansum does. Where the accumulated result has no data yet, it stands for
+    the identity of the operator (see LEFT_IDENTITIES), so NoData - b is -b.
+    For MULTIPLICATION and DIVISION a NoData operand gives NoData. Result has
+    out_nodata where it has no data.
+    '''
+    return compile_group(operator, nodatas, out_nodata, pixel_type,
+                         rule)(*arrays)
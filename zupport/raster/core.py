@@ -0,0 +1,443 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Backend neutral block processing of rasters. Rasters are accessed through
+adapters that can read and write rectangular windows as NumPy arrays, so the
+same processing code runs on top of GDAL (no ArcGIS needed), ArcGIS or plain
+NumPy arrays. A typical use without ArcGIS is:
+
+    inputs = [open_raster('a.img'), open_raster('b.img')]
+    output = create_raster('c.img', like=inputs[0], pixel_type='float32',
+                           nodata=-9999)
+    BlockEngine(inputs, output, mem_max=500000000).run(func)
+    output.close()
+
+where func takes one array per input raster and returns the output array.
+"""
+
+import os
+from collections import namedtuple
+from fractions import gcd
+
+import numpy as np
+
+from zupport.plugins.fileio import size_in_mem, pixeltype_to_pixeltype
+from errors import RasterError
+from kernels import aggregate_result, aggregate_state, data_mask
+
+try:
+    from osgeo import gdal
+    GDAL_AVAILABLE = True
+except ImportError:
+    gdal = None
+    GDAL_AVAILABLE = False
+
+# Window is a rectangular part of a raster. Row and column offsets are counted
+# from the upper left corner.
+Window = namedtuple('Window', 'row col nrows ncols')
+
+# GDAL drivers used for output rasters based on the file extension
+GDAL_DRIVERS = {'.img': 'HFA',
+                '.tif': 'GTiff',
+                '.tiff': 'GTiff'}
+
+# Default creation options for the GDAL drivers
+GDAL_OPTIONS = {'HFA': ['COMPRESSED=YES'],
+                'GTiff': ['COMPRESS=LZW', 'TILED=YES', 'BIGTIFF=IF_SAFER']}
+
+# GDAL data type names and corresponding NumPy pixel types
+GDAL_TYPES = {'Byte': 'uint8',
+              'UInt16': 'uint16',
+              'Int16': 'int16',
+              'UInt32': 'uint32',
+              'Int32': 'int32',
+              'Float32': 'float32',
+              'Float64': 'float64'}
+
+def block_shape(shape, cell_bytes, mem_max, natural=None):
+    '''Returns the (nrows, ncols) shape of the largest block that fits into
+    mem_max bytes when each cell requires cell_bytes bytes. Blocks span the
+    whole raster width if even a single row fits into memory, otherwise rows
+    are split as well. If natural block shape (e.g. GDAL block size) of the
+    raster is given, the block shape is aligned with it.
+    '''
+    nrows, ncols = shape
+    row_bytes = ncols * cell_bytes
+
+    if row_bytes <= mem_max:
+        rows = min(nrows, max(1, int(mem_max // row_bytes)))
+        if natural and natural[0] < rows < nrows:
+            rows -= rows % natural[0]
+        return (rows, ncols)
+    else:
+        cols = max(1, int(mem_max // cell_bytes))
+        if natural and natural[1] < cols:
+            cols -= cols % natural[1]
+        return (1, cols)
+
+def block_windows(shape, block):
+    '''Generator yielding Windows of (at most) block size that cover a raster
+    of a given shape. Windows are returned row by row from the upper left
+    corner.
+    '''
+    nrows, ncols = shape
+    for row in xrange(0, nrows, block[0]):
+        for col in xrange(0, ncols, block[1]):
+            yield Window(row, col, min(block[0], nrows - row),
+                         min(block[1], ncols - col))
+
+def to_pixel_type(pixel_type):
+    '''Converts any of the known pixel type abbreviations (osgeo, arc_short,
+    arc_long) into a NumPy pixel type name.
+    '''
+    if isinstance(pixel_type, np.dtype):
+        return str(pixel_type)
+    converted = pixeltype_to_pixeltype(pixel_type, 'osgeo')
+    if not converted:
+        raise RasterError('Unknown pixel type: %s' % pixel_type)
+    return converted
+
+class RasterAdapter(object):
+    """Base class for raster adapters. Adapters expose a single band raster
+    through read_window / write_window methods operating on NumPy arrays.
+
+    Subclasses must set the following attributes:
+    path - path to the raster
+    shape - tuple (nrows, ncols)
+    pixel_type - NumPy name of the pixel type (e.g. 'float32')
+    nodata - NoData value or None
+    geotransform - GDAL style geotransform tuple
+    projection - projection as WKT string
+    natural - natural block shape of the raster or None
+    """
+
+    path = None
+    shape = None
+    pixel_type = None
+    nodata = None
+    geotransform = None
+    projection = ''
+    natural = None
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.path)
+
+    def read_window(self, window):
+        raise NotImplementedError
+
+    def write_window(self, window, array):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class RasterTemplate(RasterAdapter):
+    """Describes the dimensions and georeferencing of a raster that does not
+    exist yet. Can be used as like for create_raster.
+    """
+
+    def __init__(self, shape, geotransform, projection=''):
+        self.shape = shape
+        self.geotransform = geotransform
+        self.projection = projection
+
+class ArrayRaster(RasterAdapter):
+    """Adapter wrapping a two dimensional NumPy array (or memory map).
+    """
+
+    def __init__(self, array, nodata=None, geotransform=(0, 1, 0, 0, 0, -1),
+                 projection='', path=None):
+        if array.ndim != 2:
+            raise RasterError('Array must be two dimensional')
+        self.array = array
+        self.path = path
+        self.shape = array.shape
+        self.pixel_type = str(array.dtype)
+        self.nodata = nodata
+        self.geotransform = geotransform
+        self.projection = projection
+
+    def read_window(self, window):
+        return self.array[window.row:window.row + window.nrows,
+                          window.col:window.col + window.ncols]
+
+    def write_window(self, window, array):
+        self.array[window.row:window.row + window.nrows,
+                   window.col:window.col + window.ncols] = array
+
+class GDALRaster(RasterAdapter):
+    """Adapter for the first band of a GDAL dataset.
+    """
+
+    def __init__(self, dataset, path):
+        self.dataset = dataset
+        self.band = dataset.GetRasterBand(1)
+        self.path = path
+        self.shape = (dataset.RasterYSize, dataset.RasterXSize)
+        self.pixel_type = GDAL_TYPES[gdal.GetDataTypeName(self.band.DataType)]
+        self.nodata = self.band.GetNoDataValue()
+        self.geotransform = dataset.GetGeoTransform()
+        self.projection = dataset.GetProjection()
+        # GDAL reports block size as (x, y)
+        xsize, ysize = self.band.GetBlockSize()
+        self.natural = (ysize, xsize)
+
+    def read_window(self, window):
+        return self.band.ReadAsArray(window.col, window.row, window.ncols,
+                                     window.nrows)
+
+    def write_window(self, window, array):
+        if array.dtype != np.dtype(self.pixel_type):
+            array = array.astype(self.pixel_type)
+        self.band.WriteArray(array, window.col, window.row)
+
+    def close(self):
+        if self.dataset is not None:
+            self.band.FlushCache()
+            self.band = None
+            self.dataset = None
+
+def open_raster(path, update=False):
+    '''Opens an existing raster with GDAL and returns a GDALRaster adapter.
+    '''
+    if not GDAL_AVAILABLE:
+        raise RasterError('GDAL/OGR not present in the system.')
+    if not os.path.exists(path):
+        raise RasterError('Path provided does not exist: %s' % path)
+
+    if update:
+        dataset = gdal.Open(path, gdal.GA_Update)
+    else:
+        dataset = gdal.Open(path, gdal.GA_ReadOnly)
+    if dataset is None:
+        raise RasterError('Could not open raster %s' % path)
+    return GDALRaster(dataset, path)
+
+def create_raster(path, like, pixel_type, nodata, driver=None, options=None):
+    '''Creates a new single band raster with GDAL and returns a GDALRaster
+    adapter to it. Dimensions, geotransform and projection are taken from
+    another raster adapter (like). If driver is not given, it is inferred from
+    the file extension. The raster is allocated on disk upfront so that blocks
+    can be written straight into it.
+    '''
+    if not GDAL_AVAILABLE:
+        raise RasterError('GDAL/OGR not present in the system.')
+
+    if driver is None:
+        ext = os.path.splitext(path)[1].lower()
+        if ext not in GDAL_DRIVERS:
+            raise RasterError('No GDAL driver for raster %s' % path)
+        driver = GDAL_DRIVERS[ext]
+    if options is None:
+        options = GDAL_OPTIONS.get(driver, [])
+
+    pixel_type = to_pixel_type(pixel_type)
+    gdal_type = dict([(value, key) for key, value in GDAL_TYPES.iteritems()])
+
+    gdal_driver = gdal.GetDriverByName(driver)
+    if os.path.exists(path):
+        gdal_driver.Delete(path)
+    dataset = gdal_driver.Create(path, like.shape[1], like.shape[0], 1,
+                                 gdal.GetDataTypeByName(gdal_type[pixel_type]),
+                                 options)
+    if dataset is None:
+        raise RasterError('Could not create raster %s' % path)
+
+    dataset.SetGeoTransform(like.geotransform)
+    if like.projection:
+        dataset.SetProjection(like.projection)
+    if nodata is not None:
+        dataset.GetRasterBand(1).SetNoDataValue(nodata)
+    return GDALRaster(dataset, path)
+
+def overview_levels(shape, min_size=64):
+    '''Returns the decimation factors (powers of two) of the overviews for a
+    raster of shape. Overviews are built until the smaller dimension drops
+    below min_size cells.
+    '''
+    levels = []
+    level = 2
+    while min(shape) // level >= min_size:
+        levels.append(level)
+        level *= 2
+    return levels
+
+def build_overviews(path, resampling='NEAREST', statistics=True,
+                    min_size=64):
+    '''Builds overviews (pyramids) and optionally band statistics for an
+    existing raster with GDAL. Returns the overview levels built.
+    '''
+    raster = open_raster(path, update=True)
+    try:
+        dataset = raster.dataset
+        levels = overview_levels(raster.shape, min_size)
+        if levels and dataset.BuildOverviews(resampling, levels) != 0:
+            raise RasterError('Could not build overviews for %s' % path)
+        if statistics:
+            for i in xrange(dataset.RasterCount):
+                dataset.GetRasterBand(i + 1).ComputeStatistics(False)
+    finally:
+        raster.close()
+    return levels
+
+class BlockEngine(object):
+    """Runs a function over a set of input rasters block by block and writes
+    the results into an output raster. Output can also be a list of rasters,
+    in which case the function must return a list of arrays, one per output
+    raster. All rasters must have the same dimensions. Block size is chosen so
+    that the input blocks, the output blocks and work_copies float64 working
+    arrays of all the blocks in flight fit into mem_max bytes.
+    """
+
+    def __init__(self, inputs, output, mem_max=500000000, work_copies=4,
+                 log=None):
+        self.inputs = inputs
+        self.output = output
+        if isinstance(output, (list, tuple)):
+            self.outputs = list(output)
+        else:
+            self.outputs = [output]
+        self.mem_max = mem_max
+        self.work_copies = work_copies
+        self.log = log
+
+        for raster in inputs[1:] + self.outputs:
+            if raster.shape != inputs[0].shape:
+                raise RasterError('Raster dimensions do not match: %s %s'
+                                  % (inputs[0].shape, raster.shape))
+        self.shape = inputs[0].shape
+
+    @property
+    def cell_bytes(self):
+        '''Number of bytes needed per cell for all the blocks in memory.'''
+        cell_bytes = 0
+        for raster in self.inputs + self.outputs:
+            cell_bytes += size_in_mem(1, to_pixel_type(raster.pixel_type))
+            # Deferred rasters also need memory for computing their blocks
+            cell_bytes += getattr(raster, 'work_bytes', 0)
+        return cell_bytes + self.work_copies * size_in_mem(1, 'float64')
+
+    @property
+    def in_flight(self):
+        '''Number of blocks held in memory at the same time.'''
+        return 1
+
+    @property
+    def block(self):
+        return block_shape(self.shape, self.cell_bytes,
+                           self.mem_max / self.in_flight,
+                           self.inputs[0].natural)
+
+    def windows(self):
+        return block_windows(self.shape, self.block)
+
+    def write(self, window, result):
+        '''Writes the result of the block function into the output raster(s).
+        '''
+        if isinstance(self.output, (list, tuple)):
+            for raster, array in zip(self.outputs, result):
+                raster.write_window(window, array)
+        else:
+            self.output.write_window(window, result)
+
+    def run(self, func):
+        '''Applies func to every block of the input rasters and writes the
+        result(s) into the output raster(s). Returns the number of blocks
+        processed.
+        '''
+        block = self.block
+        if self.log:
+            self.log.debug('Processing %s x %s raster in blocks of %s x %s',
+                           *(self.shape + block))
+        nblocks = 0
+        for window in block_windows(self.shape, block):
+            arrays = [raster.read_window(window) for raster in self.inputs]
+            self.write(window, func(*arrays))
+            nblocks += 1
+        if self.log:
+            self.log.debug('Processed %s blocks', nblocks)
+        return nblocks
+
+def unique_values(raster, mem_max=500000000):
+    '''Returns the sorted unique values (NoData excluded) of a raster. The
+    raster is read block by block.
+    '''
+    cell_bytes = 2 * size_in_mem(1, to_pixel_type(raster.pixel_type))
+    block = block_shape(raster.shape, cell_bytes, mem_max, raster.natural)
+    values = np.array([], dtype=to_pixel_type(raster.pixel_type))
+    for window in block_windows(raster.shape, block):
+        array = raster.read_window(window)
+        if raster.nodata is not None:
+            array = array[array != raster.nodata]
+        values = np.union1d(values, np.unique(array))
+    return values
+
+def aggregate_template(raster, factor):
+    '''Returns a RasterTemplate for raster aggregated with cell factor. Partial
+    cells at the right and bottom edges are included.
+    '''
+    x, xres, xrot, y, yrot, yres = raster.geotransform
+    return RasterTemplate((-(-raster.shape[0] // factor),
+                           -(-raster.shape[1] // factor)),
+                          (x, xres * factor, xrot, y, yrot, yres * factor),
+                          raster.projection)
+
+def aggregate_raster(raster, output, factor, method='SUM', mem_max=500000000,
+                     log=None):
+    '''Aggregates raster into output (see aggregate_template) with cell factor
+    and method (see kernels.aggregate) block by block. Returns the number of
+    blocks processed.
+    '''
+    return aggregate_pyramid(raster, {factor: output}, method, mem_max, log)
+
+def aggregate_pyramid(raster, outputs, method='SUM', mem_max=500000000,
+                      log=None):
+    '''Aggregates raster with several cell factors in a single read. Outputs
+    is a dictionary of cell factor -> output raster (see aggregate_template).
+    Blocks are aligned with the aggregate cells of all the factors. Within a
+    block, each factor is cascaded from the largest smaller factor that it
+    divides evenly, except for MEDIAN which is always computed from the source
+    cells. Returns the number of blocks processed.
+    '''
+    factors = sorted(outputs)
+    parents = {}
+    for i, factor in enumerate(factors):
+        parents[factor] = 1
+        if method != 'MEDIAN':
+            for parent in factors[:i]:
+                if factor % parent == 0:
+                    parents[factor] = parent
+
+    # Blocks must hold whole aggregate cells of every factor
+    step = reduce(lambda a, b: a * b // gcd(a, b), factors)
+
+    # Input block, the float64 working copies and the cell counts
+    cell_bytes = (size_in_mem(1, to_pixel_type(raster.pixel_type)) +
+                  3 * size_in_mem(1, 'float64'))
+    rows, cols = block_shape(raster.shape, cell_bytes, mem_max, raster.natural)
+    if rows < raster.shape[0]:
+        rows = max(step, rows - rows % step)
+    if cols < raster.shape[1]:
+        cols = max(step, cols - cols % step)
+    if log:
+        log.debug('Aggregating %s x %s raster with factors %s in blocks of '
+                  '%s x %s', *(raster.shape + (factors, rows, cols)))
+
+    nblocks = 0
+    for window in block_windows(raster.shape, (rows, cols)):
+        array = raster.read_window(window)
+        states = {1: (array, data_mask(array, raster.nodata))}
+        for factor in factors:
+            values, counts = states[parents[factor]]
+            states[factor] = aggregate_state(values, counts,
+                                             factor // parents[factor], method)
+            output = outputs[factor]
+            result = aggregate_result(states[factor][0], states[factor][1],
+                                      method, output.nodata,
+                                      to_pixel_type(output.pixel_type))
+            output.write_window(Window(window.row // factor,
+                                       window.col // factor,
+                                       result.shape[0], result.shape[1]),
+                                result)
+        nblocks += 1
+    return nblocks
@@ -0,0 +1,18 @@
+#!/usr/bin/python
+# coding=utf-8
+
+class RasterError(Exception):
+    """ Customized error class caused if a raster can not be opened, created or
+    processed.
+
+    INPUTS:
+    value (str): error message to be delivered.
+
+    METHODS:
+    __str__: returns error message for printing.
+    """
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return self.value
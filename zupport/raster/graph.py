@@ -0,0 +1,197 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Deferred raster graphs. When tools are chained, an intermediate result does
+not need to be written to disk just to be read back by the next tool. Instead
+the tool producing it defers the computation into a LazyRaster, which computes
+its blocks on demand from its sources. The next tool reads the LazyRaster like
+any other raster, so the whole chain is evaluated block by block in a single
+pass and only the terminal outputs are written.
+
+A RasterGraph keeps track of the deferred rasters of a chain by their output
+paths. Deferred rasters that no tool consumed are terminal outputs and are
+written by RasterGraph.materialize. Only tools reading their inputs by path
+through the graph can consume deferred rasters (see Tool.reads_deferred), the
+rasters left in the graph are written before any other tool of the chain is
+run. A written raster is removed from the graph, so later tools read it from
+disk.
+
+A deferred raster can be read by several tools. The graph and each reader
+hold a reference to it and its sources are closed when the last one of them
+closes it.
+"""
+
+import os
+import threading
+
+from zupport.plugins.fileio import size_in_mem
+from core import BlockEngine, RasterAdapter, to_pixel_type
+
+class LazyRaster(RasterAdapter):
+    """Raster computed block by block by applying func to the blocks of the
+    source rasters. Dimensions and georeferencing are taken from raster like.
+    The result of the latest window is kept, so a LazyRaster read by several
+    consumers for the same window is computed only once. A LazyRaster owns
+    its sources, closing it closes them. Each user taking a reference with
+    acquire must close it, the sources are closed by the last one.
+    """
+
+    def __init__(self, func, sources, like, pixel_type, nodata=None,
+                 path=None, work_copies=4):
+        self.func = func
+        self.sources = sources
+        self.path = path
+        self.shape = like.shape
+        self.pixel_type = to_pixel_type(pixel_type)
+        self.nodata = nodata
+        self.geotransform = like.geotransform
+        self.projection = like.projection
+        self.natural = sources[0].natural
+        self.work_copies = work_copies
+        self._lock = threading.Lock()
+        self._window = None
+        self._array = None
+        self._users = 1
+
+    @property
+    def work_bytes(self):
+        '''Number of bytes per cell needed to compute a block, including the
+        blocks of the sources.
+        '''
+        work_bytes = self.work_copies * size_in_mem(1, 'float64')
+        for source in self.sources:
+            work_bytes += size_in_mem(1, to_pixel_type(source.pixel_type))
+            work_bytes += getattr(source, 'work_bytes', 0)
+        return work_bytes
+
+    def read_window(self, window):
+        self._lock.acquire()
+        try:
+            if window != self._window:
+                arrays = [source.read_window(window) for source in
+                          self.sources]
+                self._array = self.func(*arrays)
+                self._window = window
+            return self._array
+        finally:
+            self._lock.release()
+
+    def acquire(self):
+        '''Takes a reference to the raster for another user. Returns the
+        raster.
+        '''
+        self._lock.acquire()
+        try:
+            self._users += 1
+        finally:
+            self._lock.release()
+        return self
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            self._users -= 1
+            if self._users > 0:
+                return
+            self._window = None
+            self._array = None
+        finally:
+            self._lock.release()
+        for source in self.sources:
+            source.close()
+
+class RasterGraph(object):
+    """Deferred rasters of a chain of tools keyed by their output paths.
+
+    >>> graph = RasterGraph()
+    >>> graph.defer(path, LazyRaster(func, inputs, inputs[0], 'float32'),
+    ...             create_raster)
+    >>> raster = graph.get(path)    # in the next tool
+    >>> graph.materialize()         # after the last tool
+    >>> graph.close()
+    """
+
+    def __init__(self):
+        # {key: [path, raster, create, consumed]}
+        self.nodes = {}
+        self._order = []
+
+    def _key(self, path):
+        return os.path.normcase(os.path.abspath(str(path)))
+
+    def __contains__(self, path):
+        return self._key(path) in self.nodes
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def defer(self, path, raster, create):
+        '''Adds a deferred raster with output path into the graph. Create is
+        a function create(path, like, pixel_type, nodata) returning an output
+        raster adapter, it is used if the raster needs to be written. The
+        graph takes over the reference of the caller to raster.
+        '''
+        key = self._key(path)
+        if key in self.nodes:
+            self._remove(key)
+        self._order.append(key)
+        raster.path = path
+        self.nodes[key] = [path, raster, create, False]
+
+    def _remove(self, key):
+        raster = self.nodes.pop(key)[1]
+        self._order.remove(key)
+        raster.close()
+
+    def get(self, path):
+        '''Returns the deferred raster for path and marks it consumed, i.e.
+        it will not be written unless asked for by materialize. The caller
+        must close the raster.
+        '''
+        node = self.nodes[self._key(path)]
+        node[3] = True
+        return node[1].acquire()
+
+    def paths(self):
+        '''Returns a list of the paths of all the deferred rasters.'''
+        return [self.nodes[key][0] for key in self._order]
+
+    def pending(self):
+        '''Returns a list of the paths of the deferred rasters that have not
+        been consumed.
+        '''
+        return [self.nodes[key][0] for key in self._order
+                if not self.nodes[key][3]]
+
+    def materialize(self, mem_max=500000000, log=None, paths=None):
+        '''Writes the deferred rasters that have not been consumed, or the
+        ones in paths (consumed or not) if given. The written rasters are
+        removed from the graph. Returns the list of paths written.
+        '''
+        keys = None
+        if paths is not None:
+            keys = set([self._key(path) for path in paths])
+        written = []
+        for key in self._order[:]:
+            path, raster, create, consumed = self.nodes[key]
+            if keys is not None:
+                if key not in keys:
+                    continue
+            elif consumed:
+                continue
+            if log:
+                log.info('Writing %s' % path)
+            output = create(path, like=raster, pixel_type=raster.pixel_type,
+                            nodata=raster.nodata)
+            engine = BlockEngine([raster], output, mem_max, work_copies=0,
+                                 log=log)
+            engine.run(lambda array: array)
+            output.close()
+            self._remove(key)
+            written.append(path)
+        return written
+
+    def close(self):
+        '''Removes all the rasters from the graph without writing them.'''
+        for key in self._order[:]:
+            self._remove(key)
@@ -0,0 +1,201 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Block kernels for the BlockEngine. Kernels are plain NumPy functions operating
+on the arrays of a single block, NoData handling is done with boolean masks.
+"""
+
+import numpy as np
+
+def data_mask(array, nodata):
+    '''Returns a boolean array that is True where array has data.'''
+    if nodata is None:
+        return np.ones(array.shape, dtype=bool)
+    return array != nodata
+
+def sigmoidal(x, asym=1.0, xmid=None, xmod=0, scale=1.0):
+    '''Logistic (sigmoidal) function of x. If xmid is not given, the median of
+    x is used.
+    '''
+    if xmid is None:
+        xmid = np.median(x)
+    xmid = xmid + xmod
+    with np.errstate(over='ignore'):
+        return asym / (1 + np.exp((xmid - x) / scale))
+
+def ra_sigmoidal(array1, array2, nodata1, nodata2, out_nodata, asym=1.0,
+                 xmid=0.0, lxmod=0.0, rxmod=0.0, lscale=1.0, rscale=1.0,
+                 pixel_type='float32'):
+    '''Transforms array1 with an asymmetric sigmoidal function and multiplies
+    the result with array2. Values of array1 up to xmid are transformed using
+    asymptote asym, xmid + lxmod and lscale, values above xmid using asymptote
+    1.0, xmid + rxmod and rscale. Result has out_nodata wherever either of the
+    inputs has NoData.
+    '''
+    mask = data_mask(array1, nodata1) & data_mask(array2, nodata2)
+
+    out = np.empty(array1.shape, dtype=pixel_type)
+    out.fill(out_nodata)
+
+    x = array1[mask].astype(np.float64)
+    left = x <= xmid
+    trans = np.empty(x.shape, dtype=np.float64)
+    trans[left] = sigmoidal(x[left], asym=asym, xmid=xmid + lxmod,
+                            scale=lscale)
+    right = ~left
+    trans[right] = sigmoidal(x[right], xmid=xmid + rxmod, scale=rscale)
+    trans *= array2[mask]
+
+    out[mask] = trans
+    return out
+
+# Operators for group_reduce
+REDUCE_OPERATORS = {'SUM': np.add,
+                    'SUBTRACTION': np.subtract,
+                    'MULTIPLICATION': np.multiply,
+                    'DIVISION': np.divide}
+
+def set_null_nonpositive(array, nodata):
+    '''Sets the cells of array that are zero or negative to nodata in place
+    (like SetNull with "VALUE <= 0" in ArcGIS). Returns array.
+    '''
+    array[array <= 0] = nodata
+    return array
+
+def class_split(reference, values, classes, ref_nodata, value_nodata,
+                out_nodata):
+    '''Splits values into one array per class in (sorted) classes. Each
+    output array holds the values where the reference array equals the class
+    and out_nodata elsewhere. Cells are partitioned into the classes with a
+    single sort instead of comparing the reference with every class.
+    '''
+    classes = np.asarray(classes)
+    nclasses = len(classes)
+    if nclasses == 0:
+        return []
+    reference = reference.ravel()
+    values_flat = values.ravel()
+
+    # Class index of each cell, nclasses for cells not in any of the classes
+    index = np.searchsorted(classes, reference)
+    index[index == nclasses] = 0
+    member = (classes[index] == reference) & data_mask(values_flat,
+                                                       value_nodata)
+    if ref_nodata is not None:
+        member &= reference != ref_nodata
+    index[~member] = nclasses
+
+    order = np.argsort(index, kind='mergesort')
+    bounds = np.concatenate(([0], np.cumsum(np.bincount(index,
+                                                minlength=nclasses + 1))))
+    outs = []
+    for i in xrange(nclasses):
+        out = np.empty(values.shape, dtype=values.dtype)
+        out.fill(out_nodata)
+        cells = order[bounds[i]:bounds[i + 1]]
+        out.flat[cells] = values_flat[cells]
+        outs.append(out)
+    return outs
+
+# Methods for aggregate
+AGGREGATE_METHODS = ['SUM', 'MEAN', 'MIN', 'MAX', 'MEDIAN']
+
+def aggregate_pixel_type(pixel_type, method):
+    '''Returns the pixel type of an aggregate of a raster with pixel_type.
+    MIN and MAX keep the pixel type, integer SUMs are 32 bit integers and
+    integer MEANs and MEDIANs 32 bit floats.
+    '''
+    if np.dtype(pixel_type).kind == 'f' or method in ['MIN', 'MAX']:
+        return pixel_type
+    elif method == 'SUM':
+        return 'int32'
+    else:
+        return 'float32'
+
+def aggregate_state(values, counts, factor, method='SUM'):
+    '''Aggregates values into factor x factor cells. Counts holds the number of
+    source cells with data behind each value, cells with zero count have no
+    data. Returns a tuple (values, counts) for the aggregate cells that can be
+    aggregated further with a larger factor, except for MEDIAN which can only
+    be computed from source cells (counts of 0 or 1). For MEAN the values are
+    sums, see aggregate_result. Partial cells at the right and bottom edges
+    are included.
+    '''
+    if method not in AGGREGATE_METHODS:
+        raise ValueError('Unknown aggregation method: %s' % method)
+
+    nrows, ncols = values.shape
+    rows = -(-nrows // factor)
+    cols = -(-ncols // factor)
+
+    if method == 'MIN':
+        fill = np.inf
+    elif method == 'MAX':
+        fill = -np.inf
+    elif method == 'MEDIAN':
+        fill = np.nan
+    else:
+        fill = 0
+
+    # Pad to full aggregate cells, padding has no data
+    has_data = counts > 0
+    data = np.empty((rows * factor, cols * factor), dtype=np.float64)
+    data.fill(fill)
+    data[:nrows, :ncols][has_data] = values[has_data]
+    weights = np.zeros(data.shape, dtype=np.int64)
+    weights[:nrows, :ncols] = counts
+
+    counts = weights.reshape(rows, factor, cols, factor).sum(axis=3).sum(axis=1)
+    blocks = data.reshape(rows, factor, cols, factor)
+
+    if method in ['SUM', 'MEAN']:
+        values = blocks.sum(axis=3).sum(axis=1)
+    elif method == 'MIN':
+        values = blocks.min(axis=3).min(axis=1)
+    elif method == 'MAX':
+        values = blocks.max(axis=3).max(axis=1)
+    else:
+        # NaNs (no data) are sorted last, the median is taken from the
+        # count first values
+        cells = blocks.transpose(0, 2, 1, 3).reshape(rows, cols,
+                                                     factor * factor)
+        cells = np.sort(cells, axis=2)
+        lower = np.maximum((counts - 1) // 2, 0)
+        upper = np.minimum(counts // 2, factor * factor - 1)
+        i, j = np.indices(counts.shape)
+        values = (cells[i, j, lower] + cells[i, j, upper]) / 2.0
+    return values, counts
+
+def aggregate_result(values, counts, method, out_nodata=None,
+                     pixel_type='float32'):
+    '''Converts the values and counts from aggregate_state into the final
+    aggregate. Result has out_nodata (or 0 if out_nodata is None) where count
+    is zero.
+    '''
+    empty = counts == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if method == 'MEAN':
+            result = values / counts
+        else:
+            result = values.copy()
+    result[empty] = 0
+    result = result.astype(pixel_type)
+    if out_nodata is not None:
+        result[empty] = out_nodata
+    return result
+
+def aggregate(array, factor, method='SUM', nodata=None, out_nodata=None,
+              pixel_type=None):
+    '''Aggregates array into factor x factor cells with SUM, MEAN, MIN, MAX or
+    MEDIAN. Only cells with data are used and partial cells at the right and
+    bottom edges are included (like "EXPAND" and "DATA" in ArcGIS Aggregate).
+    Returns a tuple (aggregate, count) where count holds the number of cells
+    with data in each aggregate cell. Aggregate has out_nodata where count is
+    zero.
+    '''
+    if pixel_type is None:
+        pixel_type = aggregate_pixel_type(str(array.dtype), method)
+    values, counts = aggregate_state(array, data_mask(array, nodata), factor,
+                                     method)
+    return aggregate_result(values, counts, method, out_nodata,
+                            pixel_type), counts
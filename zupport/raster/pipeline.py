@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Threaded version of the BlockEngine. Reading, computing and writing blocks
+overlap: a reader thread prefetches input blocks, a pool of worker threads runs
+the block function (NumPy releases the GIL for most of the work) and a writer
+thread writes the results. Queues between the stages are bounded so only a few
+blocks are in memory at any time.
+"""
+
+import sys
+import threading
+from Queue import Queue, Empty, Full
+
+from core import BlockEngine
+
+# Marks the end of the blocks in the queues
+_STOP = object()
+
+class BlockPipeline(BlockEngine):
+    """Runs a block function like BlockEngine, but with separate reader,
+    worker and writer threads. Each input and output raster is only accessed
+    from a single thread. At most prefetch blocks wait for workers and
+    prefetch blocks wait for the writer, the block size is chosen so that
+    all of the blocks in flight fit into mem_max bytes.
+    """
+
+    def __init__(self, inputs, output, mem_max=500000000, work_copies=4,
+                 log=None, workers=2, prefetch=2):
+        BlockEngine.__init__(self, inputs, output, mem_max, work_copies, log)
+        self.workers = max(1, workers)
+        self.prefetch = max(1, prefetch)
+        self._failed = threading.Event()
+        self._error = None
+
+    @property
+    def in_flight(self):
+        return 2 * self.prefetch + self.workers
+
+    def _fail(self):
+        # Only the first error is reraised
+        if self._error is None:
+            self._error = sys.exc_info()
+        self._failed.set()
+
+    def _put(self, queue, item):
+        while not self._failed.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _get(self, queue):
+        while not self._failed.is_set():
+            try:
+                return queue.get(timeout=0.1)
+            except Empty:
+                pass
+        return _STOP
+
+    def _read(self, windows, in_queue):
+        try:
+            for window in windows:
+                arrays = [raster.read_window(window) for raster in self.inputs]
+                if not self._put(in_queue, (window, arrays)):
+                    return
+            for i in range(self.workers):
+                self._put(in_queue, _STOP)
+        except:
+            self._fail()
+
+    def _work(self, func, in_queue, out_queue):
+        try:
+            while True:
+                item = self._get(in_queue)
+                if item is _STOP:
+                    self._put(out_queue, _STOP)
+                    return
+                window, arrays = item
+                if not self._put(out_queue, (window, func(*arrays))):
+                    return
+        except:
+            self._fail()
+
+    def _write(self, out_queue, counter):
+        try:
+            running = self.workers
+            while running:
+                item = self._get(out_queue)
+                if item is _STOP:
+                    if self._failed.is_set():
+                        return
+                    running -= 1
+                    continue
+                window, array = item
+                self.write(window, array)
+                counter.append(window)
+        except:
+            self._fail()
+
+    def run(self, func):
+        '''Applies func to every block of the input rasters and writes the
+        result into the output raster. Returns the number of blocks processed.
+        Exceptions raised in any of the threads are reraised.
+        '''
+        block = self.block
+        if self.log:
+            self.log.debug('Processing %s x %s raster in blocks of %s x %s '
+                           'with %s workers',
+                           *(self.shape + block + (self.workers,)))
+        self._failed.clear()
+        self._error = None
+        in_queue = Queue(self.prefetch)
+        out_queue = Queue(self.prefetch)
+        written = []
+
+        threads = [threading.Thread(target=self._read,
+                                    args=(self.windows(), in_queue))]
+        threads += [threading.Thread(target=self._work,
+                                     args=(func, in_queue, out_queue))
+                    for i in range(self.workers)]
+        threads.append(threading.Thread(target=self._write,
+                                        args=(out_queue, written)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error[0], error[1], error[2]
+
+        if self.log:
+            self.log.debug('Processed %s blocks', len(written))
+        return len(written)
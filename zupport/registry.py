@@ -1,50 +1,153 @@
 #!/usr/bin/python
 # coding=utf-8
+"""
+Registry of the tools provided by plugins. Utilities are registered with
+zope.component under 'plugin::name', and kept in indices by name and by
+plugin, so lookups do not need to go through all the registered utilities.
+The indices are updated whenever a utility is provided or removed. Context
+arguments are accepted for compatibility with zope.component, lookups only
+cover the global registry.
+"""
 
 from zope import component
 
-from zupport.interfaces import ITool
-    
+# Registered utilities {interface: {name: (plugin, utility)}}
+_utilities = {}
+# Names of the registered and deferred utilities of each plugin,
+# {interface: {plugin: set(names)}}
+_plugins = {}
+# Utilities listed (e.g. in the plugin manifest) but not created yet,
+# {interface: {name: (plugin, loader)}}. A loader creates and registers the
+# utility when it is first requested.
+_deferred = {}
+# Factories creating new instances of the utilities,
+# {interface: {name: (plugin, factory)}}
+_factories = {}
+
+def _index_name(interface, name, plugin):
+    _plugins.setdefault(interface, {}).setdefault(plugin, set()).add(name)
+
+def _unindex_name(interface, name, plugin):
+    names = _plugins.get(interface, {}).get(plugin)
+    if names is not None:
+        names.discard(name)
+        if not names:
+            del _plugins[interface][plugin]
+
+def _resolve(interface, providedby=None, name=None):
+    deferred = _deferred.get(interface)
+    if not deferred:
+        return
+    if name is not None:
+        names = [name]
+    elif providedby:
+        names = list(_plugins.get(interface, {}).get(providedby, []))
+    else:
+        names = deferred.keys()
+    for name in names:
+        entry = deferred.get(name)
+        if entry is None or (providedby and entry[0] != providedby):
+            continue
+        del deferred[name]
+        entry[1]()
+        if name not in _utilities.get(interface, {}):
+            # Loading failed, the utility is not available
+            _unindex_name(interface, name, entry[0])
+
+def provideFactory(factory, provides=None, name=u'', providedby=u''):
+    """Registers a factory, a callable returning a new instance of the
+    utility provided under name.
+    """
+    _factories.setdefault(provides, {})[name] = (providedby, factory)
+
+def queryFactory(interface, name='', default=None):
+    """Returns a tuple (plugin, factory) for the utility provided under name
+    or (None, default) if there is no factory for it.
+    """
+    return _factories.get(interface, {}).get(name, (None, default))
+
+def provideDeferredUtility(loader, provides=None, name=u'', providedby=u''):
+    """Registers a utility that is created by calling loader when it is
+    first requested. Loader must register the utility with provideUtility.
+    """
+    _deferred.setdefault(provides, {})[name] = (providedby, loader)
+    _index_name(provides, name, providedby)
+
+def getNamesFor(interface, providedby=None, context=None):
+    """Returns a dictionary {name: plugin} of the registered and deferred
+    utilities without creating the deferred ones.
+    """
+    if providedby:
+        return dict([(name, providedby) for name in
+                     _plugins.get(interface, {}).get(providedby, [])])
+    names = {}
+    for plugin, plugin_names in _plugins.get(interface, {}).iteritems():
+        for name in plugin_names:
+            names[name] = plugin
+    return names
+
+def getPlugins(interface):
+    """Returns the names of the plugins providing utilities."""
+    return _plugins.get(interface, {}).keys()
+
 def getUtilitiesFor(interface, providedby=None, context=None):
-    utilities = component.getUtilitiesFor(interface, context)
+    _resolve(interface, providedby)
+    utilities = _utilities.get(interface, {})
     if providedby:
-        new_utilities = []
-        for name, value in utilities:
-            plugin, name = _break_plugin_name(name)
-            if plugin == providedby:
-                new_utilities.append((name, value))
-        return new_utilities
+        return [(name, utilities[name][1]) for name in
+                _plugins.get(interface, {}).get(providedby, [])
+                if name in utilities]
     else:
-        return utilities
-    
-def getUtilitiesForBy(interface, context=None):
-    utilities = component.getUtilitiesFor(interface, context)
+        return [(_create_plugin_name(name, plugin), utility) for name,
+                (plugin, utility) in utilities.iteritems()]
 
-    new_utilities = {}
-    for name, value in utilities:
-        plugin, name = _break_plugin_name(name)
-        new_utilities[name] = (plugin, value)
-    return new_utilities
+def getUtilitiesForBy(interface, context=None):
+    _resolve(interface)
+    return dict(_utilities.get(interface, {}))
 
 def provideUtility(component_, provides=None, name=u'', providedby=u''):
-    name = _create_plugin_name(name, providedby)
-    component.provideUtility(component_, provides, name)
+    component.provideUtility(component_, provides,
+                             _create_plugin_name(name, providedby))
+    _utilities.setdefault(provides, {})[name] = (providedby, component_)
+    _index_name(provides, name, providedby)
+
+def unprovideUtility(provides=None, name=u'', providedby=u''):
+    """Removes a utility (registered or deferred) and its factory. Returns
+    True if something was removed.
+    """
+    removed = False
+    entry = _utilities.get(provides, {}).get(name)
+    if entry is not None and entry[0] == providedby:
+        del _utilities[provides][name]
+        component.getGlobalSiteManager().unregisterUtility(
+                        entry[1], provides, _create_plugin_name(name,
+                                                                providedby))
+        removed = True
+    for index in (_deferred, _factories):
+        entry = index.get(provides, {}).get(name)
+        if entry is not None and entry[0] == providedby:
+            del index[provides][name]
+            removed = True
+    _unindex_name(provides, name, providedby)
+    return removed
+
+def unprovidePlugin(provides, providedby):
+    """Removes all the utilities of a plugin."""
+    for name in list(_plugins.get(provides, {}).get(providedby, [])):
+        unprovideUtility(provides, name, providedby)
 
 def queryUtility(interface, name='', default=None, context=None):
-    utilities = getUtilitiesForBy(ITool)
-    if name in utilities.keys():
-        utility = utilities[name]
-    else:
-        utility = (None, None)
-    return utility
+    # Only the requested utility is created if it was deferred
+    _resolve(interface, name=name)
+    return _utilities.get(interface, {}).get(name, (None, default))
 
 def _create_plugin_name(name, plugin):
-    if plugin != '':
+    if plugin:
         return u'%s::%s' % (plugin, name)
+    return name
 
 def _break_plugin_name(name):
     if '::' in name:
         return name.split('::')
     else:
-        return (name, None)
-    
\ No newline at end of file
+        return (None, name)
@@ -0,0 +1,266 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Parallel job scheduler. Jobs are arranged into a dependency graph (DAG) based
+on their predesessor / successor links and the input and output paths they
+declare (Job.inputs and Job.outputs). Jobs whose dependencies have finished are
+run concurrently in a process pool. Every job gets its own tool instance
+created from the tool definition, so jobs do not share parameters through the
+tool in the registry.
+"""
+
+import os
+import time
+from multiprocessing import Pool, Queue
+
+from zupport import registry
+from zupport.core import finish_queues
+from zupport.interfaces import ITool
+from zupport.zlogging import (ArcMessageHandler, LogListener, Logger,
+                              configure_worker, set_log_context)
+
+def create_tool(service):
+    """Returns a new instance of the tool providing service. The instance has
+    its own parameters read from the tool definition file.
+    """
+    plugin_name, factory = registry.queryFactory(ITool, service)
+    if factory is None:
+        raise ValueError('Service <%s> not available' % service)
+    return factory()
+
+def _init_worker(log_queue=None):
+    # Log records are written by the listener in the main process
+    if log_queue is not None:
+        configure_worker(log_queue)
+    # Plugins (and the tools in the registry) are loaded once per process
+    from zupport.core import Manager
+    Manager()
+
+def run_isolated(index, service, batch, args, kwargs, queues=None):
+    """Runs service with a new tool instance. Returns a tuple (index, result,
+    elapsed time in seconds, error message or None). The post-processing
+    queues of the tool are added into queues if given, otherwise they are 
+    finished with the job.
+    """
+    start = time.time()
+    set_log_context(job='%s %s' % (index, service))
+    try:
+        tool = create_tool(service)
+        tool.update((not batch), False, *args, **kwargs)
+        finish = queues is None
+        if finish:
+            queues = {}
+        tool.post_queues = queues
+        result = None
+        try:
+            if tool.ready:
+                result = tool.run()
+        finally:
+            if finish:
+                finish_queues(queues, getattr(tool, 'logger', None))
+        return index, result, time.time() - start, None
+    except Exception, e:
+        return index, None, time.time() - start, '%s: %s' % (
+                                                    e.__class__.__name__, e)
+    finally:
+        set_log_context(job=None)
+
+class JobScheduler(object):
+    """Runs a list of jobs concurrently according to their dependencies.
+
+    >>> scheduler = JobScheduler(manager.jobqueue, processes=4)
+    >>> report = scheduler.run()
+    >>> report['critical_path']
+
+    If a geoprocessor gp is given (e.g. zupport.plugins.zarcgis.utilities.
+    shared_geoprocessor()), the log records of the worker processes are also
+    added to the ArcGIS geoprocessing messages. Without it, the geoprocessor
+    of logger is used if logger is an ArcLogger with gui on.
+    """
+
+    def __init__(self, jobs, processes=None, logger=None, manifest=None,
+                 gp=None):
+        self.jobs = list(jobs)
+        self.processes = processes
+        self.gp = gp
+        # Jobs up to date in the manifest (zupport.manifest.JobManifest) are
+        # skipped
+        self.manifest = manifest
+        if logger is None:
+            logger = Logger('Zupport.JobScheduler')
+        self.logger = logger
+        self.dependencies = self.build_graph()
+
+    def _key(self, path):
+        return os.path.normcase(os.path.abspath(str(path)))
+
+    def build_graph(self):
+        """Returns a list holding the set of indices of the jobs each job
+        depends on. Raises ValueError if the dependencies have a cycle.
+        """
+        index = dict([(id(job), i) for i, job in enumerate(self.jobs)])
+        producers = {}
+        for i, job in enumerate(self.jobs):
+            for path in getattr(job, 'outputs', []):
+                producers[self._key(path)] = i
+
+        dependencies = []
+        for i, job in enumerate(self.jobs):
+            depends = set()
+            if job.predesessor is not None and id(job.predesessor) in index:
+                depends.add(index[id(job.predesessor)])
+            for path in getattr(job, 'inputs', []):
+                producer = producers.get(self._key(path))
+                if producer is not None and producer != i:
+                    depends.add(producer)
+            dependencies.append(depends)
+        for i, job in enumerate(self.jobs):
+            if job.successor is not None and id(job.successor) in index:
+                dependencies[index[id(job.successor)]].add(i)
+
+        # Check for cycles by taking away jobs without dependencies
+        remaining = dict([(i, set(depends)) for i, depends in
+                          enumerate(dependencies)])
+        while remaining:
+            free = [i for i, depends in remaining.iteritems() if not depends]
+            if not free:
+                raise ValueError('Job dependencies have a cycle: %s' %
+                                 ', '.join([self.jobs[i].service for i in
+                                            remaining]))
+            for i in free:
+                del remaining[i]
+            for depends in remaining.itervalues():
+                depends.difference_update(free)
+        return dependencies
+
+    def _spec(self, i):
+        job = self.jobs[i]
+        return (i, job.service, job.batch, job.args, job.kwargs)
+
+    def run(self):
+        """Runs the jobs and returns a report dictionary with keys 'jobs' (a
+        list of dictionaries with service, result, elapsed and error for each
+        job), 'wall_time' and 'critical_path' (the longest chain of dependent
+        jobs measured in job wall times).
+
+        Jobs run in this process (processes is 1) share the post-processing
+        queues of their tools, which are finished after the last job. In 
+        worker processes the queues are finished with each job.
+        """
+        njobs = len(self.jobs)
+        queues = {}
+        done = {}
+        failed = set()
+        waiting = set(range(njobs))
+        running = {}
+        started = {}
+        start = time.time()
+
+        pool = None
+        listener = None
+        if self.processes is None or self.processes > 1:
+            # Workers send their log records to a single listener
+            log_queue = Queue()
+            handlers = []
+            gp = self.gp
+            if gp is None and self.logger.gui:
+                gp = getattr(self.logger, 'gp', None)
+            if gp is not None:
+                handlers.append(ArcMessageHandler(gp))
+            listener = LogListener(log_queue, handlers)
+            listener.start()
+            pool = Pool(self.processes, _init_worker, (log_queue,))
+        try:
+            while waiting or running:
+                # Jobs depending on failed jobs are not run
+                for i in sorted(waiting):
+                    if self.dependencies[i] & failed:
+                        self.logger.warning('Skipping job %s: a job it '
+                                            'depends on failed' %
+                                            self.jobs[i].service)
+                        waiting.discard(i)
+                        failed.add(i)
+                        done[i] = (i, None, 0.0, 'Dependency failed')
+
+                ready = sorted([i for i in waiting if
+                                self.dependencies[i].issubset(done)])
+                for i in ready:
+                    waiting.discard(i)
+                    if (self.manifest is not None and
+                        self.manifest.is_current(self.jobs[i])):
+                        self.logger.info('Skipping job %s, inputs and outputs '
+                                         'unchanged' % self.jobs[i].service)
+                        done[i] = (i, None, 0.0, None)
+                        continue
+                    self.logger.debug('Starting job %s' % self.jobs[i].service)
+                    started[i] = time.time()
+                    if pool is None:
+                        running[i] = run_isolated(*self._spec(i),
+                                                  queues=queues)
+                    else:
+                        running[i] = pool.apply_async(run_isolated,
+                                                      self._spec(i))
+
+                finished = []
+                for i, result in running.items():
+                    if pool is None:
+                        finished.append(result)
+                    elif result.ready():
+                        try:
+                            finished.append(result.get())
+                        except Exception, e:
+                            # E.g. the job could not be sent to the workers
+                            finished.append((i, None, 0.0, '%s: %s' %
+                                             (e.__class__.__name__, e)))
+                if running and not finished:
+                    time.sleep(0.05)
+
+                for i, value, elapsed, error in finished:
+                    del running[i]
+                    done[i] = (i, value, elapsed, error)
+                    if error is not None:
+                        failed.add(i)
+                        self.logger.error('Job %s failed after %.1f s: %s' %
+                                          (self.jobs[i].service, elapsed,
+                                           error))
+                    else:
+                        self.logger.info('Finished job %s in %.1f s' %
+                                         (self.jobs[i].service, elapsed))
+                        if self.manifest is not None:
+                            self.manifest.record(self.jobs[i],
+                                                 since=started[i])
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if listener is not None:
+                listener.stop()
+            finish_queues(queues, self.logger)
+
+        # Critical path: the longest chain of dependent jobs
+        path_time = {}
+        for i in self.order():
+            before = [path_time[j] for j in self.dependencies[i]]
+            path_time[i] = done[i][2] + max(before + [0.0])
+        critical_path = max(path_time.values() + [0.0])
+
+        wall_time = time.time() - start
+        self.logger.info('Ran %s jobs in %.1f s, critical path %.1f s' %
+                         (njobs, wall_time, critical_path))
+        return {'jobs': [{'service': self.jobs[i].service,
+                          'result': done[i][1],
+                          'elapsed': done[i][2],
+                          'error': done[i][3]} for i in range(njobs)],
+                'wall_time': wall_time,
+                'critical_path': critical_path}
+
+    def order(self):
+        """Returns the job indices in a dependency respecting order."""
+        order = []
+        placed = set()
+        while len(order) < len(self.jobs):
+            for i in range(len(self.jobs)):
+                if i not in placed and self.dependencies[i].issubset(placed):
+                    order.append(i)
+                    placed.add(i)
+        return order
@@ -0,0 +1,200 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Compiled parameter schemas. A tool definition file (.yaml) is read once into
+a ParameterSchema holding the parameter definitions, a name to index map and
+a coercer for each parameter. Coercers convert string values (e.g. from the
+command line) to the type of the parameter, given by the optional type key
+of the definition (see COERCERS) or else the type of the default value.
+
+Schemas are kept in memory for the process and pickled into the user cache
+folder (USER_CACHE_DIR/schemas), keyed by the path of the definition file and
+validated against its modification time and size. The YAML is parsed only
+when the definition file has changed, with the LibYAML based loader if it is
+available.
+"""
+
+import copy
+import cPickle
+import os
+
+import yaml
+
+from zupport.utilities.cache import cache_dir, cache_key, replace_file
+
+# Use the C loader if PyYAML has been built with LibYAML
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Values that mean "not given" and are never coerced ('#' is used by ArcGIS)
+EMPTY_VALUES = ['', '#']
+
+TRUE_STRINGS = ['true', 'yes', '1']
+FALSE_STRINGS = ['false', 'no', '0']
+
+# Compiled schemas of this process {path: (stat, schema)}
+_schemas = {}
+
+def _empty(value):
+    return value is None or (isinstance(value, basestring) and
+                             value.strip() in EMPTY_VALUES)
+
+def _to_bool(value):
+    if isinstance(value, basestring) and not _empty(value):
+        lower = value.strip().lower()
+        if lower in TRUE_STRINGS:
+            return True
+        if lower in FALSE_STRINGS:
+            return False
+        raise ValueError('Not a boolean value: %s' % value)
+    return value
+
+def _to_int(value):
+    if isinstance(value, basestring) and not _empty(value):
+        return int(value)
+    return value
+
+def _to_float(value):
+    if isinstance(value, basestring) and not _empty(value):
+        return float(value)
+    return value
+
+def _as_is(value):
+    return value
+
+# Coercers for the type key of a parameter definition
+COERCERS = {'boolean': _to_bool,
+            'integer': _to_int,
+            'float': _to_float,
+            'string': _as_is}
+
+def coercer(default, type=None):
+    '''Returns a function coercing values of a parameter of type (see
+    COERCERS), or if type is None, of the type of the default value. Only 
+    strings are coerced, other values are returned as is.
+    '''
+    if type is not None:
+        if type not in COERCERS:
+            raise ValueError('Unknown parameter type: %s' % type)
+        return COERCERS[type]
+    # bool is a subclass of int, check it first
+    if isinstance(default, bool):
+        return _to_bool
+    if isinstance(default, (int, long)):
+        return _to_int
+    if isinstance(default, float):
+        return _to_float
+    return _as_is
+
+class ParameterSchema(object):
+    """Parameter definitions of a tool. Definitions are dictionaries with
+    keys name, value (the default), required, tip and optionally type. The 
+    schema is shared, it must not be modified.
+    """
+
+    def __init__(self, name, definitions):
+        self.name = name
+        self.definitions = definitions
+        self.names = [definition['name'] for definition in definitions]
+        self.index = dict([(name, i) for i, name in enumerate(self.names)])
+        self.coercers = [coercer(definition['value'], definition.get('type'))
+                         for definition in definitions]
+
+    def __getstate__(self):
+        # Coercers are functions, they are compiled again when unpickled
+        return (self.name, self.definitions)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __len__(self):
+        return len(self.definitions)
+
+    def defaults(self):
+        '''Returns a list of (name, value, required, tip) tuples. Mutable
+        default values are copied.
+        '''
+        defaults = []
+        for definition in self.definitions:
+            value = definition['value']
+            if isinstance(value, (list, dict)):
+                value = copy.deepcopy(value)
+            defaults.append((definition['name'], value,
+                             definition['required'], definition['tip']))
+        return defaults
+
+def compile_schema(path):
+    '''Reads a tool definition file into a ParameterSchema.'''
+    stream = open(path, 'r')
+    try:
+        data = yaml.load(stream, Loader=YAML_LOADER)
+    finally:
+        stream.close()
+    # TODO: hack, there should be a way of comparing template name
+    # (key) and Parameters instance.name
+    name, items = data.items()[0]
+    definitions = []
+    for item in items:
+        try:
+            definitions.append({'name': item['name'],
+                                'value': item['value'],
+                                'required': item.get('required', False),
+                                'tip': item.get('tip', ''),
+                                'type': item.get('type')})
+        except KeyError:
+            raise KeyError('Parameter definitions in %s must have values '
+                           '"name" and "value".' % path)
+    return ParameterSchema(name, definitions)
+
+def _cache_file(path):
+    return os.path.join(cache_dir('schemas'), cache_key(path) + '.pickle')
+
+def _read_cache(path, stat):
+    filename = _cache_file(path)
+    if not os.path.exists(filename):
+        return None
+    try:
+        stream = open(filename, 'rb')
+        try:
+            cached_stat, schema = cPickle.load(stream)
+        finally:
+            stream.close()
+    except Exception:
+        # Unreadable or from an incompatible version, compiled again
+        return None
+    if cached_stat != stat:
+        return None
+    return schema
+
+def _write_cache(path, stat, schema):
+    filename = _cache_file(path)
+    tmp_filename = filename + '.%s.tmp' % os.getpid()
+    try:
+        stream = open(tmp_filename, 'wb')
+        cPickle.dump((stat, schema), stream, cPickle.HIGHEST_PROTOCOL)
+        stream.close()
+        replace_file(tmp_filename, filename)
+    except (IOError, OSError):
+        # The cache is only an optimization
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+def load_schema(path):
+    '''Returns the compiled schema of a tool definition file. The file is
+    parsed only if it has changed since it was last compiled.
+    '''
+    if not path.endswith('.yaml'):
+        path = path + '.yaml'
+    if not os.path.exists(path):
+        raise ValueError('Template path does not exits: %s' % path)
+    path = os.path.abspath(path)
+    stat = (os.path.getmtime(path), os.path.getsize(path))
+
+    entry = _schemas.get(path)
+    if entry is not None and entry[0] == stat:
+        return entry[1]
+    schema = _read_cache(path, stat)
+    if schema is None:
+        schema = compile_schema(path)
+        _write_cache(path, stat, schema)
+    _schemas[path] = (stat, schema)
+    return schema
@@ -4,14 +4,16 @@
 import os 
 import platform
 import sys
+import threading
 from types import BooleanType, FloatType, IntType, ListType, StringType
 
 from guidata.dataset import datatypes, dataitems
 from guidata.qthelpers import get_icon
-from guidata.qt.QtGui import (QAction, QActionGroup, QColor, QMainWindow, QMenu,  
-                              QMessageBox, QTextCursor, QTreeWidgetItem)
-from guidata.qt.QtCore import (QPoint, QSettings, QSize, QStringList, QVariant, 
-                               Slot)
+from guidata.qt.QtGui import (QAction, QActionGroup, QBrush, QColor, QMainWindow,
+                              QMenu, QMessageBox, QTextCharFormat, QTextCursor,
+                              QTreeWidgetItem)
+from guidata.qt.QtCore import (QPoint, QSettings, QSize, QStringList, QTimer,
+                               QVariant, Slot)
 from guidata.qt.QtCore import PYQT_VERSION, QT_VERSION
 
 from zupport.resources.ui_toolloader import Ui_MainWindow
@@ -40,9 +42,12 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                                                   'python.png')))
         self.setupUi(self)
         
-        # Redirect output to GUI's QTextEdit
-        sys.stdout = OutLog(self.outputTextEdit, sys.stdout)
-        sys.stderr = OutLog(self.outputTextEdit, sys.stderr, QColor(255,0,0) )
+        # Redirect output to GUI's QTextEdit, stdout and stderr share the
+        # console so that their output stays in order
+        self.console = OutputConsole(self.outputTextEdit)
+        self._streams = (sys.stdout, sys.stderr)
+        sys.stdout = OutLog(self.console, sys.stdout)
+        sys.stderr = OutLog(self.console, sys.stderr, QColor(255,0,0) )
         
         settings = QSettings()
         size = settings.value("MainWindow/Size",
@@ -103,6 +108,9 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                           QVariant(self.pos()))
         settings.setValue("MainWindow/State",
                           QVariant(self.saveState()))
+        
+        sys.stdout, sys.stderr = self._streams
+        self.console.stop()
     
     def load_tools(self):
         plugins = self.manager.plugins
@@ -197,35 +205,111 @@ class MainWindow(QMainWindow, Ui_MainWindow):
     def _set_debugging(self, toggle):
         self.logger.debugging = toggle
         
-class OutLog:
+class OutputConsole(object):
+    '''Buffered output for a QTextEdit. Written text is collected into a
+    buffer and appended to the edit by a timer every interval milliseconds,
+    so the edit is updated once per interval however much is written.
+    Writing is thread safe, only the timer touches the edit.
+
+    The document keeps at most max_lines lines, older lines are dropped. If
+    more than max_pending characters are written between two updates, the
+    oldest pending text is skipped.
+    '''
+    
+    def __init__(self, edit, interval=100, max_lines=10000,
+                 max_pending=1000000):
+        self.edit = edit
+        self.max_pending = max_pending
+        self.edit.document().setMaximumBlockCount(max_lines)
+        # Pending (text format, text) writes
+        self._pending = []
+        self._size = 0
+        self._skipped = 0
+        self._lock = threading.Lock()
+        self.timer = QTimer(edit)
+        self.timer.timeout.connect(self.flush)
+        self.timer.start(interval)
+
+    def write(self, text, format):
+        '''Adds text written with format (a QTextCharFormat) to the buffer.
+        '''
+        self._lock.acquire()
+        try:
+            self._pending.append((format, text))
+            self._size += len(text)
+            while self._size > self.max_pending and len(self._pending) > 1:
+                size = len(self._pending.pop(0)[1])
+                self._size -= size
+                self._skipped += size
+        finally:
+            self._lock.release()
+
+    def flush(self):
+        '''Appends the pending text to the edit.'''
+        self._lock.acquire()
+        try:
+            pending, skipped = self._pending, self._skipped
+            self._pending, self._size, self._skipped = [], 0, 0
+        finally:
+            self._lock.release()
+        if not pending:
+            return
+        
+        # Follow the output only if the edit is scrolled to the end
+        scrollbar = self.edit.verticalScrollBar()
+        at_end = scrollbar.value() == scrollbar.maximum()
+        cursor = QTextCursor(self.edit.document())
+        cursor.movePosition(QTextCursor.End)
+        cursor.beginEditBlock()
+        if skipped:
+            cursor.insertText('\n[%s characters of output skipped]\n' % 
+                              skipped, QTextCharFormat())
+        # Consecutive writes with the same format are inserted at once
+        texts = []
+        for i, (format, text) in enumerate(pending):
+            texts.append(text)
+            if i + 1 == len(pending) or pending[i + 1][0] is not format:
+                cursor.insertText(''.join(texts), format)
+                texts = []
+        cursor.endEditBlock()
+        if at_end:
+            scrollbar.setValue(scrollbar.maximum())
+
+    def stop(self):
+        '''Stops the timer and appends the pending text.'''
+        self.timer.stop()
+        self.flush()
+
+class OutLog(object):
     def __init__(self, edit, out=None, color=None):
         """(edit, out=None, color=None) -> can write stdout, stderr to a
         QTextEdit.
-        edit = QTextEdit
+        edit = QTextEdit or an OutputConsole shared by several streams
         out = alternate stream ( can be the original sys.stdout )
         color = alternate color (i.e. color stderr a different color)
         Example usage:
         import sys
-        sys.stdout = OutLog( edit, sys.stdout)
-        sys.stderr = OutLog( edit, sys.stderr, QtGui.QColor(255,0,0) )
+        console = OutputConsole(edit)
+        sys.stdout = OutLog( console, sys.stdout)
+        sys.stderr = OutLog( console, sys.stderr, QtGui.QColor(255,0,0) )
         """
-        self.edit = edit
+        if not isinstance(edit, OutputConsole):
+            edit = OutputConsole(edit)
+        self.console = edit
         self.out = out
         self.color = color
+        self.format = QTextCharFormat()
+        if color:
+            self.format.setForeground(QBrush(color))
 
     def write(self, m):
-        if self.color:
-            tc = self.edit.textColor()
-            self.edit.setTextColor(self.color)
-
-        self.edit.moveCursor(QTextCursor.End)
-        self.edit.insertPlainText( m )
-
-        if self.color:
-            self.edit.setTextColor(tc)
-
+        self.console.write(m, self.format)
         if self.out:
             self.out.write(m)
+
+    def flush(self):
+        if self.out:
+            self.out.flush()
         
 #------------------------------------------------------------------------------ 
 # Zupport DataSets
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# coding=utf-8
+"""
+Helpers for keeping derived data in the Zupport user cache folder
+(USER_CACHE_DIR). Cache entries are identified by the path of the source they
+were derived from and validated against the source file fingerprint
+(modification time and size), so a changed source is never served from the
+cache.
+"""
+
+import hashlib
+import os
+import time
+
+from zupport.utilities import USER_CACHE_DIR
+
+def cache_dir(namespace):
+    """Returns the path of a namespace folder in the user cache folder. The
+    folder is created if it does not exist.
+    """
+    path = os.path.join(USER_CACHE_DIR, namespace)
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # Another process may have created the folder in between
+            if not os.path.isdir(path):
+                raise
+    return path
+
+def cache_key(*items):
+    """Returns a hex digest string identifying the given items. Items must
+    have a stable string representation.
+    """
+    return hashlib.sha1('|'.join([str(item) for item in items])).hexdigest()
+
+def file_fingerprint(path):
+    """Returns a dictionary describing the current state of a file. For
+    folders (e.g. file geodatabases) the newest modification time and the
+    total size of the files directly in the folder are used.
+    """
+    path = os.path.abspath(path)
+    if os.path.isdir(path):
+        mtime = os.path.getmtime(path)
+        size = 0
+        for name in os.listdir(path):
+            filepath = os.path.join(path, name)
+            if os.path.isfile(filepath):
+                mtime = max(mtime, os.path.getmtime(filepath))
+                size += os.path.getsize(filepath)
+    else:
+        mtime = os.path.getmtime(path)
+        size = os.path.getsize(path)
+    return {'path': path, 'mtime': mtime, 'size': size}
+
+def sampled_checksum(path, samples=16, sample_size=65536):
+    """Returns a hex digest of samples evenly spaced chunks of sample_size
+    bytes of a file. Much cheaper than hashing a large raster in full, but
+    still catches most changes that keep the size and modification time.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size))
+    stream = open(path, 'rb')
+    try:
+        if size <= samples * sample_size:
+            digest.update(stream.read())
+        else:
+            step = (size - sample_size) // max(samples - 1, 1)
+            for i in xrange(samples):
+                stream.seek(i * step)
+                digest.update(stream.read(sample_size))
+    finally:
+        stream.close()
+    return digest.hexdigest()
+
+# Flags of MoveFileEx
+MOVEFILE_REPLACE_EXISTING = 0x1
+MOVEFILE_WRITE_THROUGH = 0x8
+
+def _move_file_ex(source, target):
+    import ctypes
+    if not ctypes.windll.kernel32.MoveFileExW(unicode(source), unicode(target),
+                                              MOVEFILE_REPLACE_EXISTING |
+                                              MOVEFILE_WRITE_THROUGH):
+        raise ctypes.WinError()
+
+def replace_file(source, target, retries=5, delay=0.1):
+    """Moves source over target in a single step, so a concurrent reader
+    sees either the old or the new target but never a missing one. On POSIX
+    os.rename replaces target atomically. On Windows os.rename fails if target
+    exists, so MoveFileEx is used instead. It fails while another process has
+    target open, the move is then retried retries times delay seconds apart.
+    If the move still fails, source is removed, target is left as it was and
+    OSError is raised. Readers treat a missing or outdated entry as a cache
+    miss.
+    """
+    if os.name != 'nt':
+        os.rename(source, target)
+        return
+    for attempt in xrange(retries):
+        try:
+            _move_file_ex(source, target)
+            return
+        except OSError:
+            if attempt == retries - 1:
+                if os.path.exists(source):
+                    os.remove(source)
+                raise
+            time.sleep(delay)
@@ -27,10 +27,14 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import inspect
+import logging
 import logging.config
 import os
+import sys
+import threading
 import traceback
+import warnings
+from logging import DEBUG, INFO, WARNING, ERROR, CRITICAL
 from types import IntType, BooleanType
 
 from zupport.utilities import (Singleton, LOGGING_INI, USER_DATA_DIR)
@@ -44,29 +48,32 @@ elif os.path.exists(LOGGING_INI):
 else:
     raise IOError('No logging.ini file found')
 
-# TODO: args[0] approach in the following decorators is not safe
+# Messages can be given with arguments the same way as with the logging
+# module, e.g. log.debug('Processing %s', raster). The message is only
+# formatted if it is actually logged, so disabled debug messages in loops cost
+# next to nothing. Use isEnabledFor to guard building expensive arguments.
 
-def addLineNo(logFunction):
-    def wrapper(self, *args, **kwargs):
-        lineno = inspect.currentframe().f_back.f_lineno
-        
-        # HACK: in some cases lineno may be added twice, only have the first
-        if 'line' in args[0]:
-            linemsg = ''
-        else:
-            linemsg = 'line %s: ' % lineno
-        msg = linemsg + str(args[0])
-        logFunction(self, msg)
-    return wrapper
-
-def addStack(logFunction):
-    def wrapper(self, *args, **kwargs):
-        msg = args[0]
-        if self.gui:
-            stackmsg = ''.join(traceback.format_exc())
-            msg += stackmsg
-        logFunction(self, msg)
-    return wrapper
+# In a worker process, all the records are sent to this queue and written by
+# a LogListener in the main process (see configure_worker)
+_worker_queue = None
+# Context of the records of this process, e.g. the job being run
+_context = {'job': None}
+
+# Formats tracebacks before records are sent to the listener
+_exception_formatter = logging.Formatter()
+
+def format_message(msg, args):
+    '''Returns msg formatted with args like logging does. If msg does not
+    match args, they are appended to msg instead of raising an error in the
+    caller.
+    '''
+    msg = str(msg)
+    if args:
+        try:
+            msg = msg % args
+        except (TypeError, ValueError):
+            msg = ' '.join([msg] + [str(arg) for arg in args])
+    return msg
 
 class LoggerManager(Singleton):
     """
@@ -74,10 +81,15 @@ class LoggerManager(Singleton):
     Handles all logging files.
     """
     def init(self):
-        # Set up default log file location
-        logging.config.fileConfig(log_config, defaults={'logdir': USER_DATA_DIR})
+        # Set up default log file location. Worker processes only send their
+        # records to the listener in the main process.
+        if _worker_queue is None:
+            logging.config.fileConfig(log_config,
+                                      defaults={'logdir': USER_DATA_DIR})
         self.logger = logging.getLogger()
         self.__gui = False
+        # Loggers by name, logging.getLogger takes a lock on every call
+        self._loggers = {}
         
     def _get_gui(self):
         return self.__gui
@@ -90,37 +102,48 @@ class LoggerManager(Singleton):
             self.__gui = True
         else:
             self.__gui = False
+
+    def get_logger(self, loggername):
+        logger = self._loggers.get(loggername)
+        if logger is None:
+            logger = logging.getLogger(loggername)
+            self._loggers[loggername] = logger
+        return logger
         
-    def debug(self, loggername, msg):
-        self.logger = logging.getLogger(loggername)
-        self.logger.debug(msg)
+    def debug(self, loggername, msg, *args):
+        self.get_logger(loggername).debug(msg, *args)
 
-    def error(self, loggername, msg):
-        self.logger = logging.getLogger(loggername)
-        self.logger.error(msg)
+    def error(self, loggername, msg, *args):
+        self.get_logger(loggername).error(msg, *args)
         
-    def exception(self, loggername, msg):
-        self.logger = logging.getLogger(loggername)
-        self.logger.exception(msg)
+    def exception(self, loggername, msg, *args):
+        self.get_logger(loggername).exception(msg, *args)
 
-    def info(self, loggername, msg):
-        self.logger = logging.getLogger(loggername)
-        self.logger.info(msg)
+    def info(self, loggername, msg, *args):
+        self.get_logger(loggername).info(msg, *args)
 
-    def warning(self, loggername, msg):
-        self.logger = logging.getLogger(loggername)
-        self.logger.warning(msg)
+    def warning(self, loggername, msg, *args):
+        self.get_logger(loggername).warning(msg, *args)
         
     _gui = property(_get_gui, _set_gui, None, '')
 
 class Logger(object):
     """
-    Logger object.
+    Logger object. Debug messages are logged only if debugging is True. If
+    line_numbers is True, the line number of the caller is added to debug
+    messages. It is only looked up for messages that are logged.
+
+    Messages can also be added to the result of a parent tool, given as 
+    keyword argument parent. Giving parent as the second positional argument
+    (e.g. log.debug(msg, self)) is deprecated.
     """
-    def __init__(self, loggername="root", debugging=False, parent=None):
+    def __init__(self, loggername="root", debugging=False, parent=None,
+                 line_numbers=True):
         self.lm = LoggerManager() # LoggerManager instance
         self.loggername = loggername # logger name
+        self.logger = self.lm.get_logger(loggername)
         self.__debugging = debugging
+        self.line_numbers = line_numbers
         
         # TODO: strings should be replaced with ints form LOG
         self.levels = {'debug': self.debug, 'info': self.info, 
@@ -152,52 +175,87 @@ class Logger(object):
         else:
             self.lm._gui = False
 
-    # Message severity codes correspond to Python logging module
+    def isEnabledFor(self, level):
+        '''Returns True if messages of level (e.g. DEBUG) are logged.'''
+        if level <= DEBUG and not self.__debugging:
+            return False
+        return self.logger.isEnabledFor(level)
 
-    @addLineNo
-    def debug(self, msg, parent=None):
-        if self.debugging:
-            self.lm.debug(self.loggername, msg)
-            if parent:
-                parent.result.addMessage(10, msg)
+    def _add_line(self, msg):
+        # Frame 2 is the caller of the public logging method
+        if self.line_numbers:
+            return 'line %s: %s' % (sys._getframe(2).f_lineno, msg)
+        return msg
 
-    @addLineNo
-    def error(self, msg, parent=None):
-        self.lm.error(self.loggername, msg)
+    def _split_parent(self, msg, args, kwargs):
+        # Returns (parent, args). The old signature took parent as the second
+        # positional argument, a single argument with a result is still taken
+        # as parent (even if msg has a '%', e.g. '50% done').
+        parent = kwargs.get('parent')
+        if (parent is None and len(args) == 1 and 
+            hasattr(args[0], 'result')):
+            warnings.warn('Give parent to Logger methods as a keyword '
+                          'argument', DeprecationWarning, stacklevel=3)
+            return args[0], ()
+        return parent, args
+
+    def _add_message(self, parent, level, msg, args):
         if parent:
-            parent.result.addMessage(40, msg)
+            parent.result.addMessage(level, format_message(msg, args))
+
+    # Message severity codes correspond to Python logging module
+
+    def debug(self, msg, *args, **kwargs):
+        # Disabled debug messages cost only this check
+        if not self.__debugging:
+            return
+        parent, args = self._split_parent(msg, args, kwargs)
+        msg = self._add_line(msg)
+        self.logger.debug(msg, *args)
+        self._add_message(parent, 10, msg, args)
+
+    def error(self, msg, *args, **kwargs):
+        parent, args = self._split_parent(msg, args, kwargs)
+        self.logger.error(msg, *args)
+        self._add_message(parent, 40, msg, args)
         
-    @addLineNo
-    def exception(self, msg, parent=None):
-        self.lm.exception(self.loggername, msg)
-        if parent:
-            parent.result.addMessage(50, msg)
+    def exception(self, msg, *args, **kwargs):
+        parent, args = self._split_parent(msg, args, kwargs)
+        self.logger.exception(msg, *args)
+        self._add_message(parent, 50, msg, args)
 
-    def info(self, msg, parent=None):
-        self.lm.info(self.loggername, msg)
-        if parent:
-            parent.result.addMessage(20, msg)
+    def info(self, msg, *args, **kwargs):
+        parent, args = self._split_parent(msg, args, kwargs)
+        self.logger.info(msg, *args)
+        self._add_message(parent, 20, msg, args)
 
-    def warning(self, msg, parent=None):
-        self.lm.warning(self.loggername, msg)
-        if parent:
-            parent.result.addMessage(40, msg)
+    def warning(self, msg, *args, **kwargs):
+        parent, args = self._split_parent(msg, args, kwargs)
+        self.logger.warning(msg, *args)
+        self._add_message(parent, 40, msg, args)
         
     debugging = property(get_debugging, set_debugging, None, '')
     gui = property(get_gui, set_gui, None, '')  
         
 class ArcLogger(Logger):
     """
-    ArcLogger object.
+    ArcLogger object. If gui is True, messages are also added to the ArcGIS
+    geoprocessing messages. The geoprocessor is acquired when a message is
+    first added or the progressor is first used, so creating a logger does
+    not import arcpy.
     """
-    def __init__(self, loggername="root", debugging=False):
-        Logger.__init__(self, loggername, debugging)
-        try:
-            from zupport.plugins.zarcgis.utilities import get_geoprocessor
-            self.gp = get_geoprocessor(10)
-            self.__progressor = False
-        except ImportError:
-            raise
+    def __init__(self, loggername="root", debugging=False, line_numbers=True):
+        Logger.__init__(self, loggername, debugging,
+                        line_numbers=line_numbers)
+        self._gp = None
+        self.__progressor = False
+
+    @property
+    def gp(self):
+        if self._gp is None:
+            from zupport.plugins.zarcgis.utilities import shared_geoprocessor
+            self._gp = shared_geoprocessor(10)
+        return self._gp
     
     def setProgressor(self, msg, min=0, max=100, type='step'):
         self.gp.SetProgressor(type, msg, min, max)
@@ -211,30 +269,29 @@ class ArcLogger(Logger):
         self.gp.ResetProgressor()
         self.__progressor = False
     
-    @addLineNo
-    def debug(self, msg):
-        if self.debugging:
-            super(ArcLogger, self).debug(msg)
-            if self.gui:
-                self.gp.AddMessage('DEBUG - %s' % msg)
-
-    @addLineNo
-    def error(self, msg):
-        super(ArcLogger, self).error(msg)
+    def debug(self, msg, *args):
+        if not self.debugging:
+            return
+        msg = self._add_line(msg)
+        self.logger.debug(msg, *args)
+        if self.gui:
+            self.gp.AddMessage('DEBUG - %s' % format_message(msg, args))
+
+    def error(self, msg, *args):
+        self.logger.error(msg, *args)
         if self.gui:
-            self.gp.AddError(msg)
+            self.gp.AddError(format_message(msg, args))
 
-    @addLineNo
-    @addStack
-    def exception(self, msg):
-        super(ArcLogger, self).exception(msg)
+    def exception(self, msg, *args):
+        self.logger.exception(msg, *args)
         if self.gui:
-            self.gp.AddError(msg)
+            self.gp.AddError(format_message(msg, args) +
+                             ''.join(traceback.format_exc()))
 
-    def info(self, msg):
-        super(ArcLogger, self).info(msg)
+    def info(self, msg, *args):
+        self.logger.info(msg, *args)
         if self.gui:
-            self.gp.AddMessage(msg)
+            self.gp.AddMessage(format_message(msg, args))
             
     def progressor(self, msg, log=None):
         if self.__progressor:
@@ -243,11 +300,145 @@ class ArcLogger(Logger):
             if log in self.levels.keys():
                 self.levels[log](msg)
                 
-    def warning(self, msg):
-        super(ArcLogger, self).warning(msg)
+    def warning(self, msg, *args):
+        self.logger.warning(msg, *args)
         if self.gui:
-            self.gp.AddWarning(msg)
+            self.gp.AddWarning(format_message(msg, args))
             
+class ArcMessageHandler(logging.Handler):
+    """
+    Handler adding log records to the ArcGIS geoprocessing messages.
+    """
+    def __init__(self, gp, level=INFO):
+        logging.Handler.__init__(self, level)
+        self.gp = gp
+
+    def emit(self, record):
+        try:
+            msg = self.format(record)
+            if record.levelno >= ERROR:
+                self.gp.AddError(msg)
+            elif record.levelno >= WARNING:
+                self.gp.AddWarning(msg)
+            else:
+                self.gp.AddMessage(msg)
+        except Exception:
+            self.handleError(record)
+
+class QueueHandler(logging.Handler):
+    """
+    Handler sending log records to a multiprocessing queue. The message and
+    the traceback are formatted before sending, as the arguments may not be
+    picklable. Records carry the job of the process (see set_log_context),
+    the process name and id and the creation time are included by logging.
+    Putting a record on the queue does not block.
+    """
+    def __init__(self, queue):
+        logging.Handler.__init__(self)
+        self.queue = queue
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(
+                                                            record.exc_info)
+            record.exc_info = None
+        record.job = _context['job']
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            self.handleError(record)
+
+class LogListener(object):
+    """
+    Writes the log records sent by worker processes (see configure_worker).
+    Records are passed to the loggers of the main process, so they end up in
+    the same files and console (and the GUI) as the records of the main
+    process. Extra handlers, e.g. an ArcMessageHandler, get every record. If
+    tag is True, messages are prefixed with the worker and the job.
+
+    >>> listener = LogListener(queue)
+    >>> listener.start()
+    >>> pool = Pool(4, configure_worker, (queue,))
+    >>> ...
+    >>> listener.stop()
+    """
+    def __init__(self, queue, handlers=(), tag=True):
+        self.queue = queue
+        self.handlers = list(handlers)
+        self.tag = tag
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._monitor,
+                                        name='LogListener')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''Writes the records still in the queue and stops the listener.'''
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def handle(self, record):
+        if self.tag:
+            tags = [record.processName]
+            job = getattr(record, 'job', None)
+            if job is not None:
+                tags.append('job %s' % job)
+            record.msg = '[%s] %s' % (', '.join(tags), record.msg)
+        logger = logging.getLogger(record.name)
+        if logger.isEnabledFor(record.levelno):
+            logger.handle(record)
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def _monitor(self):
+        while True:
+            try:
+                record = self.queue.get()
+            except (EOFError, IOError):
+                break
+            if record is None:
+                break
+            try:
+                self.handle(record)
+            except Exception:
+                traceback.print_exc()
+
+def configure_worker(queue):
+    '''Sets up logging in a worker process so that all the records are sent
+    to queue instead of being written to the log files. Handlers inherited
+    from the main process are removed.
+    '''
+    global _worker_queue
+    _worker_queue = queue
+    loggers = [logging.getLogger()]
+    loggers.extend([logger for logger in
+                    logging.Logger.manager.loggerDict.values()
+                    if isinstance(logger, logging.Logger)])
+    for logger in loggers:
+        for handler in logger.handlers[:]:
+            logger.removeHandler(handler)
+        logger.propagate = True
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(queue))
+    # Records are filtered by the Logger objects and the main process
+    root.setLevel(DEBUG)
+
+def set_log_context(job=None):
+    '''Sets the job the records of this process are tagged with.'''
+    _context['job'] = job
+
 if __name__ == '__main__':
     print globals()['USER_DATA_DIR']
     logger = ArcLogger('root.user')